@@ -4,8 +4,18 @@ Released under Apache 2.0 license as described in the file LICENSE.
 Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
+import atexit
+import os
 from flask import Flask
 
+from solver_pool import SolverPool
+
 app = Flask(__name__)
 
+app.config['N_WORKERS'] = int(os.environ.get('GMB_N_WORKERS', os.cpu_count()))
+app.config['JOB_TIMEOUT'] = float(os.environ.get('GMB_JOB_TIMEOUT', 300))
+
+pool = SolverPool(app.config['N_WORKERS'], app.config['JOB_TIMEOUT'])
+atexit.register(pool.shutdown)
+
 from app import routes
@@ -5,12 +5,11 @@ Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
 from flask import render_template, request, Response, send_file, jsonify
-from app import app
-from io import StringIO, BytesIO
+from app import app, pool
+import json
 import pdb
-import base64
 
-from builder import build
+from solver_pool import FORMATS, JobTimeout, UnknownJob
 from util import DEFAULTS
 
 @app.route('/')
@@ -18,36 +17,71 @@ from util import DEFAULTS
 def index():
     return render_template('index.html')
 
+def form_args(form):
+    jsdata = form['problem_input']
+    lines = str(jsdata).split('\n')
+
+    # Each request gets its own options, since requests are served concurrently
+    args = dict(DEFAULTS)
+    args['lines'] = lines
+    args['n_models'] = int(form['n_models'])
+    args['plot_freq'] = -1
+    args['losses_freq'] = -1
+    args['loss_freq'] = -1
+    args['unnamed_objects'] = (form['plot_unnamed'] == 'true')
+    return args
+
+def form_format(form):
+    # Diagrams are SVG images by default, or JSON coordinates with format=json
+    return form.get('format', 'svg')
+
 @app.route('/solve', methods=['POST'])
 def solve():
     try:
-        jsdata = request.form['problem_input']
-        lines = str(jsdata).split('\n')
-
-        args = DEFAULTS
-        args['lines'] = lines
-        args['n_models'] = int(request.form['n_models'])
-        args['plot_freq'] = -1
-        args['losses_freq'] = -1
-        args['loss_freq'] = -1
-        args['unnamed_objects'] = (request.form['plot_unnamed'] == 'true')
-
-        figs = build(args, show_plot=False, encode_fig=True)
-        urls = list()
-
-        for fig in figs:
-            img = BytesIO()
-            fig.savefig(img, format='png')
-            fig.close()
-            img.seek(0)
-            plot_url = base64.b64encode(img.getvalue()).decode()
-            urls.append(f"data:image/png;base64,{plot_url}")
-
-        return jsonify(srcs=urls)
-        # return f"data:image/png;base64,{plot_url}"
+        fmt = form_format(request.form)
+        diagrams = pool.solve(form_args(request.form), fmt)
 
+        diagrams_key, _ = FORMATS[fmt]
+        return jsonify({diagrams_key: diagrams})
+
+    except JobTimeout as e:
+        return Response(
+            str(e),
+            status=504
+        )
     except Exception as e:
         return Response(
             str(e),
             status=400
         )
+
+
+# Asynchronous version of /solve: submit a job, then poll its status or stream its events
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        job_id = pool.submit(form_args(request.form), form_format(request.form))
+    except Exception as e:
+        return Response(str(e), status=400)
+    return jsonify(id=job_id), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    try:
+        return jsonify(pool.status(job_id))
+    except UnknownJob as e:
+        return Response(str(e), status=404)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    try:
+        events = pool.events(job_id)
+    except UnknownJob as e:
+        return Response(str(e), status=404)
+
+    def stream():
+        for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
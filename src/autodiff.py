@@ -0,0 +1,212 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import collections
+import numpy as np
+
+
+# A small reverse-mode autodiff over the elementwise primitives used by optimizer.py.
+# Operations on Nodes are recorded on a Tape the first time the construction runs. Branches are
+# selected elementwise with `where` (both sides are always recorded), so the tape is static and can
+# be replayed forward and backward for every step of gradient descent.
+
+# bwd(g, out, *args) returns one gradient (or None) per argument, before unbroadcasting
+Op = collections.namedtuple("Op", ["name", "fwd", "bwd"])
+
+
+class Tape:
+    def __init__(self):
+        self.nodes = list()
+        self.leaves = list()
+
+    def var(self, val):
+        leaf = Node(self, None, (), np.asarray(val, dtype=np.float64))
+        self.leaves.append(leaf)
+        return leaf
+
+    def apply(self, op, args):
+        node = Node(self, op, args, op.fwd(*[value(a) for a in args]))
+        self.nodes.append(node)
+        return node
+
+    def forward(self):
+        for node in self.nodes:
+            node.val = node.op.fwd(*[value(a) for a in node.args])
+
+    def backward(self, out, seed):
+        for node in self.nodes:
+            node.grad = None
+        for leaf in self.leaves:
+            leaf.grad = None
+
+        out.grad = seed
+        for node in reversed(self.nodes):
+            if node.grad is None:
+                continue
+            grads = node.op.bwd(node.grad, node.val, *[value(a) for a in node.args])
+            for a, g in zip(node.args, grads):
+                if g is None or not isinstance(a, Node):
+                    continue
+                g = unbroadcast(g, np.shape(a.val))
+                a.grad = g if a.grad is None else a.grad + g
+
+
+class Node:
+    __slots__ = ("tape", "op", "args", "val", "grad")
+
+    # Make numpy defer to our reflected operators instead of building object arrays
+    __array_ufunc__ = None
+
+    def __init__(self, tape, op, args, val):
+        self.tape = tape
+        self.op = op
+        self.args = args
+        self.val = val
+        self.grad = None
+
+    def __add__(self, y):      return apply(ADD, self, y)
+    def __radd__(self, x):     return apply(ADD, x, self)
+    def __sub__(self, y):      return apply(SUB, self, y)
+    def __rsub__(self, x):     return apply(SUB, x, self)
+    def __mul__(self, y):      return apply(MUL, self, y)
+    def __rmul__(self, x):     return apply(MUL, x, self)
+    def __truediv__(self, y):  return apply(DIV, self, y)
+    def __rtruediv__(self, x): return apply(DIV, x, self)
+    def __pow__(self, y):      return apply(POW if isinstance(y, Node) else POW_CONST, self, y)
+    def __rpow__(self, x):     return apply(POW, x, self)
+    def __neg__(self):         return apply(NEG, self)
+    def __lt__(self, y):       return apply(LT, self, y)
+    def __le__(self, y):       return apply(LE, self, y)
+    def __gt__(self, y):       return apply(GT, self, y)
+    def __ge__(self, y):       return apply(GE, self, y)
+
+    def __bool__(self):
+        raise TypeError("Node has no truth value, use where to branch elementwise")
+
+
+def value(x):
+    return x.val if isinstance(x, Node) else x
+
+def evaluate(x):
+    # Replace every Node of a nested structure by its current value
+    if isinstance(x, Node):
+        return x.val
+    elif isinstance(x, dict):
+        return {k: evaluate(v) for k, v in x.items()}
+    elif isinstance(x, tuple) and hasattr(x, "_fields"):
+        return type(x)(*[evaluate(v) for v in x])
+    elif isinstance(x, (list, tuple)):
+        return type(x)(evaluate(v) for v in x)
+    return x
+
+def unbroadcast(g, shape):
+    while np.ndim(g) > len(shape):
+        g = np.sum(g, axis=0)
+    for axis, dim in enumerate(shape):
+        if dim == 1 and np.shape(g)[axis] != 1:
+            g = np.sum(g, axis=axis, keepdims=True)
+    return g
+
+def apply(op, *args):
+    for a in args:
+        if isinstance(a, Node):
+            return a.tape.apply(op, args)
+    # Nothing to differentiate, so fold constants eagerly
+    return op.fwd(*args)
+
+def scale(g, d):
+    # Branches not taken receive a zero gradient, which must stay zero even where d is not finite
+    return np.where(g == 0, 0.0, g * d)
+
+
+#####################
+## Primitives
+####################
+
+ADD = Op("add", np.add, lambda g, out, x, y: (g, g))
+SUB = Op("sub", np.subtract, lambda g, out, x, y: (g, -g))
+MUL = Op("mul", np.multiply, lambda g, out, x, y: (scale(g, y), scale(g, x)))
+DIV = Op("div", np.true_divide, lambda g, out, x, y: (scale(g, 1 / y), scale(g, -out / y)))
+POW = Op("pow", np.power, lambda g, out, x, y: (scale(g, y * x ** (y - 1)), scale(g, out * np.log(x))))
+POW_CONST = Op("pow_const", np.power, lambda g, out, x, y: (scale(g, y * x ** (y - 1)), None))
+NEG = Op("neg", np.negative, lambda g, out, x: (-g,))
+
+SQRT = Op("sqrt", np.sqrt, lambda g, out, x: (scale(g, 0.5 / out),))
+SIN = Op("sin", np.sin, lambda g, out, x: (scale(g, np.cos(x)),))
+COS = Op("cos", np.cos, lambda g, out, x: (scale(g, -np.sin(x)),))
+ASIN = Op("asin", np.arcsin, lambda g, out, x: (scale(g, 1 / np.sqrt(1 - x ** 2)),))
+ACOS = Op("acos", np.arccos, lambda g, out, x: (scale(g, -1 / np.sqrt(1 - x ** 2)),))
+TANH = Op("tanh", np.tanh, lambda g, out, x: (scale(g, 1 - out ** 2),))
+EXP = Op("exp", np.exp, lambda g, out, x: (scale(g, out),))
+SIGMOID = Op("sigmoid", lambda x: 1 / (1 + np.exp(-x)), lambda g, out, x: (scale(g, out * (1 - out)),))
+ABS = Op("abs", np.abs, lambda g, out, x: (g * np.sign(x),))
+ATAN2 = Op("atan2", np.arctan2,
+           lambda g, out, y, x: (scale(g, x / (x ** 2 + y ** 2)), scale(g, -y / (x ** 2 + y ** 2))))
+
+# Ties go to the first argument, as in tensorflow
+MAXIMUM = Op("maximum", np.maximum, lambda g, out, x, y: (np.where(x >= y, g, 0.0), np.where(x >= y, 0.0, g)))
+MINIMUM = Op("minimum", np.minimum, lambda g, out, x, y: (np.where(x <= y, g, 0.0), np.where(x <= y, 0.0, g)))
+WHERE = Op("where", np.where, lambda g, out, c, x, y: (None, np.where(c, g, 0.0), np.where(c, 0.0, g)))
+
+# Not differentiable, but recorded so that predicates are recomputed on replay
+LT = Op("lt", np.less, lambda g, out, x, y: (None, None))
+LE = Op("le", np.less_equal, lambda g, out, x, y: (None, None))
+GT = Op("gt", np.greater, lambda g, out, x, y: (None, None))
+GE = Op("ge", np.greater_equal, lambda g, out, x, y: (None, None))
+EQ = Op("eq", np.equal, lambda g, out, x, y: (None, None))
+OR = Op("or", np.logical_or, lambda g, out, x, y: (None, None))
+AND = Op("and", np.logical_and, lambda g, out, x, y: (None, None))
+SIGN = Op("sign", np.sign, lambda g, out, x: (None,))
+
+def stack(xs):
+    return np.stack(np.broadcast_arrays(*xs), axis=-1)
+
+def unstack(g):
+    return tuple(g[..., i] for i in range(np.shape(g)[-1]))
+
+def select_bwd(select):
+    def bwd(g, out, *xs):
+        onehot = np.zeros(np.shape(stack(xs)))
+        np.put_along_axis(onehot, np.expand_dims(select(stack(xs), axis=-1), -1), 1.0, axis=-1)
+        return unstack(np.expand_dims(g, -1) * onehot)
+    return bwd
+
+# Reductions over a list of (per-candidate) values
+SUM_LIST = Op("sum_list", lambda *xs: np.sum(stack(xs), axis=-1), lambda g, out, *xs: (g,) * len(xs))
+MEAN_LIST = Op("mean_list", lambda *xs: np.mean(stack(xs), axis=-1), lambda g, out, *xs: (g / len(xs),) * len(xs))
+MAX_LIST = Op("max_list", lambda *xs: np.max(stack(xs), axis=-1), select_bwd(np.argmax))
+MIN_LIST = Op("min_list", lambda *xs: np.min(stack(xs), axis=-1), select_bwd(np.argmin))
+
+
+def sqrt(x):           return apply(SQRT, x)
+def sin(x):            return apply(SIN, x)
+def cos(x):            return apply(COS, x)
+def asin(x):           return apply(ASIN, x)
+def acos(x):           return apply(ACOS, x)
+def tanh(x):           return apply(TANH, x)
+def exp(x):            return apply(EXP, x)
+def sigmoid(x):        return apply(SIGMOID, x)
+def abs(x):            return apply(ABS, x)
+def sign(x):           return apply(SIGN, x)
+def atan2(y, x):       return apply(ATAN2, y, x)
+def maximum(x, y):     return apply(MAXIMUM, x, y)
+def minimum(x, y):     return apply(MINIMUM, x, y)
+def lt(x, y):          return apply(LT, x, y)
+def le(x, y):          return apply(LE, x, y)
+def gt(x, y):          return apply(GT, x, y)
+def ge(x, y):          return apply(GE, x, y)
+def eq(x, y):          return apply(EQ, x, y)
+def logical_or(x, y):  return apply(OR, x, y)
+def logical_and(x, y): return apply(AND, x, y)
+def sum_list(xs):      return apply(SUM_LIST, *xs)
+def mean_list(xs):     return apply(MEAN_LIST, *xs)
+def max_list(xs):      return apply(MAX_LIST, *xs)
+def min_list(xs):      return apply(MIN_LIST, *xs)
+
+def where(c, x, y):
+    if not isinstance(c, Node) and np.ndim(c) == 0:
+        return x if c else y
+    return apply(WHERE, c, x, y)
@@ -0,0 +1,252 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from builder import build, BACKENDS
+from util import DEFAULTS
+
+
+# Runs every problem of a corpus a few times with fixed seeds, and records how long each phase took,
+# how many iterations it needed and how well the diagrams it found satisfy their goals.
+#
+#   python benchmark.py run --out results.json --csv results.csv --trials 3 --jobs 8
+#   python benchmark.py diff baseline.json results.json
+#
+# diff exits with status 1 if any problem got slower or is solved less often.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBLEM_DIRS = [os.path.join(ROOT, "problems", d) for d in ["IMO", "misc", "test"]]
+
+PHASES = ["parse", "construct", "solve"]
+
+CSV_FIELDS = ["problem", "trial", "seed", "status", "n_models", "total_time"] + [f"{p}_time" for p in PHASES] + \
+             ["iterations", "iterations_to_model", "final_loss", "max_goal_residual", "error"]
+
+
+def list_problems(dirs):
+    problems = list()
+    for d in dirs:
+        for f in sorted(os.listdir(d)):
+            if f.endswith(".smt2") and os.path.isfile(os.path.join(d, f)):
+                problems.append(os.path.abspath(os.path.join(d, f)))
+    return problems
+
+
+def problem_name(path):
+    return os.path.relpath(path, os.path.join(ROOT, "problems")) if path.startswith(ROOT) else path
+
+
+def run_trial(path, opts, trial):
+    opts = dict(opts)
+    opts.update(problem=path, seed=opts['seed'] + trial, verbosity=-1,
+                plot_freq=-1, loss_freq=-1, losses_freq=-1, progress_freq=1, cache=False)
+
+    phases = dict()
+    # Iterations are counted over all tries, and models record the iteration of their own try.
+    # Each try is counted from its last iteration event, since in_graph only reports the final one,
+    # and tries resumed by halving start where they left off.
+    iterations = {"total": 0, "start": 0, "current": None, "at_model": list()}
+    losses = list()
+    aborts = dict() # reason -> number of tries or candidates abandoned
+
+    def end_try():
+        if iterations["current"] is not None:
+            iterations["total"] += iterations["current"] + 1 - iterations["start"]
+
+    def listener(event, data):
+        if event == "phase":
+            phases[data['name']] = data['seconds']
+        elif event == "try":
+            end_try()
+            iterations["start"] = data.get('start', 0)
+            iterations["current"] = None
+        elif event == "iteration":
+            iterations["current"] = data['iteration']
+            losses.append(data['loss'])
+        elif event == "model":
+            iterations["at_model"].append(iterations["current"] or 0)
+        elif event == "abort":
+            aborts[data['reason']] = aborts.get(data['reason'], 0) + data.get('n_candidates', 1)
+
+    result = {"problem": problem_name(path), "trial": trial, "seed": opts['seed']}
+    start = time.time()
+    try:
+        models = build(opts, show_plot=False, listener=listener)
+        result["status"] = "solved" if len(models) >= opts['n_models'] else "failed"
+        result["n_models"] = len(models)
+        result["error"] = None
+    except Exception as e:
+        models = list()
+        result.update(status="error", n_models=0, error=str(e))
+    result["total_time"] = time.time() - start
+    end_try()
+
+    for phase in PHASES:
+        result[f"{phase}_time"] = phases.get(phase)
+    result["iterations"] = iterations["total"]
+    result["iterations_to_model"] = iterations["at_model"]
+    result["aborts"] = aborts
+    result["final_loss"] = losses[-1] if losses else None
+    result["goal_residuals"] = [{k: float(v) for k, v in m.goals.items()} for m in models]
+    residuals = [v for goals in result["goal_residuals"] for v in goals.values()]
+    result["max_goal_residual"] = max(residuals) if residuals else None
+    return result
+
+
+def summarize(trials):
+    def mean_of(key):
+        vals = [t[key] for t in trials if t[key] is not None]
+        return statistics.mean(vals) if vals else None
+
+    solved = [t for t in trials if t["status"] == "solved"]
+    return {
+        "success_rate": len(solved) / len(trials),
+        "mean_time": mean_of("total_time"),
+        "median_time": statistics.median([t["total_time"] for t in trials]),
+        "mean_solve_time": mean_of("solve_time"),
+        "mean_iterations": mean_of("iterations"),
+        "errors": len([t for t in trials if t["status"] == "error"]),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    opts = dict(DEFAULTS)
+    for assignment in args.set:
+        key, val = assignment.split("=", 1)
+        if key not in DEFAULTS:
+            raise RuntimeError(f"Unknown option {key}")
+        opts[key] = val if isinstance(DEFAULTS[key], str) else json.loads(val)
+    opts['seed'] = args.seed
+
+    if opts['backend'] not in BACKENDS:
+        raise RuntimeError(f"Unknown backend {opts['backend']}, expected one of {', '.join(BACKENDS)}")
+
+    problems = list_problems(args.dirs or PROBLEM_DIRS)
+    tasks = [(path, trial) for path in problems for trial in range(args.trials)]
+
+    results = list()
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        import multiprocessing
+        from builder import init_dir_worker
+
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=args.jobs, mp_context=ctx, initializer=init_dir_worker) as pool:
+            futures = [pool.submit(run_trial, path, opts, trial) for path, trial in tasks]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print_progress(results[-1], len(results), len(tasks))
+    else:
+        for path, trial in tasks:
+            results.append(run_trial(path, opts, trial))
+            print_progress(results[-1], len(results), len(tasks))
+
+    by_problem = dict()
+    for r in sorted(results, key=lambda r: (r["problem"], r["trial"])):
+        by_problem.setdefault(r["problem"], list()).append(r)
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "jobs": args.jobs,
+            "trials": args.trials,
+            "opts": opts,
+        },
+        "problems": {name: {"summary": summarize(trials), "trials": trials} for name, trials in by_problem.items()},
+    }
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for trials in by_problem.values():
+                for t in trials:
+                    writer.writerow(dict(t, iterations_to_model=" ".join(str(i) for i in t["iterations_to_model"])))
+
+    n_solved = sum(s["summary"]["success_rate"] for s in report["problems"].values())
+    print(f"\nSuccess rate: {n_solved / max(len(by_problem), 1):.3f} over {len(by_problem)} problems")
+    print(f"Total time: {sum(r['total_time'] for r in results):.1f}s")
+
+
+def print_progress(result, n_done, n_total):
+    print(f"[{n_done}/{n_total}] {result['problem']} trial {result['trial']}: {result['status']} "
+          f"in {result['total_time']:.2f}s", flush=True)
+
+
+def diff(args):
+    old = json.load(open(args.old))["problems"]
+    new = json.load(open(args.new))["problems"]
+
+    regressions = list()
+    print("%-40s %12s %12s %10s %10s" % ("problem", "time (old)", "time (new)", "solved", ""))
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            print("%-40s %s" % (name, "only in " + (args.old if name in old else args.new)))
+            continue
+        o, n = old[name]["summary"], new[name]["summary"]
+        flags = list()
+        if n["success_rate"] < o["success_rate"] - args.success_tol:
+            flags.append("LESS SOLVED")
+        # Very short runs are dominated by noise
+        if n["median_time"] > o["median_time"] * (1 + args.time_tol) and n["median_time"] - o["median_time"] > args.min_time:
+            flags.append("SLOWER")
+        if flags:
+            regressions.append(name)
+        print("%-40s %11.2fs %11.2fs %4.2f->%4.2f %s" % (
+            name, o["median_time"], n["median_time"], o["success_rate"], n["success_rate"], " ".join(flags)))
+
+    print(f"\n{len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the model builder on a corpus of problems')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmark and write the results')
+    run_parser.add_argument('dirs', nargs='*', help='Directories of problems (defaults to problems/IMO, problems/misc and problems/test)')
+    run_parser.add_argument('--out', '-o', action='store', type=str, default='results.json', help='JSON results file')
+    run_parser.add_argument('--csv', action='store', type=str, help='Also write one CSV row per trial')
+    run_parser.add_argument('--trials', action='store', type=int, default=3)
+    run_parser.add_argument('--seed', action='store', type=int, default=0, help='Trial i uses seed + i')
+    run_parser.add_argument('--jobs', '-j', action='store', type=int, default=1)
+    run_parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Override a builder option, e.g. --set batched=true')
+
+    diff_parser = subparsers.add_parser('diff', help='Compare two results files')
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    diff_parser.add_argument('--time_tol', action='store', type=float, default=0.2, help='Allowed relative increase of the median time')
+    diff_parser.add_argument('--min_time', action='store', type=float, default=0.5, help='Ignore slowdowns of fewer seconds')
+    diff_parser.add_argument('--success_tol', action='store', type=float, default=0.0, help='Allowed decrease of the success rate')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(diff(args))
@@ -4,217 +4,232 @@ Released under Apache 2.0 license as described in the file LICENSE.
 Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
-import tensorflow.compat.v1 as tf
 import os
 import pdb
+import random
+import sys
 from os import listdir
 from os.path import isfile, join
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 import time
 
-from tf_optimizer import TfOptimizer
-from parse import parse_sexprs
-from instruction_reader import InstructionReader
 
+BACKENDS = ["tf", "tf2", "numpy", "lm"]
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-tf.logging.set_verbosity(tf.logging.ERROR)
-tf.disable_v2_behavior()
-tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
 
+def close_figures():
+    # Only plotting imports matplotlib, so there is nothing to close if it was never loaded
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
 
 
-def build_aux(opts, show_plot=True, save_plot=False, outf_prefix=None, encode_fig=False):
-    lines = opts['lines']
+def report_phase(listener, name, start):
+    if listener is not None:
+        listener("phase", {"name": name, "seconds": time.time() - start})
 
-    cmds = parse_sexprs(lines)
-    reader = InstructionReader(lines)
-    instructions = reader.instructions
 
-    verbosity = opts['verbosity']
-
-    if verbosity >= 0:
-        print("INPUT INSTRUCTIONS:\n{instrs_str}".format(instrs_str="\n".join([str(i) for i in instructions])))
+def solve(opts, reader, listener=None):
+    instructions = reader.instructions
+    start = time.time()
 
+    # Backends are imported lazily so that e.g. the numpy backend never loads tensorflow
+    if opts['backend'] in ["numpy", "lm"]:
+        import numpy as np
+        if opts['backend'] == "lm":
+            from lm_optimizer import LmOptimizer as Solver
+        else:
+            from np_optimizer import NumpyOptimizer as Solver
 
-    g = tf.Graph()
-    with g.as_default():
+        if opts['seed'] is not None:
+            np.random.seed(opts['seed'])
 
-        solver = TfOptimizer(instructions, opts,
-                             reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles,
-                             reader.segments, reader.seg_colors, g)
+        solver = Solver(instructions, opts,
+                        reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles,
+                        reader.segments, reader.seg_colors, listener)
         solver.preprocess()
-        filtered_models = solver.solve()
-        # print(filtered_models)
-
-
-    if verbosity >= 0:
-        print(f"\n\nFound {len(filtered_models)} models")
-
-    figs = list()
-    for i, m in enumerate(filtered_models):
-        # FIXME: Inconsistent return type
-        if not (encode_fig or show_plot or save_plot):
-            figs.append(m)
-        else:
-            figs.append(m.plot(show=show_plot, save=save_plot, fname=f"{outf_prefix}_{i}.png", return_fig=encode_fig, show_unnamed=opts['unnamed_objects']))
-    return figs
+        report_phase(listener, "construct", start)
+
+        start = time.time()
+        models = solver.solve()
+        report_phase(listener, "solve", start)
+        return models
+    elif opts['backend'] == "tf2":
+        import tensorflow as tf
+        from tf2_optimizer import Tf2Optimizer
+
+        if opts['seed'] is not None:
+            tf.random.set_seed(opts['seed'])
+
+        solver = Tf2Optimizer(instructions, opts,
+                              reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles,
+                              reader.segments, reader.seg_colors, listener)
+        solver.preprocess()
+        report_phase(listener, "construct", start)
 
+        start = time.time()
+        models = solver.solve()
+        report_phase(listener, "solve", start)
+        return models
+    else:
+        import tensorflow.compat.v1 as tf
+        from tf_optimizer import TfOptimizer
 
-def build(opts, show_plot=True, save_plot=False, outf_prefix=None, encode_fig=False):
-    if opts['n_models'] > 10:
-        raise RuntimeError("Max # of models is 10")
+        # Process-wide, so the tf2 backend cannot be used afterwards in the same process
+        tf.disable_v2_behavior()
 
-    problem_given = ('lines' in opts or bool(opts['problem']))
-    dir_given = 'dir' in opts and bool(opts['dir'])
+        g = tf.Graph()
+        with g.as_default():
+            if opts['seed'] is not None:
+                tf.set_random_seed(opts['seed'])
 
-    if problem_given and dir_given:
-        raise RuntimeError("Please only supply one of --problem and --dir")
-
-    if not (problem_given or dir_given):
-        raise RuntimeError("Please provide either --problem or --dir")
+            solver = TfOptimizer(instructions, opts,
+                                 reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles,
+                                 reader.segments, reader.seg_colors, g, listener)
+            solver.preprocess()
+            report_phase(listener, "construct", start)
 
-    if problem_given:
-        if 'lines' not in opts:
-            opts['lines'] = open(opts['problem'], 'r').readlines()
-        return build_aux(opts, show_plot=show_plot, save_plot=save_plot, outf_prefix=outf_prefix, encode_fig=encode_fig)
-    else:
-        dir_files = [f for f in listdir(opts['dir']) if isfile(join(opts['dir'], f)) and f[-1] != "~"]
+            start = time.time()
+            models = solver.solve()
+            report_phase(listener, "solve", start)
+            return models
 
-        if opts['experiment']:
 
-            from statistics import mean, stdev
-            import itertools
+def solve_problem(opts, reader, listener=None):
+    if opts['decompose']:
+        from decompose import solve_decomposed
+        return solve_decomposed(opts, reader, solve, listener)
+    return solve(opts, reader, listener)
 
-            solve_map = { f: list() for f in dir_files }
 
-            all_trial_data = list()
+def build_aux(opts, show_plot=True, save_plot=False, outf_prefix=None, encode_fig=False, listener=None):
+    lines = opts['lines']
 
-            all_trial_times = list()
-            all_trial_success_times = list()
-            all_trial_fail_times = list()
-            all_trial_goal_total = list()
-            all_trial_goal_success = list()
+    # Seeded before parsing, which picks the segment colors
+    if opts['seed'] is not None:
+        random.seed(opts['seed'])
 
+    start = time.time()
+    from ir import compile_program
+    reader = compile_program(lines, opts)
+    verbosity = opts['verbosity']
 
-            n_trials = 3
-            opts['verbosity'] = -1
-            opts['plot_freq'] = -1
-            opts['loss_freq'] = -1
-            opts['losses_freq'] = -1
+    if opts['rewrite']:
+        from rewrite import rewrite
+        reader = reader._replace(instructions=rewrite(reader.instructions, verbosity))
 
-            for _ in tqdm(range(n_trials), desc="Trials"):
-                trial_data = list()
-                trial_times = list()
-                trial_success_times = list()
-                trial_fail_times = list()
-                trial_goal_total = list()
-                trial_goal_success = list()
-                for f in tqdm(dir_files, desc="Problems"):
+    instructions = reader.instructions
+    report_phase(listener, "parse", start)
 
-                    plt.close('all')
+    if verbosity >= 0:
+        print("INPUT INSTRUCTIONS:\n{instrs_str}".format(instrs_str="\n".join([str(i) for i in instructions])))
 
-                    opts['lines'] = open(join(opts['dir'], f), 'r').readlines()
-                    start = time.time()
-                    models = build_aux(opts, show_plot=False, save_plot=False, outf_prefix=outf_prefix, encode_fig=False)
+    # Unseeded solves are meant to find new diagrams every time, so only seeded ones are cached
+    if opts['cache'] and opts['seed'] is not None:
+        from result_cache import ResultCache, problem_key
 
-                    end = time.time()
+        cache = ResultCache(opts['cache_dir'], opts['cache_size'])
+        key = problem_key(instructions, reader, opts)
+        filtered_models = cache.get(key)
 
-                    assert(len(models) <= 1)  # Could take away if necessary
+        if filtered_models is None:
+            filtered_models = solve_problem(opts, reader, listener)
+            # Failures are not cached, so that they can be retried
+            if filtered_models:
+                cache.put(key, filtered_models)
+        else:
+            if verbosity >= 0:
+                print("\nUsing cached models")
+            if listener is not None:
+                for m in filtered_models:
+                    listener("model", {"model": m})
+    else:
+        filtered_models = solve_problem(opts, reader, listener)
 
+    if verbosity >= 0:
+        print(f"\n\nFound {len(filtered_models)} models")
 
-                    time_elapsed = end - start
-                    n_models = len(models)
-                    solve_map[f].append(n_models)
-                    trial_data.append(n_models)
-                    trial_times.append(time_elapsed)
+    figs = list()
+    for i, m in enumerate(filtered_models):
+        # FIXME: Inconsistent return type
+        if not (encode_fig or show_plot or save_plot):
+            figs.append(m)
+        else:
+            figs.append(m.plot(show=show_plot, save=save_plot, fname=f"{outf_prefix}_{i}.png", return_fig=encode_fig, show_unnamed=opts['unnamed_objects']))
+    return figs
 
-                    if models and len(models[0].goals) > 0:
-                        [model] = models
 
-                        trial_goal_total.append(len(model.goals))
-                        trial_goal_success.append(len([v for v in model.goals.values() if v <= opts['eps'] * 10]))
-                    else:
-                        trial_goal_total.append(None)
-                        trial_goal_success.append(None)
+def build_file(opts, path, save_plot=False, outf_prefix=None):
+    close_figures()
 
-                    if n_models == opts['n_models']:
-                        trial_success_times.append(time_elapsed)
-                    elif n_models == 0:
-                        trial_fail_times.append(time_elapsed)
+    opts = dict(opts)
+    opts['lines'] = open(path, 'r').readlines()
+    models = build_aux(opts, show_plot=False, save_plot=save_plot, outf_prefix=outf_prefix, encode_fig=True)
+    return len(models)
 
-                all_trial_data.append(trial_data)
-                all_trial_times.append(trial_times)
-                all_trial_success_times.append(trial_success_times)
-                all_trial_fail_times.append(trial_fail_times)
 
-                all_trial_goal_total.append(trial_goal_total)
-                all_trial_goal_success.append(trial_goal_success)
+def init_dir_worker():
+    # Workers never show plots, and may not have a display to do so
+    os.environ.setdefault('MPLBACKEND', 'Agg')
 
-            print(f"\n\nAll Trial Data:\n{all_trial_data}")
-            print(f"\n\nSolve Map:\n{solve_map}")
-            print("\n\n")
 
-            all_n_models_per_file = [mean(t_data) for t_data in all_trial_data] # should have length 2
-            avg_models_per_file = mean(all_n_models_per_file)
-            std_models_per_file = stdev(all_n_models_per_file)
+def build_dir_parallel(opts, dir_files, save_plot=False, outf_prefix=None):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
 
+    # Output of concurrent problems would be interleaved, so only the results are printed.
+    # Problems already run in parallel, so their subproblems do not.
+    jobs = opts['jobs']
+    opts = dict(opts, verbosity=-1, plot_freq=-1, loss_freq=-1, losses_freq=-1, jobs=1)
 
-            # % Problems with at least one model
-            all_n_models_with_gt0_models = [len([n for n in t_data if n > 0]) / len(dir_files) * 100 for t_data in all_trial_data]
-            avg_perc_success = mean(all_n_models_with_gt0_models)
-            std_perc_success = stdev(all_n_models_with_gt0_models)
+    solve_map = dict()
 
-            # (avg time per problem) per trial
-            all_avg_times = [mean(time_data) for time_data in all_trial_times]
-            avg_time = mean(all_avg_times)
-            std_time = stdev(all_avg_times)
+    # Every worker builds its own graphs and sessions; spawn so that none inherits tensorflow state
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=init_dir_worker) as pool:
+        futures = {pool.submit(build_file, opts, join(opts['dir'], f), save_plot, outf_prefix): f for f in dir_files}
+        for future in as_completed(futures):
+            f = futures[future]
+            try:
+                solve_map[f] = future.result()
+            except Exception as e:
+                solve_map[f] = f"ERROR: {e}"
+            print(f"[{len(solve_map)}/{len(dir_files)}] {f}: {solve_map[f]}", flush=True)
 
-            all_avg_success_times = [mean(success_time_data) for success_time_data in all_trial_success_times]
-            avg_success_time = mean(all_avg_success_times)
-            std_success_time = stdev(all_avg_success_times)
+    print("\n\nSummary:")
+    n_solved = len([n for n in solve_map.values() if isinstance(n, int) and n > 0])
+    print(f"Solved {n_solved}/{len(dir_files)} problems")
+    return dict(sorted(solve_map.items()))
 
-            all_avg_fail_times = [mean(fail_time_data) for fail_time_data in all_trial_fail_times]
-            avg_fail_time = mean(all_avg_fail_times)
-            std_fail_time = stdev(all_avg_fail_times)
 
-            print(f"Models per File: Avg {avg_models_per_file}, Sd {std_models_per_file}")
-            print(f"% Problems with atleast 1 Model: Avg {avg_perc_success}, Sd {std_perc_success}")
-            print(f"Avg Time per Problem (all): Avg {avg_time}, Sd {std_time}")
-            print(f"Avg Time per Problem (success): Avg {avg_success_time}, Sd {std_success_time}")
-            print(f"Avg Time per Problem (fail): Avg {avg_fail_time}, Sd {std_fail_time}")
+def build(opts, show_plot=True, save_plot=False, outf_prefix=None, encode_fig=False, listener=None):
+    if opts['n_models'] > 10:
+        raise RuntimeError("Max # of models is 10")
 
-            # handle goals
-            perc_goals_satisfied = list()
-            for (trial_totals, trial_successes) in zip(all_trial_goal_total, all_trial_goal_success):
-                trial_totals = [n for n in trial_totals if n is not None]
-                trial_successes = [n for n in trial_successes if n is not None]
+    if opts['backend'] not in BACKENDS:
+        raise RuntimeError(f"Unknown backend {opts['backend']}, expected one of {', '.join(BACKENDS)}")
 
-                n_successful_problems = len(trial_totals)
+    problem_given = ('lines' in opts or bool(opts['problem']))
+    dir_given = 'dir' in opts and bool(opts['dir'])
 
-                n_successful_problems_goals_satisfied = len(
-                    [n_goals for (n_total, n_goals) in zip(trial_totals, trial_successes) if n_total == n_goals]
-                )
+    if problem_given and dir_given:
+        raise RuntimeError("Please only supply one of --problem and --dir")
 
-                perc_goals_satisfied.append(n_successful_problems_goals_satisfied / n_successful_problems)
+    if not (problem_given or dir_given):
+        raise RuntimeError("Please provide either --problem or --dir")
 
+    if problem_given:
+        if 'lines' not in opts:
+            opts['lines'] = open(opts['problem'], 'r').readlines()
+        return build_aux(opts, show_plot=show_plot, save_plot=save_plot, outf_prefix=outf_prefix, encode_fig=encode_fig, listener=listener)
+    else:
+        dir_files = [f for f in listdir(opts['dir']) if isfile(join(opts['dir'], f)) and f[-1] != "~"]
 
-            print(f"Goal total info: {all_trial_goal_total}")
-            print(f"Goal success info: {all_trial_goal_success}")
-            print(f"% Successful Problems with Goals Satisfied up to Tolerance: Avg {mean(perc_goals_satisfied)}, Sd {stdev(perc_goals_satisfied)}")
-            pdb.set_trace()
+        solve_map = dict()
 
+        if opts['jobs'] > 1:
+            solve_map = build_dir_parallel(opts, dir_files, save_plot, outf_prefix)
         else:
-
-            solve_map = dict()
-
             for f in dir_files:
-                plt.close('all')
-
-                opts['lines'] = open(join(opts['dir'], f), 'r').readlines()
-                models = build_aux(opts, show_plot=False, save_plot=save_plot, outf_prefix=outf_prefix, encode_fig=True)
-                solve_map[f] = len(models)
+                solve_map[f] = build_file(opts, join(opts['dir'], f), save_plot, outf_prefix)
 
-            for f, n_models in solve_map.items():
-                print(f"{f}: {n_models}")
+        for f, n_models in solve_map.items():
+            print(f"{f}: {n_models}")
@@ -19,6 +19,9 @@ if __name__ == "__main__":
     # General arguments
     parser.add_argument('--problem', '-p', action='store', type=str, help='Name of the file defining the set of constraints')
     parser.add_argument('--dir', '-d', action='store', type=str, help='Directory containing problem files.')
+    parser.add_argument('--jobs', '-j', action='store', dest='jobs', type=int, default=DEFAULTS['jobs'], help='Number of problems of --dir, or of independent subproblems with --decompose, to solve in parallel.')
+    parser.add_argument('--rewrite', dest='rewrite', action='store_true', help='Fold assertions that a sampler or parameterization can satisfy by construction into it.')
+    parser.add_argument('--decompose', dest='decompose', action='store_true', help='Solve the independent parts of the problem separately.')
     parser.add_argument('--regularize_points', action='store', dest='regularize_points', type=float, default=DEFAULTS["regularize_points"])
     parser.add_argument('--make_distinct', action='store', dest='make_distinct', type=float, default=DEFAULTS["make_distinct"])
     parser.add_argument('--distinct_prob', action='store', dest='distinct_prob', type=float, default=DEFAULTS["distinct_prob"])
@@ -34,6 +37,11 @@ if __name__ == "__main__":
     parser.add_argument('--loss_freq', action='store', dest='loss_freq', type=int, default=DEFAULTS['loss_freq'])
     parser.add_argument('--losses_freq', action='store', dest='losses_freq', type=int, default=DEFAULTS['losses_freq'])
 
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=DEFAULTS['seed'])
+    parser.add_argument('--cache', dest='cache', action='store_true')
+    parser.add_argument('--cache_dir', action='store', dest='cache_dir', type=str, default=DEFAULTS['cache_dir'])
+    parser.add_argument('--cache_size', action='store', dest='cache_size', type=float, default=DEFAULTS['cache_size'])
+
     parser.add_argument('--unnamed_objects', dest='unnamed_objects', action='store_true')
     parser.add_argument('--no_unnamed_objects', dest='unnamed_objects', action='store_false')
     parser.set_defaults(unnamed_objects=True)
@@ -44,8 +52,18 @@ if __name__ == "__main__":
     parser.add_argument('--decay_rate', action='store', dest='decay_rate', type=float, default=DEFAULTS["decay_rate"])
     parser.add_argument('--n_iterations', action='store', dest='n_iterations', type=int, default=DEFAULTS["n_iterations"])
     parser.add_argument('--eps', action='store', dest='eps', type=float, default=DEFAULTS["eps"])
+    parser.add_argument('--batched', dest='batched', action='store_true')
+    parser.add_argument('--in_graph', dest='in_graph', action='store_true')
+    parser.add_argument('--check_numerics', dest='check_numerics', action='store_true')
+    parser.add_argument('--xla', dest='xla', action='store_true')
+    parser.add_argument('--halving', dest='halving', action='store_true')
+    parser.add_argument('--halving_budget', action='store', dest='halving_budget', type=int, default=DEFAULTS["halving_budget"])
+    parser.add_argument('--stall_window', action='store', dest='stall_window', type=int, default=DEFAULTS["stall_window"])
+    parser.add_argument('--stall_tol', action='store', dest='stall_tol', type=float, default=DEFAULTS["stall_tol"])
+    parser.add_argument('--grad_floor', action='store', dest='grad_floor', type=float, default=DEFAULTS["grad_floor"])
+    parser.add_argument('--lm_damping', action='store', dest='lm_damping', type=float, default=DEFAULTS["lm_damping"])
 
-    parser.add_argument('--experiment', dest='experiment', action='store_true')
+    parser.add_argument('--backend', action='store', dest='backend', type=str, choices=["tf", "tf2", "numpy", "lm"], default=DEFAULTS["backend"])
 
 
     args = parser.parse_args()
@@ -0,0 +1,217 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import itertools
+
+import numpy as np
+
+from diagram import Diagram
+from instruction import *
+from ir import Program, to_ir, from_ir
+from primitives import Primitive
+from util import FuncInfo, Root
+
+
+# Objects that are never mentioned together, even indirectly, cannot constrain each other, so the
+# instructions split into groups that can be solved on their own. Each group is a smaller problem,
+# and one that fails to converge no longer forces retrying the others. The models of the groups
+# are then merged into single diagrams. If too few merged diagrams keep their points apart, the rest
+# are found by solving the whole problem, so that decomposing never finds fewer models than not.
+
+# Subproblems are asked for more models than the problem, but no more than builder.build allows
+MAX_SUB_MODELS = 10
+
+def names(x):
+    # The named objects a term, constraint or instruction refers to
+    if isinstance(x, Primitive):
+        return [x] if isinstance(x.val, str) else names(x.val)
+    elif isinstance(x, (FuncInfo, Root)):
+        return names(x.args if isinstance(x, FuncInfo) else x.vars)
+    elif isinstance(x, (list, tuple)):
+        return [n for v in x for n in names(v)]
+    elif isinstance(x, (Assert, AssertNDG, Eval)):
+        return names(x.constraint.args)
+    elif isinstance(x, Compute):
+        return [x.obj_name] + names(x.computation)
+    elif isinstance(x, Parameterize):
+        return [x.obj_name] + names(x.parameterization[1])
+    elif isinstance(x, Sample):
+        return names(x.points) + names(x.args)
+    return list()
+
+
+class Components:
+    # Union-find over the named objects
+    def __init__(self):
+        self.parent = dict()
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, xs):
+        roots = [self.find(x) for x in xs]
+        for r in roots[1:]:
+            self.parent[r] = roots[0]
+        return roots[0] if roots else None
+
+
+def decompose(reader):
+    # Splits the problem into subproblems, in the order their first instruction appears
+    components = Components()
+    for i in reader.instructions:
+        components.union(names(i))
+
+    # Unnamed objects and segments normally mention objects that are already connected
+    unnamed = [reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles, reader.segments]
+    for terms in unnamed:
+        for t in terms:
+            components.union(names(t))
+
+    roots = list()
+    def root_of(x):
+        r = components.union(names(x))
+        # Instructions that mention no object, if any, go with the first subproblem
+        r = roots[0] if r is None and roots else r
+        if r not in roots:
+            roots.append(r)
+        return r
+
+    instr_roots = [root_of(i) for i in reader.instructions]
+    unnamed_roots = [[root_of(t) for t in terms] for terms in unnamed]
+
+    subproblems = list()
+    for r in roots:
+        def pick(xs, rs):
+            return [x for x, xr in zip(xs, rs) if xr == r]
+
+        seg_roots = unnamed_roots[3]
+        subproblems.append(Program(
+            instructions=pick(reader.instructions, instr_roots),
+            unnamed_points=pick(reader.unnamed_points, unnamed_roots[0]),
+            unnamed_lines=pick(reader.unnamed_lines, unnamed_roots[1]),
+            unnamed_circles=pick(reader.unnamed_circles, unnamed_roots[2]),
+            segments=pick(reader.segments, seg_roots),
+            seg_colors=pick(reader.seg_colors, seg_roots)))
+    return subproblems
+
+
+def merge(models):
+    # One diagram from one model of every subproblem
+    return Diagram(
+        named_points={p: P for m in models for p, P in m.named_points.items()},
+        named_lines={l: L for m in models for l, L in m.named_lines.items()},
+        named_circles={c: C for m in models for c, C in m.named_circles.items()},
+        segments=[s for m in models for s in m.segments],
+        seg_colors=[c for m in models for c in m.seg_colors],
+        unnamed_points=[P for m in models for P in m.unnamed_points],
+        unnamed_lines=[L for m in models for L in m.unnamed_lines],
+        unnamed_circles=[C for m in models for C in m.unnamed_circles],
+        ndgs={k: v for m in models for k, v in m.ndgs.items()},
+        goals={k: v for m in models for k, v in m.goals.items()})
+
+
+def apart(models, min_dist):
+    # Points of each model were already checked against each other, but not against the other models
+    xys = [np.array([[float(P.x), float(P.y)] for P in m.named_points.values()]).reshape(-1, 2) for m in models]
+    for a, b in itertools.combinations(xys, 2):
+        if (np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=-1)) < min_dist).any():
+            return False
+    return True
+
+
+def pick_merges(all_models, n_models, min_dist):
+    # Greedily picks up to n_models combinations of one model per subproblem whose points are apart,
+    # using each model at most once. Points only clash between pairs of subproblems, so a model is
+    # only checked against the parts picked so far.
+    unused = [list(range(len(models))) for models in all_models]
+    merges = list()
+    while len(merges) < n_models:
+        parts = list()
+        for models, ks in zip(all_models, unused):
+            k = next((k for k in ks if apart(parts + [models[k]], min_dist)), None)
+            if k is None:
+                return merges
+            ks.remove(k)
+            parts.append(models[k])
+        merges.append(parts)
+    return merges
+
+
+def solve_subproblem(opts, ir):
+    from builder import solve
+
+    # Subproblems are sent to workers, and diagrams, which hold backend values, sent back as plain data
+    return [m.to_dict() for m in solve(opts, from_ir(ir))]
+
+
+def solve_decomposed(opts, reader, solve, listener=None):
+    subproblems = decompose(reader)
+    if len(subproblems) == 1:
+        return solve(opts, reader, listener)
+
+    if opts['verbosity'] >= 0:
+        print(f"\nSolving {len(subproblems)} independent subproblems")
+
+    def report_component(k):
+        if listener is not None:
+            listener("component", {"index": k, "n_components": len(subproblems)})
+
+    # Models of a subproblem are incomplete diagrams, so only the merged ones are reported
+    def component_listener(event, data):
+        if event != "model":
+            listener(event, data)
+
+    # Subproblems seeded alike would start from the same draws, e.g. put their first free points in the same
+    # place, and only the first may put a triangle on the fixed base. Each asks for more models than needed,
+    # so that there are other ones to merge when some clash.
+    def sub_opts(opts, k):
+        n_models = min(2 * opts['n_models'], MAX_SUB_MODELS)
+        opts = dict(opts, fixed_base=(k == 0), n_models=n_models, n_tries=max(opts['n_tries'], n_models),
+                    n_inits=max(opts['n_inits'], n_models))
+        return opts if opts['seed'] is None else dict(opts, seed=opts['seed'] + k)
+
+    all_models = [None] * len(subproblems)
+    if opts['jobs'] > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        import multiprocessing
+        from builder import init_dir_worker
+
+        # Output of concurrent subproblems would be interleaved
+        quiet_opts = dict(opts, verbosity=-1, plot_freq=-1, loss_freq=-1, losses_freq=-1)
+
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=opts['jobs'], mp_context=ctx, initializer=init_dir_worker) as pool:
+            futures = {pool.submit(solve_subproblem, sub_opts(quiet_opts, k), to_ir(s)): k for k, s in enumerate(subproblems)}
+            for future in as_completed(futures):
+                k = futures[future]
+                all_models[k] = [Diagram.from_dict(d) for d in future.result()]
+                report_component(k)
+    else:
+        for k, s in enumerate(subproblems):
+            report_component(k)
+            all_models[k] = solve(sub_opts(opts, k), s, component_listener if listener is not None else None)
+            # The whole diagram needs every subproblem, so there is no point solving the rest
+            if not all_models[k]:
+                break
+
+    models = list()
+    if all(all_models):
+        for parts in pick_merges(all_models, opts['n_models'], opts['min_dist']):
+            model = merge(parts)
+            models.append(model)
+            if listener is not None:
+                listener("model", {"model": model})
+
+    n_missing = opts['n_models'] - len(models)
+    if n_missing > 0:
+        if opts['verbosity'] >= 0:
+            print(f"\nMerged {len(models)} models, solving the whole problem for the other {n_missing}")
+        models.extend(solve(dict(opts, n_models=n_missing), reader, listener))
+    return models
@@ -5,19 +5,70 @@ Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
 import collections
-import matplotlib.pyplot as plt
 import os
 import pdb
 import numpy as np
 import math
 
+from primitives import Point, Line, Circle
+
 
 UNNAMED_ALPHA = 0.1
 MIN_AXIS_VAL = -10
 MAX_AXIS_VAL = 10
 
+# Backend-independent coordinates, for diagrams read back from plain data
+Coords = collections.namedtuple("Coords", ["x", "y"])
+
+def point_to_list(p):   return [float(p.x), float(p.y)]
+def point_from_list(p): return Coords(*p)
+
+# Lines are a unit normal and an offset, circles a center and a radius
+def pair_to_list(pair):   return [point_to_list(pair[0]), float(pair[1])]
+def pair_from_list(pair): return (point_from_list(pair[0]), pair[1])
+
 class Diagram(collections.namedtuple("Diagram", ["named_points", "named_lines", "named_circles", "segments", "seg_colors", "unnamed_points", "unnamed_lines", "unnamed_circles", "ndgs", "goals"])):
+    def to_dict(self):
+        # Only names and plain numbers, so that the result can be stored as JSON
+        return {
+            "named_points": {p.val: point_to_list(P) for p, P in self.named_points.items()},
+            "named_lines": {l.val: pair_to_list(L) for l, L in self.named_lines.items()},
+            "named_circles": {c.val: pair_to_list(C) for c, C in self.named_circles.items()},
+            "segments": [[point_to_list(p1), point_to_list(p2)] for p1, p2 in self.segments],
+            "seg_colors": [[float(x) for x in c] for c in self.seg_colors],
+            "unnamed_points": [point_to_list(P) for P in self.unnamed_points],
+            "unnamed_lines": [pair_to_list(L) for L in self.unnamed_lines],
+            "unnamed_circles": [pair_to_list(C) for C in self.unnamed_circles],
+            "ndgs": {k: float(v) for k, v in self.ndgs.items()},
+            "goals": {k: float(v) for k, v in self.goals.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            named_points={Point(p): point_from_list(P) for p, P in d["named_points"].items()},
+            named_lines={Line(l): pair_from_list(L) for l, L in d["named_lines"].items()},
+            named_circles={Circle(c): pair_from_list(C) for c, C in d["named_circles"].items()},
+            segments=[(point_from_list(p1), point_from_list(p2)) for p1, p2 in d["segments"]],
+            seg_colors=d["seg_colors"],
+            unnamed_points=[point_from_list(P) for P in d["unnamed_points"]],
+            unnamed_lines=[pair_from_list(L) for L in d["unnamed_lines"]],
+            unnamed_circles=[pair_from_list(C) for C in d["unnamed_circles"]],
+            ndgs=d["ndgs"],
+            goals=d["goals"])
+
+    def to_svg(self, show_unnamed=True, size=480):
+        # Much faster than plot, and does not need matplotlib
+        from render import render_svg
+        return render_svg(self, show_unnamed=show_unnamed, size=size)
+
+    def to_png(self, show_unnamed=True, size=480):
+        from render import svg_to_png
+        return svg_to_png(self.to_svg(show_unnamed=show_unnamed, size=size))
+
     def plot(self, show=True, save=False, fname=None, return_fig=False, show_unnamed=True):
+        # matplotlib is slow to import and only needed here
+        import matplotlib.pyplot as plt
 
         unnamed_points = self.unnamed_points
         unnamed_lines = self.unnamed_lines
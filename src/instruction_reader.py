@@ -7,7 +7,7 @@ Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 import pdb
 import argparse
 import math
-import numpy as np
+import random
 
 from instruction import Assert, AssertNDG, Eval, Sample, Parameterize, Compute
 from constraint import Constraint
@@ -38,7 +38,7 @@ class InstructionReader:
             try:
                 self.process_command(cmd)
             except:
-                raise RuntimeError(f"Invalid command: {cmd}")
+                raise RuntimeError(f"Invalid command at line {cmd.span.line}, column {cmd.span.col}: {cmd}")
 
     def register_pt(self, p):
         if p in self.points:
@@ -116,7 +116,7 @@ class InstructionReader:
         else:
             raise RuntimeError("Invalid joint param method")
 
-        n_gon_color = np.random.rand(3)
+        n_gon_color = [random.random() for _ in range(3)]
         for i in range(len(ps)):
             self.segments.append((ps[i], ps[(i+1) % (len(ps))]))
             self.seg_colors.append(n_gon_color)
@@ -0,0 +1,176 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import collections
+import hashlib
+import os
+import random
+
+from constraint import Constraint
+from instruction import *
+from instruction_reader import InstructionReader
+from parse import source_text
+from primitives import Point, Line, Circle, Num
+from result_cache import JsonCache
+from util import FuncInfo, Root
+
+
+# A validated program as plain JSON data, so that it can be stored, or sent to another process,
+# and read back without parsing and checking the source again. Every term is a list that starts
+# with a tag, so that e.g. lists and tuples, which compare differently, come back as they were.
+#
+#   {"version": 1, "instructions": [["Sample", ["t", ["P", "A"], ...], "triangle", ["t"]], ...],
+#    "unnamed_points": [...], "unnamed_lines": [...], "unnamed_circles": [...],
+#    "segments": [[p1, p2, color_index], ...], "colors": [[r, g, b], ...]}
+
+# Bump whenever the instructions or the encoding change, which invalidates stored programs
+IR_VERSION = 1
+
+# Has the same fields as an InstructionReader, so that it can be solved like one
+Program = collections.namedtuple("Program", ["instructions", "unnamed_points", "unnamed_lines", "unnamed_circles",
+                                             "segments", "seg_colors"])
+
+PRIMITIVES = {"P": Point, "L": Line, "C": Circle, "N": Num}
+INSTRUCTIONS = {"Assert": Assert, "AssertNDG": AssertNDG, "Eval": Eval}
+
+
+def encode(x):
+    if isinstance(x, (Point, Line, Circle, Num)):
+        tag = next(t for t, cls in PRIMITIVES.items() if type(x) == cls)
+        return [tag, encode(x.val)]
+    elif isinstance(x, FuncInfo):
+        return ["F", str(x.head), encode(x.args)]
+    elif isinstance(x, Root):
+        return ["R", x.pred, encode(x.vars)]
+    elif isinstance(x, Constraint):
+        return ["K", x.pred, encode(x.args), x.negate]
+    elif isinstance(x, list):
+        return ["l"] + [encode(v) for v in x]
+    elif isinstance(x, tuple):
+        return ["t"] + [encode(v) for v in x]
+    elif isinstance(x, str):
+        # Parsed atoms know where they were read from, which is not kept
+        return str(x)
+    elif x is None or isinstance(x, (bool, int, float)):
+        return x
+    raise ValueError(f"[encode] Cannot encode {x!r}")
+
+
+def decode(x):
+    if not isinstance(x, list):
+        return x
+    tag, args = x[0], x[1:]
+    if tag in PRIMITIVES:
+        return PRIMITIVES[tag](decode(args[0]))
+    elif tag == "F":
+        return FuncInfo(args[0], decode(args[1]))
+    elif tag == "R":
+        return Root(args[0], decode(args[1]))
+    elif tag == "K":
+        return Constraint(args[0], decode(args[1]), args[2])
+    elif tag == "l":
+        return [decode(v) for v in args]
+    elif tag == "t":
+        return tuple(decode(v) for v in args)
+    raise ValueError(f"[decode] Unknown tag {tag}")
+
+
+def encode_instruction(i):
+    if isinstance(i, Sample):
+        return ["Sample", encode(i.points), i.sampler, encode(i.args)]
+    elif isinstance(i, Compute):
+        return ["Compute", encode(i.obj_name), encode(i.computation)]
+    elif isinstance(i, Parameterize):
+        return ["Parameterize", encode(i.obj_name), encode(i.parameterization)]
+    elif type(i).__name__ in INSTRUCTIONS:
+        return [type(i).__name__, encode(i.constraint)]
+    raise ValueError(f"[encode_instruction] Cannot encode {i}")
+
+
+def decode_instruction(i):
+    kind, args = i[0], [decode(a) for a in i[1:]]
+    if kind == "Sample":
+        return Sample(*args)
+    elif kind == "Compute":
+        return Compute(*args)
+    elif kind == "Parameterize":
+        return Parameterize(*args)
+    elif kind in INSTRUCTIONS:
+        return INSTRUCTIONS[kind](*args)
+    raise ValueError(f"[decode_instruction] Unknown instruction {kind}")
+
+
+def to_ir(program):
+    # Segments of a polygon share one color, drawn once when it was parsed
+    colors = list()
+    segments = list()
+    for (p1, p2), c in zip(program.segments, program.seg_colors):
+        if not any(c is c2 for c2 in colors):
+            colors.append(c)
+        k = next(k for k, c2 in enumerate(colors) if c is c2)
+        segments.append([encode(p1), encode(p2), k])
+
+    return {
+        "version": IR_VERSION,
+        "instructions": [encode_instruction(i) for i in program.instructions],
+        "unnamed_points": [encode(p) for p in program.unnamed_points],
+        "unnamed_lines": [encode(l) for l in program.unnamed_lines],
+        "unnamed_circles": [encode(c) for c in program.unnamed_circles],
+        "segments": segments,
+        "colors": [[float(v) for v in c] for c in colors],
+    }
+
+
+def from_ir(d, redraw_colors=False):
+    # With redraw_colors, colors are drawn again in the order parsing drew them. Seeded, this gives the same
+    # colors and leaves the random generator in the same state as parsing the source would have, and
+    # unseeded, new colors, as parsing would. Without it, the stored colors are kept, e.g. for subproblems.
+    if d.get("version") != IR_VERSION:
+        raise ValueError(f"[from_ir] Expected version {IR_VERSION}, got {d.get('version')}")
+
+    program = Program(
+        instructions=[decode_instruction(i) for i in d["instructions"]],
+        unnamed_points=[decode(p) for p in d["unnamed_points"]],
+        unnamed_lines=[decode(l) for l in d["unnamed_lines"]],
+        unnamed_circles=[decode(c) for c in d["unnamed_circles"]],
+        segments=[(decode(p1), decode(p2)) for p1, p2, _ in d["segments"]],
+        seg_colors=list())
+
+    colors = [[random.random() for _ in range(3)] for _ in d["colors"]] if redraw_colors else d["colors"]
+    program.seg_colors.extend(colors[k] for _, _, k in d["segments"])
+    return program
+
+
+def source_key(lines):
+    return hashlib.sha256(f"{IR_VERSION}\n{source_text(lines)}".encode()).hexdigest()
+
+
+class CompileCache(JsonCache):
+    # Colors are part of the program, but drawn every time it is compiled
+    def get(self, key):
+        return self.get_json(key, lambda d: from_ir(d, redraw_colors=True))
+
+    def put(self, key, program):
+        self.put_json(key, to_ir(program))
+
+
+def read_program(lines):
+    reader = InstructionReader(lines)
+    return Program(*[getattr(reader, field) for field in Program._fields])
+
+
+def compile_program(lines, opts):
+    # Parses and validates the source, unless the same source was compiled before
+    if not opts['cache']:
+        return read_program(lines)
+
+    cache = CompileCache(os.path.join(opts['cache_dir'], "ir"), opts['cache_size'])
+    key = source_key(lines)
+    program = cache.get(key)
+    if program is None:
+        program = read_program(lines)
+        cache.put(key, program)
+    return program
@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import numpy as np
+
+import autodiff as ad
+from np_optimizer import NumpyOptimizer
+from optimizer import StallDetector
+
+
+# Every loss is a weighted mean of squared errors, so the total loss is a sum of squared residuals and
+# can be minimized with Levenberg-Marquardt instead of Adam. Like NumpyOptimizer, all n_inits
+# candidates are optimized at once; each has its own damping, and takes a step only if it lowers its loss.
+
+# Candidates whose damping grows past this are stuck, since no step lowers their loss
+MAX_DAMPING = 1e8
+# Rejected steps grow the damping from at least this, so that it also grows from lm_damping 0
+MIN_DAMPING = 1e-9
+
+
+class LmOptimizer(NumpyOptimizer):
+
+    def reset(self):
+        super().reset()
+        # Pairs of a constant coefficient and an error, whose products are the residuals
+        self.residuals = list()
+
+    def residual_terms(self, err, coef):
+        # mk_zero takes the mean of the squares of a (nested) list of errors
+        if isinstance(err, list):
+            return [t for e in err for t in self.residual_terms(e, coef / np.sqrt(len(err)))]
+        return [(coef, err)]
+
+    def register_loss(self, key, val, weight=1.0, requires_train=True):
+        super().register_loss(key, val, weight, requires_train)
+        self.residuals.extend(self.residual_terms(val, np.sqrt(weight)))
+
+    def params(self):
+        return np.concatenate([np.reshape(var.val, [self.batch_size, -1]) for var in self.trainable_vars], axis=1)
+
+    def set_params(self, theta):
+        offset = 0
+        for var in self.trainable_vars:
+            size = int(np.prod(np.shape(var.val)[1:]))
+            var.val = np.reshape(theta[:, offset:offset + size], np.shape(var.val))
+            offset += size
+        self.tape.forward()
+
+    def residual_values(self):
+        return np.stack([np.broadcast_to(coef * ad.value(e), [self.batch_size]) for coef, e in self.residuals], axis=1)
+
+    def jacobian(self, active):
+        # One reverse pass per residual gives its row of the Jacobian for every candidate at once
+        n_params = sum(int(np.prod(np.shape(var.val)[1:])) for var in self.trainable_vars)
+        J = np.zeros([self.batch_size, len(self.residuals), n_params])
+        for j, (coef, e) in enumerate(self.residuals):
+            if not isinstance(e, ad.Node):
+                continue
+            self.tape.backward(e, np.broadcast_to(np.where(active, coef, 0.0), np.shape(e.val)))
+            offset = 0
+            for var in self.trainable_vars:
+                size = int(np.prod(np.shape(var.val)[1:]))
+                if var.grad is not None:
+                    J[:, j, offset:offset + size] = np.reshape(np.broadcast_to(var.grad, np.shape(var.val)), [self.batch_size, -1])
+                offset += size
+        return J
+
+    def train(self):
+        opts = self.opts
+
+        damping = np.full(self.batch_size, opts['lm_damping'])
+
+        models = list()
+        done = np.zeros(self.batch_size, dtype=bool)
+        stalls = StallDetector(opts)
+
+        for i in range(opts['n_iterations']):
+
+            loss_v = np.broadcast_to(ad.value(self.loss), [self.batch_size])
+
+            # Candidates that blew up are abandoned rather than aborting the batch
+            done |= ~np.isfinite(loss_v)
+            if done.all():
+                break
+
+            # The damping plays the part of the learning rate in the progress output
+            best = int(np.argmin(np.where(done, np.inf, loss_v)))
+            if self.verbosity > 0 or (i % self.opts['loss_freq'] == 0 and self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
+                print("[%6d] %16.12f || %10.6f || %d/%d active" % (i, loss_v[best], damping[best], (~done).sum(), self.batch_size))
+            self.report_iteration(i, loss_v[best], damping[best], active=int((~done).sum()))
+            if self.verbosity > 1 or (i % self.opts['losses_freq'] == 0 and self.opts['losses_freq'] > 0 and self.opts['verbosity'] > -1):
+                self.print_losses(best)
+            if i % self.opts['plot_freq'] == 0 and self.opts['plot_freq'] > 0 and self.opts['verbosity'] > -1:
+                self.get_model(best).plot(show_unnamed=self.opts['unnamed_objects'])
+
+            converged = np.flatnonzero((loss_v < opts['eps']) & ~done)
+            if converged.size > 0:
+                done[converged] = True
+                for k, model in zip(converged, self.get_models(converged)):
+                    if self.valid_model(model, k):
+                        self.add_model(models, model)
+                    if len(models) >= opts['n_models']:
+                        return models
+
+            if done.all():
+                break
+
+            # Damped Gauss-Newton step, with the damping scaled by the curvature of each parameter
+            r = np.nan_to_num(self.residual_values())
+            J = np.nan_to_num(self.jacobian(~done))
+            g = np.einsum('krp,kr->kp', J, r)
+            A = np.einsum('krp,krq->kpq', J, J)
+            diag = np.maximum(np.diagonal(A, axis1=1, axis2=2), 1e-9)
+            A_damped = A + damping[:, None, None] * np.eye(A.shape[1])[None] * diag[:, :, None]
+            try:
+                step = -np.linalg.solve(A_damped, g[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                step = -np.einsum('kpq,kq->kp', np.linalg.pinv(A_damped), g)
+            step[done] = 0.0
+
+            theta = self.params()
+            self.set_params(theta + step)
+            new_loss_v = np.broadcast_to(ad.value(self.loss), [self.batch_size])
+
+            # Steps that do not lower the loss are undone, and retried with more damping
+            accepted = np.isfinite(new_loss_v) & (new_loss_v < loss_v)
+            damping = np.where(accepted, damping / 3, np.maximum(damping * 2, MIN_DAMPING))
+            if not accepted[~done].all():
+                self.set_params(np.where(accepted[:, None], theta + step, theta))
+
+            reasons = stalls.check(np.where(accepted, new_loss_v, loss_v), np.linalg.norm(g, axis=1))
+            reasons[damping > MAX_DAMPING] = "damping"
+            self.abandon_candidates(i, reasons, done)
+
+        return models
@@ -0,0 +1,347 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import collections
+import itertools
+import numpy as np
+import random
+
+import autodiff as ad
+from optimizer import Optimizer, StallDetector
+from diagram import Diagram
+from util import select_candidate
+
+class NpPoint(collections.namedtuple("NpPoint", ["x", "y"])):
+    def __add__(self, p):  return NpPoint(self.x + p.x, self.y + p.y)
+    def __sub__(self, p):  return NpPoint(self.x - p.x, self.y - p.y)
+    def sdiv(self, z):     return NpPoint(self.x / z, self.y / z)
+    def smul(self, z):     return NpPoint(self.x * z, self.y * z)
+    def norm(self):        return ad.sqrt(self.x ** 2 + self.y ** 2)
+    def normalize(self):   return self.sdiv(self.norm())
+    def has_nan(self):     return np.logical_or(np.isnan(ad.value(self.x)), np.isnan(ad.value(self.y)))
+    def __str__(self):     return "(coords %f %f)" % (self.x, self.y)
+
+# Evaluates the construction over all n_inits initializations at once: every variable holds one
+# value per candidate, branches are selected elementwise, and the construction is recorded on an
+# autodiff tape that is replayed for each step of gradient descent
+class NumpyOptimizer(Optimizer):
+    def __init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, listener=None):
+        super().__init__(instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, listener)
+        self.batch_size = self.n_inits
+
+    def reset(self):
+        super().reset()
+        # Every operation on the variables is recorded here while the construction is built
+        self.tape = ad.Tape()
+        self.trainable_vars = list()
+
+    def get_point(self, x, y):
+        return NpPoint(x, y)
+
+    def simplify(self, p, method="all"):
+        return p
+
+    def register_var(self, val, trainable):
+        var = self.tape.var(val)
+        if trainable is None or trainable:
+            self.trainable_vars.append(var)
+        return var
+
+    def mkvar(self, name, shape=[], lo=-1.0, hi=1.0, trainable=None):
+        return self.register_var(np.random.uniform(low=lo, high=hi, size=[self.batch_size] + list(shape)), trainable)
+
+    def mk_normal_var(self, name, shape=[], mean=0.0, std=1.0, trainable=None):
+        return self.register_var(np.random.normal(loc=mean, scale=std, size=[self.batch_size] + list(shape)), trainable)
+
+    #####################
+    ## Math Utilities
+    ####################
+    def sum(self, xs):
+        return ad.sum_list(xs)
+
+    def sqrt(self, x):
+        return ad.sqrt(x)
+
+    def sin(self, x):
+        return ad.sin(x)
+
+    def cos(self, x):
+        return ad.cos(x)
+
+    def asin(self, x):
+        return ad.asin(x)
+
+    def acos(self, x):
+        return ad.acos(x)
+
+    def tanh(self, x):
+        return ad.tanh(x)
+
+    def atan2(self, x, y):
+        return ad.atan2(x, y)
+
+    def sigmoid(self, x):
+        return ad.sigmoid(x)
+
+    def const(self, x):
+        return np.float64(x)
+
+    def max(self, x, y):
+        return ad.maximum(x, y)
+
+    def min(self, x, y):
+        return ad.minimum(x, y)
+
+    def cond(self, cond, t_lam, f_lam):
+        # Both branches are built and selected per candidate, as in batched tensorflow
+        t, f = t_lam(), f_lam()
+        if isinstance(t, (list, tuple)):
+            return type(t)(*[self.cond(cond, lambda: x, lambda: y) for x, y in zip(t, f)]) \
+                if hasattr(t, "_fields") else type(t)(self.cond(cond, lambda: x, lambda: y) for x, y in zip(t, f))
+        return ad.where(cond, t, f)
+
+    def lt(self, x, y):
+        return ad.lt(x, y)
+
+    def lte(self, x, y):
+        return ad.le(x, y)
+
+    def gt(self, x, y):
+        return ad.gt(x, y)
+
+    def gte(self, x, y):
+        return ad.ge(x, y)
+
+    def eq(self, x, y):
+        return ad.eq(x, y)
+
+    def logical_or(self, x, y):
+        return ad.logical_or(x, y)
+
+    def logical_and(self, x, y):
+        return ad.logical_and(x, y)
+
+    def reduce_max(self, xs):
+        return ad.max_list(xs)
+
+    def reduce_min(self, xs):
+        return ad.min_list(xs)
+
+    def sign(self, x):
+        return ad.sign(x)
+
+    def abs(self, x):
+        return ad.abs(x)
+
+    def exp(self, x):
+        return ad.exp(x)
+
+    #####################
+    ## NumPy Utilities
+    ####################
+
+    # Errors are either one value per candidate or a list of them
+    def mk_non_zero(self, err):
+        if isinstance(err, list):
+            return ad.mean_list([self.mk_non_zero(e) for e in err])
+        return self.exp(- (err ** 2) * 20)
+
+    def mk_zero(self, err):
+        if isinstance(err, list):
+            return ad.mean_list([self.mk_zero(e) for e in err])
+        return err ** 2
+
+    def register_pt(self, p, P, save_name=True):
+        if save_name:
+            assert(isinstance(p.val, str))
+            assert(p not in self.name2pt)
+
+        # Non-finite coordinates are caught when the model is validated
+        self.all_points.append(P)
+        if save_name:
+            self.name2pt[p] = P
+        return P
+
+    def register_line(self, l, L):
+        assert(l not in self.name2line)
+        assert(isinstance(l.val, str))
+        self.name2line[l] = L
+        return L
+
+    def register_circ(self, c, C):
+        assert(c not in self.name2circ)
+        assert(isinstance(c.val, str))
+        self.name2circ[c] = C
+        return C
+
+    def register_loss(self, key, val, weight=1.0, requires_train=True):
+        assert(key not in self.losses)
+        self.losses[key] = weight * self.mk_zero(val)
+        if requires_train:
+            self.has_loss = True
+
+    def register_ndg(self, key, val, weight=1.0):
+        assert(key not in self.ndgs)
+        err = weight * self.mk_non_zero(val)
+        self.ndgs[key] = err
+
+        self.register_loss(key, err, weight)
+
+    def register_goal(self, key, val, negate):
+        assert(key not in self.goals)
+        if negate:
+            self.goals[key] = self.mk_non_zero(val)
+        else:
+            self.goals[key] = self.mk_zero(val)
+
+    def regularize_points(self):
+        if not self.name2pt:
+            return
+        norms = ad.mean_list([p.norm() for p in self.name2pt.values()])
+        self.register_loss("points", norms, self.opts['regularize_points'])
+
+    def make_points_distinct(self):
+        if len(self.name2pt) > 1 and random.random() < self.opts['distinct_prob']:
+            distincts = [self.dist(A, B) for A, B in itertools.combinations(self.name2pt.values(), 2)]
+            dloss     = self.mk_non_zero(distincts)
+            self.register_loss("distinct", dloss, self.opts['make_distinct'])
+
+    def print_losses(self, k=None):
+        losses, goals, ndgs = self.run([self.losses, self.goals, self.ndgs])
+        if k is not None:
+            losses, goals, ndgs = select_candidate([losses, goals, ndgs], k)
+        print("======== Print losses ==========")
+        print("-- Losses --")
+        for key, x in losses.items(): print("  %-50s %.10f" % (key, x))
+        print("-- Goals --")
+        for key, x in goals.items(): print("  %-50s %.10f" % (key, x))
+        print("-- NDGs --")
+        for key, x in ndgs.items(): print("  %-50s %.10f" % (key, x))
+        print("================================")
+
+    def freeze(self):
+        self.regularize_points()
+        self.make_points_distinct()
+        self.loss = self.sum(list(self.losses.values()))
+
+    def learning_rate(self, step):
+        opts = self.opts
+        return opts['learning_rate'] * opts['decay_rate'] ** (step / opts['decay_steps'])
+
+    def train(self):
+        opts = self.opts
+
+        # Adam, with the same defaults as tf.train.AdamOptimizer
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+        ms = [np.zeros_like(v.val) for v in self.trainable_vars]
+        vs = [np.zeros_like(v.val) for v in self.trainable_vars]
+
+        models = list()
+        done = np.zeros(self.batch_size, dtype=bool)
+        stalls = StallDetector(opts)
+
+        for i in range(opts['n_iterations']):
+
+            loss_v = np.broadcast_to(ad.value(self.loss), [self.batch_size])
+            learning_rate_v = self.learning_rate(i)
+
+            # Candidates that blew up are abandoned rather than aborting the batch
+            done |= ~np.isfinite(loss_v)
+            if done.all():
+                break
+
+            best = int(np.argmin(np.where(done, np.inf, loss_v)))
+            if self.verbosity > 0 or (i % self.opts['loss_freq'] == 0 and self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
+                print("[%6d] %16.12f || %10.6f || %d/%d active" % (i, loss_v[best], learning_rate_v, (~done).sum(), self.batch_size))
+            self.report_iteration(i, loss_v[best], learning_rate_v, active=int((~done).sum()))
+            if self.verbosity > 1 or (i % self.opts['losses_freq'] == 0 and self.opts['losses_freq'] > 0 and self.opts['verbosity'] > -1):
+                self.print_losses(best)
+            if i % self.opts['plot_freq'] == 0 and self.opts['plot_freq'] > 0 and self.opts['verbosity'] > -1:
+                self.get_model(best).plot(show_unnamed=self.opts['unnamed_objects'])
+
+            converged = np.flatnonzero((loss_v < opts['eps']) & ~done)
+            if converged.size > 0:
+                done[converged] = True
+                for k, model in zip(converged, self.get_models(converged)):
+                    if self.valid_model(model, k):
+                        self.add_model(models, model)
+                    if len(models) >= opts['n_models']:
+                        return models
+
+            if done.all():
+                break
+
+            # Finished candidates get a zero seed, so they stay where they are
+            self.tape.backward(self.loss, np.where(done, 0.0, 1.0))
+
+            # Candidates are independent, so each one's gradient is its slice of every variable's gradient
+            grad_sq = np.zeros(self.batch_size)
+            for var in self.trainable_vars:
+                if var.grad is not None:
+                    grad_sq += np.sum(np.reshape(var.grad ** 2, [self.batch_size, -1]), axis=1)
+
+            t = i + 1
+            lr_t = learning_rate_v * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+            for var, m, v in zip(self.trainable_vars, ms, vs):
+                if var.grad is None:
+                    continue
+                m *= beta1
+                m += (1 - beta1) * var.grad
+                v *= beta2
+                v += (1 - beta2) * var.grad ** 2
+                var.val = var.val - lr_t * m / (np.sqrt(v) + epsilon)
+
+            self.abandon_candidates(i, stalls.check(loss_v, np.sqrt(grad_sq)), done)
+            self.tape.forward()
+
+        return models
+
+    #####################
+    ## Core
+    ####################
+
+    def preprocess(self):
+        # NaNs and infinities are expected in bad candidates, and are rejected during validation
+        with np.errstate(all='ignore'):
+            super().preprocess()
+
+    def get_model(self, k=None):
+        return self.get_models([k])[0]
+
+    def get_models(self, ks):
+        assns = self.run([
+            self.name2pt, self.name2line, self.name2circ,
+            self.segments, self.unnamed_points, self.unnamed_lines, self.unnamed_circles,
+            self.ndgs, self.goals
+        ])
+
+        models = list()
+        for k in ks:
+            named_pt_assn, named_line_assn, named_circ_assn, segments, \
+                unnamed_points, unnamed_lines, unnamed_circles_assn, ndgs, goals = assns if k is None else select_candidate(assns, k)
+
+            models.append(Diagram(
+                named_points=named_pt_assn, named_lines=named_line_assn, named_circles=named_circ_assn,
+                segments=segments, seg_colors=self.seg_colors, unnamed_points=unnamed_points, unnamed_lines=unnamed_lines,
+                unnamed_circles=unnamed_circles_assn, ndgs=ndgs, goals=goals))
+        return models
+
+    def run(self, x):
+        return ad.evaluate(x)
+
+    def solve(self):
+        with np.errstate(all='ignore'):
+            if self.has_loss:
+                self.freeze()
+                return self.train()
+
+            models = list()
+            for k, model in enumerate(self.get_models(range(self.batch_size))):
+                if len(models) >= self.opts['n_models']:
+                    break
+                if self.valid_model(model, k):
+                    self.add_model(models, model)
+            return models
@@ -9,12 +9,12 @@ import math
 import pdb
 import collections
 import itertools
-import tensorflow.compat.v1 as tf
+import numpy as np
 import random
 from tqdm import tqdm
 
 from instruction import *
-from primitives import Line, Point, Circle, Num
+from primitives import Line, Point, Circle, Num, Primitive
 from util import is_number, FuncInfo
 
 
@@ -27,29 +27,60 @@ CircleNF = collections.namedtuple("CircleNF", ["center", "radius"])
 LineNF = collections.namedtuple("LineNF", ["n", "r"])
 
 
+class Stalled(Exception):
+    pass
+
+
+# Tells when a try stops making progress, either because its best loss improved by less than a fraction
+# stall_tol over the last stall_window iterations, or because its gradient norm fell below grad_floor.
+# Losses and gradient norms are either scalars or one value per candidate.
+class StallDetector:
+    def __init__(self, opts):
+        self.window = opts['stall_window']
+        self.tol = opts['stall_tol']
+        self.grad_floor = opts['grad_floor']
+        self.bests = collections.deque(maxlen=self.window + 1)
+
+    def check(self, loss, grad_norm=None):
+        # Returns why each try stalled, or None where it has not
+        loss = np.asarray(loss, dtype=np.float64)
+        best = loss if not self.bests else np.fmin(self.bests[-1], loss)
+        self.bests.append(best)
+
+        reasons = np.full(loss.shape, None, dtype=object)
+        if self.window > 0 and len(self.bests) > self.window:
+            old = self.bests[0]
+            reasons[old - best < self.tol * old] = "plateau"
+        if self.grad_floor > 0 and grad_norm is not None:
+            reasons[np.asarray(grad_norm) < self.grad_floor] = "gradient"
+        return reasons if reasons.ndim else reasons.item()
+
+
+def has_raw_val(term):
+    if isinstance(term, FuncInfo) and term.head == "__val__":
+        return True
+    elif isinstance(term, Primitive):
+        return has_raw_val(term.val)
+    elif isinstance(term, (list, tuple)):
+        return any(has_raw_val(t) for t in term)
+    return False
+
+
 
 class Optimizer(ABC):
-    def __init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors):
+    def __init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, listener=None):
 
-        self.losses = dict()
-        self.has_loss = False
         self.opts = opts
         self.verbosity = opts['verbosity']
         self.instructions = instructions
-        self.ndgs = dict()
-        self.goals = dict()
-
-        self.all_points = list()
+        self.seg_colors = seg_colors
 
-        self.name2pt = dict()
-        self.name2line = dict()
-        self.name2circ = dict()
+        # Called with an event name and its data as the search progresses, see report
+        self.listener = listener
 
-        self.segments = segments
-        self.seg_colors = seg_colors
-        self.unnamed_points = unnamed_points
-        self.unnamed_lines = unnamed_lines
-        self.unnamed_circles = unnamed_circles
+        # preprocess replaces the unnamed objects with their values, so keep the terms to rebuild from
+        self.unnamed_terms = (unnamed_points, unnamed_lines, unnamed_circles, segments)
+        self.reset()
 
         self.n_tries = opts['n_tries']
         if opts['n_tries'] < opts['n_models']:
@@ -63,6 +94,31 @@ class Optimizer(ABC):
 
         super().__init__()
 
+    def reset(self):
+        self.losses = dict()
+        self.has_loss = False
+        self.ndgs = dict()
+        self.goals = dict()
+
+        self.all_points = list()
+
+        self.name2pt = dict()
+        self.name2line = dict()
+        self.name2circ = dict()
+
+        # Values of unnamed terms, so that each distinct term is only built once
+        self.term_cache = dict()
+
+        # Whether a triangle has been placed on the fixed base, see sample_triangle. Subproblems of a
+        # decomposed problem other than the first may not use it, since their models are merged.
+        self.fixed_base_used = not self.opts.get('fixed_base', True)
+
+        unnamed_points, unnamed_lines, unnamed_circles, segments = self.unnamed_terms
+        self.unnamed_points = list(unnamed_points)
+        self.unnamed_lines = list(unnamed_lines)
+        self.unnamed_circles = list(unnamed_circles)
+        self.segments = list(segments)
+
     def preprocess(self):
         process_instr_iter = self.instructions if self.verbosity < 0 else tqdm(self.instructions, desc="Processing instructions...")
 
@@ -102,10 +158,21 @@ class Optimizer(ABC):
     def simplify(self, p, method="all"):
         pass
 
+    def memoize(self, kind, term, build):
+        # Terms wrapping raw backend values (__val__) are not structural, so never cache them
+        if has_raw_val(term):
+            return build()
+        key = (kind, term)
+        if key not in self.term_cache:
+            self.term_cache[key] = build()
+        return self.term_cache[key]
+
     def lookup_pt(self, p, name=None):
         if isinstance(p.val, str): # Base case
             return self.name2pt[p]
+        return self.memoize("pt", p, lambda: self.build_pt(p, name))
 
+    def build_pt(self, p, name=None):
         if isinstance(p.val, FuncInfo):
             head, args = p.val
             if head == "__val__":
@@ -263,6 +330,10 @@ class Optimizer(ABC):
     def make_points_distinct(self):
         pass
 
+    @abstractmethod
+    def print_losses(self, k=None):
+        pass
+
     # FIXME: The below should be combined with an abstract Point class
 
     #####################
@@ -346,6 +417,22 @@ class Optimizer(ABC):
     def logical_or(self, x, y):
         pass
 
+    @abstractmethod
+    def logical_and(self, x, y):
+        pass
+
+    @abstractmethod
+    def reduce_max(self, xs):
+        pass
+
+    @abstractmethod
+    def reduce_min(self, xs):
+        pass
+
+    @abstractmethod
+    def sign(self, x):
+        pass
+
     @abstractmethod
     def abs(self, x):
         pass
@@ -451,13 +538,27 @@ class Optimizer(ABC):
             return self.sample_triangle_on_unit_circ(ps)
 
         [nA, nB, nC] = ps
-        B = self.get_point(self.const(-2.0), self.const(0.0))
-        C = self.get_point(self.const(2.0), self.const(0.0))
+        name = f"{nA}_{nB}_{nC}"
+
+        # Triangles are built on the base from (-2, 0) to (2, 0). Only the first one is placed there, since
+        # any other would share its base: the others are placed on a base with free endpoints.
+        if not self.fixed_base_used:
+            self.fixed_base_used = True
+            place = self.get_point
+        else:
+            B0 = self.get_point(self.mkvar(f"{name}_base_Bx", lo=-2.0, hi=2.0), self.mkvar(f"{name}_base_By", lo=-2.0, hi=2.0))
+            C0 = self.get_point(self.mkvar(f"{name}_base_Cx", lo=-2.0, hi=2.0), self.mkvar(f"{name}_base_Cy", lo=-2.0, hi=2.0))
+            M, u = (B0 + C0).smul(0.5), (C0 - B0).smul(0.25)
+            v = self.rotate_counterclockwise_90(u)
+            place = lambda x, y: M + u.smul(x) + v.smul(y)
+
+        B = place(self.const(-2.0), self.const(0.0))
+        C = place(self.const(2.0), self.const(0.0))
 
         if iso is not None or equi:
             Ax = self.const(0)
         else:
-            Ax = self.mkvar("tri_x", lo=-1.2, hi=1.2, trainable=False)
+            Ax = self.mkvar(f"{name}_tri_x", lo=-1.2, hi=1.2, trainable=False)
 
         if right is not None:
             Ay = self.sqrt(4 - (Ax ** 2))
@@ -465,10 +566,10 @@ class Optimizer(ABC):
             Ay = 2 * self.sqrt(self.const(3.0))
         else:
             AyLo = 1.1 if acute else 0.4
-            z = self.mkvar("tri")
+            z = self.mkvar(f"{name}_tri")
             Ay = self.const(AyLo) + 3.0 * self.sigmoid(z)
 
-        A = self.get_point(Ax, Ay)
+        A = place(Ax, Ay)
 
         # Shuffle if the isosceles vertex was not C
         if iso == nB or right == nB:
@@ -765,7 +866,7 @@ class Optimizer(ABC):
         vals = self.assertion_vals(pred, args)
 
         # We only have to violate one!
-        ndg_val = tf.reduce_max(vals) # Note how we reduce MAX because we are trying to make non-zero
+        ndg_val = self.reduce_max(vals) # Note how we reduce MAX because we are trying to make non-zero
         ndg_str = f"not_{pred}_{'_'.join([str(a) for a in args])}"
         self.register_ndg(ndg_str, ndg_val, weight=1.0)
 
@@ -786,7 +887,7 @@ class Optimizer(ABC):
         g_str = f"{pred}_{'_'.join([str(a) for a in args])}"
         if negate:
             g_str = f"not_{g_str}"
-            vals = [tf.reduce_max(vals)]
+            vals = [self.reduce_max(vals)]
 
         for i, val in enumerate(vals):
             goal_str = g_str if len(vals) == 1 else f"{g_str}_{i}"
@@ -940,9 +1041,9 @@ class Optimizer(ABC):
             return [self.right_phi(A, B, C)]
         elif pred == "right-tri":
             A, B, C = self.lookup_pts(args)
-            return [tf.reduce_min([self.right_phi(A, B, C),
-                                   self.right_phi(B, A, C),
-                                   self.right_phi(B, C, A)])]
+            return [self.reduce_min([self.right_phi(A, B, C),
+                                     self.right_phi(B, A, C),
+                                     self.right_phi(B, C, A)])]
         elif pred == "same-side":
             a, b, l = args
             A, B = self.lookup_pts([a, b])
@@ -966,7 +1067,7 @@ class Optimizer(ABC):
             lhs = (x1 - x2) ** 2 + (y1 - y2) ** 2
             rhs_1 = (r1 - r2) ** 2
             rhs_2 = (r1 + r2) ** 2
-            return [tf.reduce_min([self.abs(lhs - rhs_1), self.abs(lhs - rhs_2)])]
+            return [self.reduce_min([self.abs(lhs - rhs_1), self.abs(lhs - rhs_2)])]
         elif pred == "tangent-lc":
             l, c = args
             inter_point = Point(FuncInfo("inter-lc", [l, c, Root("arbitrary", list())]))
@@ -1146,11 +1247,11 @@ class Optimizer(ABC):
                 return numer/denom
 
             def on_bad():
-                return numer/(tf.math.sign(denom) * 1e-4)
+                return numer/(self.sign(denom) * 1e-4)
 
-            return tf.cond(tf.less(tf.math.abs(denom), 1e-4),
-                           on_bad,
-                           on_ok)
+            return self.cond(self.lt(self.abs(denom), 1e-4),
+                             on_bad,
+                             on_ok)
 
         return self.get_point(x=inter_ll_aux(n22, n21, r2, n12, n11, r1),
                               y=inter_ll_aux(n11, n12, r1, n21, n22, r2))
@@ -1172,11 +1273,14 @@ class Optimizer(ABC):
             def sgnstar(x):
                 return self.cond(self.lt(x, self.const(0.0)), lambda: self.const(-1.0), lambda: self.const(1.0))
 
-            Q1 = self.get_point((D * dy + sgnstar(dy) * dx * self.sqrt(radicand)) / (dr**2),
-                                (-D * dx + self.abs(dy) * self.sqrt(radicand)) / (dr**2))
+            # Batched backends evaluate both branches, so keep the sqrt (and its gradient) finite
+            sqrt_radicand = self.sqrt(self.max(radicand, self.const(1e-12)))
+
+            Q1 = self.get_point((D * dy + sgnstar(dy) * dx * sqrt_radicand) / (dr**2),
+                                (-D * dx + self.abs(dy) * sqrt_radicand) / (dr**2))
 
-            Q2 = self.get_point((D * dy - sgnstar(dy) * dx * self.sqrt(radicand)) / (dr**2),
-                                (-D * dx - self.abs(dy) * self.sqrt(radicand)) / (dr**2))
+            Q2 = self.get_point((D * dy - sgnstar(dy) * dx * sqrt_radicand) / (dr**2),
+                                (-D * dx - self.abs(dy) * sqrt_radicand) / (dr**2))
             return self.unshift(O, [Q1, Q2])
 
         def on_neg():
@@ -1238,12 +1342,15 @@ class Optimizer(ABC):
         # FIXME: Fails on EGMO 2.7 because we aren't passing around lambdas anymore
         # pdb.set_trace()
         test = self.gt(self.abs(A), 1e-6)
+        # Batched backends evaluate both branches, so guard the denominator of the one not taken
+        A_safe = self.cond(test, lambda: A, lambda: self.const(1.0))
+        B_safe = self.cond(test, lambda: self.const(1.0), lambda: B)
         p1 = self.cond(test,
-                       lambda: self.get_point(x=(C-B)/A, y=self.const(1.0)),
-                       lambda: self.get_point(x=self.const(1.0), y=C/B))
+                       lambda: self.get_point(x=(C-B)/A_safe, y=self.const(1.0)),
+                       lambda: self.get_point(x=self.const(1.0), y=C/B_safe))
         p2 = self.cond(test,
-                       lambda: self.get_point(x=C/A, y=self.const(0.0)),
-                       lambda: self.get_point(x=self.const(0.0), y=C/B))
+                       lambda: self.get_point(x=C/A_safe, y=self.const(0.0)),
+                       lambda: self.get_point(x=self.const(0.0), y=C/B_safe))
 
         return p1, p2
 
@@ -1359,7 +1466,10 @@ class Optimizer(ABC):
         if isinstance(l.val, str):
             L = self.name2line[l]
             return self.lnf2pp(L)
-        elif isinstance(l.val, FuncInfo):
+        return self.memoize("two_pts", l, lambda: self.build_two_pts(l))
+
+    def build_two_pts(self, l):
+        if isinstance(l.val, FuncInfo):
             pred, args = l.val
             if pred == "connecting":
                 return self.lookup_pts(args)
@@ -1440,14 +1550,14 @@ class Optimizer(ABC):
         def mysterious_pp2pp(p1, p2):
             x,y = p2
             def pred(x,y):
-                return tf.logical_or(tf.math.less(y, self.const(0.0)),
-                                     tf.logical_and(tf.equal(y, self.const(0.0)), tf.math.less(x, self.const(0.0))))
-            return tf.compat.v1.cond(pred(x,y), lambda:(p1, p2.smul(-1.0)), lambda:(p1, p2))
+                return self.logical_or(self.lt(y, self.const(0.0)),
+                                       self.logical_and(self.eq(y, self.const(0.0)), self.lt(x, self.const(0.0))))
+            return self.cond(pred(x,y), lambda:(p1, p2.smul(-1.0)), lambda:(p1, p2))
 
         def pp2lnf_core(p1, p2):
             p1, p2 = mysterious_pp2pp(p1, p2)
             x , _ = p2
-            n = tf.compat.v1.cond(tf.less_equal(x,0.0), lambda: self.rotate_clockwise_90(p2), lambda: self.rotate_counterclockwise_90(p2))
+            n = self.cond(self.lte(x, self.const(0.0)), lambda: self.rotate_clockwise_90(p2), lambda: self.rotate_counterclockwise_90(p2))
             r = self.inner_product(p1, n)
             return LineNF(n=n, r=r)
 
@@ -1458,8 +1568,7 @@ class Optimizer(ABC):
         if isinstance(l.val, str):
             return self.name2line[l]
         else:
-            p1, p2 = self.line2twoPts(l)
-            return self.pp2lnf(p1, p2)
+            return self.memoize("line_nf", l, lambda: self.pp2lnf(*self.line2twoPts(l)))
 
     def pp2sf(self, p1, p2):
         def vert_line():
@@ -1484,10 +1593,12 @@ class Optimizer(ABC):
                                            calc_sf_from_slope_intercept))
 
     def circ2nf(self, circ):
-
         if isinstance(circ.val, str):
             return self.name2circ[circ]
-        elif isinstance(circ.val, FuncInfo):
+        return self.memoize("circ_nf", circ, lambda: self.build_circ(circ))
+
+    def build_circ(self, circ):
+        if isinstance(circ.val, FuncInfo):
 
             pred, args = circ.val
 
@@ -1569,17 +1680,62 @@ class Optimizer(ABC):
         else:
             raise NotImplementedError(f"[process_rs] NYI: {pred}")
 
-    def points_far_enough_away(self):
-        name2pt = self.run(self.name2pt)
-        min_dist = self.opts['min_dist']
-        for a, b in itertools.combinations(name2pt.keys(), 2):
-            A, B = name2pt[a], name2pt[b]
-            d = self.dist(A, B)
-            if d < min_dist:
-                if self.opts['verbosity'] >= 0:
-                    print(f"DUP: {a} {b}")
-                return False
+    # Validation runs on evaluated coordinates with plain NumPy, so it never touches the backend
+    def points_far_enough_away(self, name2pt):
+        names = list(name2pt.keys())
+        xys = np.array([[P.x, P.y] for P in name2pt.values()], dtype=np.float64).reshape(-1, 2)
+        if not np.isfinite(xys).all():
+            return False
+
+        dists = np.sqrt(((xys[:, None, :] - xys[None, :, :]) ** 2).sum(axis=-1))
+        dists[np.tril_indices(len(names))] = np.inf
+
+        too_close = dists < self.opts['min_dist']
+        if too_close.any():
+            if self.opts['verbosity'] >= 0:
+                i, j = np.argwhere(too_close)[0]
+                print(f"DUP: {names[i]} {names[j]}")
+            return False
         return True
 
+    def satisfies_goals(self, goals):
+        if not self.opts['enforce_goals'] or not goals:
+            return True
+
+        goal_vals = np.array(list(goals.values()), dtype=np.float64)
+        return not (goal_vals > self.opts['eps'] * 10).any()
+
+    def report(self, event, **data):
+        if self.listener is not None:
+            self.listener(event, data)
+
+    def report_iteration(self, i, loss, learning_rate, active=None):
+        if self.listener is not None and self.opts['progress_freq'] > 0 and i % self.opts['progress_freq'] == 0:
+            self.report("iteration", iteration=i, loss=float(loss), learning_rate=float(learning_rate), active=active)
+
+    def abandon(self, i, reason, loss):
+        # Ends the current try, which the solver then skips like any other failed try
+        self.report("abort", iteration=i, reason=reason, loss=float(loss))
+        raise Stalled(f"Abandoned at iteration {i}: {reason}")
+
+    def abandon_candidates(self, i, reasons, done):
+        # Marks the batched candidates that stalled as done, and returns how many there were
+        stalled = np.array([r is not None for r in reasons]) & ~done
+        for reason in set(reasons[stalled]):
+            self.report("abort", iteration=i, reason=reason, n_candidates=int((reasons[stalled] == reason).sum()))
+        done |= stalled
+        return int(stalled.sum())
+
+    def add_model(self, models, model):
+        models.append(model)
+        self.report("model", model=model)
+
+    def valid_model(self, model, k=None):
+        if self.verbosity > 0:
+            self.print_losses(k)
+        if self.points_far_enough_away(model.named_points) and self.satisfies_goals(model.goals):
+            return True
+        return False
+
     def diff_signs(self, x, y):
         return self.max(self.const(0.0), x * y)
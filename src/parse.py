@@ -4,59 +4,78 @@ Released under Apache 2.0 license as described in the file LICENSE.
 Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
-from typing import List
-import pdb
+import collections
+import re
+
+
+# Forms may span several lines, and comments run from ';' to the end of the line.
+# The whole program is read in one pass, without recursion, so very long or deeply nested
+# (e.g. machine-generated) programs parse in linear time.
+
+# 1-based lines and columns of the first character of a form or atom, and of the one after it
+Span = collections.namedtuple("Span", ["line", "col", "end_line", "end_col"])
+
+
+# Parsed forms are tuples and atoms are strings, as before, that also know where they were read from.
+# Positions are kept as plain ints, which the garbage collector need not track, and only made into a Span when asked for.
+class Form(tuple):
+    @property
+    def span(self):
+        return Span(self.line, self.col, self.end_line, self.end_col)
+
+class Atom(str):
+    @property
+    def span(self):
+        return Span(self.line, self.col, self.end_line, self.end_col)
+
+
+# Whitespace other than newlines is skipped by finditer
+TOKEN = re.compile(r"[()]|[^\s();]+|;[^\n]*|\n")
+
+
+def source_text(lines):
+    # Accepts the lines of a program, with or without their newlines, or the whole program as one string
+    if isinstance(lines, str):
+        return lines
+    return "".join(l if l.endswith("\n") else l + "\n" for l in lines)
+
 
 def parse_sexprs(lines):
-    def parse_sexpr(s :str):
-        return read_from_tokens(tokenize(s))
-
-    def tokenize(s :str):
-        result = s.replace('(',' ( ').replace(')',' ) ').split()
-
-        # discard comments
-        for i, tk in enumerate(result):
-          # if tk == ";;":
-          if tk[0] == ";":
-            return result[:i]
-
-        return result
-
-    def read_from_tokens(tokens :List[str]):
-        "Read an expression from a sequence of tokens."
-        if len(tokens) == 0:
-          return
-        token = tokens.pop(0)
-        if '(' == token:
-            L = []
-            while tokens[0] != ')':
-                L.append(read_from_tokens(tokens))
-            tokens.pop(0) # pop off ')'
-            return tuple(L)
-        elif ')' == token:
-            raise SyntaxError('unexpected )')
-        else:
-            return token
-
-    try:
-        result = list()
-        for l in lines:
-            sexp = parse_sexpr(l)
-            if sexp:
-                result.append(sexp)
-        return result
-    except:
-        raise RuntimeError("Could not parse s-expressions")
-
-    '''
-    with open(filename, 'r') as f:
-      result = []
-      for l in f.readlines():
-        sexp = parse_sexpr(l)
-        if sexp:
-          result.append(sexp)
-      return result
-    '''
+    text = source_text(lines)
+
+    result = list()
+    # Open forms, as the position of their '(' and the items read so far
+    stack = list()
+    items = result
+    line, line_start = 1, 0
+
+    for m in TOKEN.finditer(text):
+        token = m.group()
+        col = m.start() - line_start + 1
+        if token == "\n":
+            line, line_start = line + 1, m.end()
+        elif token == "(":
+            stack.append((line, col, items))
+            items = list()
+        elif token == ")":
+            if not stack:
+                raise RuntimeError(f"Could not parse s-expressions: unexpected ')' at line {line}, column {col}")
+            x = Form(items)
+            start_line, start_col, items = stack.pop()
+            x.line, x.col, x.end_line, x.end_col = start_line, start_col, line, col + 1
+            # Empty top-level forms are ignored
+            if x or stack:
+                items.append(x)
+        elif token[0] != ";":
+            x = Atom(token)
+            x.line, x.col, x.end_line, x.end_col = line, col, line, col + len(token)
+            items.append(x)
+
+    if stack:
+        line, col, _ = stack[-1]
+        raise RuntimeError(f"Could not parse s-expressions: '(' at line {line}, column {col} is never closed")
+    return result
+
 
 if __name__ == "__main__":
   import argparse
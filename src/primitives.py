@@ -12,6 +12,12 @@ import pdb
 from util import FuncInfo
 
 
+def freeze(val):
+    # FuncInfo args are sometimes built as lists, which are not hashable
+    if isinstance(val, (list, tuple)):
+        return tuple(freeze(v) for v in val)
+    return val
+
 
 class Primitive(ABC):
     def __init__(self, val):
@@ -27,7 +33,7 @@ class Primitive(ABC):
         return self.val == other.val
 
     def __hash__(self):
-        return hash(self.val)
+        return hash(freeze(self.val))
 
 
     @abstractmethod
@@ -0,0 +1,184 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import base64
+import math
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+
+# Draws diagrams as SVG directly from their coordinates, without matplotlib. The view is chosen like
+# Diagram.plot chooses its axes: it fits the points and circles with a margin, grows by 1 if there are
+# named lines, is clamped to [MIN_AXIS_VAL, MAX_AXIS_VAL], and is square. Lines are clipped to it.
+
+UNNAMED_ALPHA = 0.1
+MIN_AXIS_VAL = -10
+MAX_AXIS_VAL = 10
+MARGIN = 0.05
+
+# matplotlib's default color cycle, for named lines and circles
+PALETTE = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+POINT_COLOR = PALETTE[0]
+
+
+def xy(points):
+    return np.array([[float(P.x), float(P.y)] for P in points], dtype=np.float64).reshape(-1, 2)
+
+def pairs(objs):
+    # Lines as unit normals and offsets, circles as centers and radii
+    objs = list(objs)
+    return xy(o[0] for o in objs), np.array([float(o[1]) for o in objs], dtype=np.float64)
+
+
+def view_box(points, centers, radii, has_named_lines):
+    lo = np.concatenate([points, centers - radii[:, None]]).min(axis=0, initial=np.inf)
+    hi = np.concatenate([points, centers + radii[:, None]]).max(axis=0, initial=-np.inf)
+    if not np.isfinite(lo).all() or not np.isfinite(hi).all():
+        lo, hi = np.array([-2.0, -2.0]), np.array([2.0, 2.0])
+    else:
+        pad = np.maximum(hi - lo, 1e-6) * MARGIN
+        lo, hi = lo - pad, hi + pad
+        if has_named_lines:
+            lo, hi = lo - 1, hi + 1
+        lo, hi = np.maximum(lo, MIN_AXIS_VAL), np.minimum(hi, MAX_AXIS_VAL)
+
+    # Square, around the same center
+    center, half = (lo + hi) / 2, (hi - lo).max() / 2
+    return center - half, center + half
+
+
+def clip_lines(normals, offsets, lo, hi):
+    # Liang-Barsky for all lines at once: the line is p0 + t d, and stays in the box for t_in <= t <= t_out
+    p0 = normals * offsets[:, None]
+    d = np.stack([-normals[:, 1], normals[:, 0]], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_lo, t_hi = (lo - p0) / d, (hi - p0) / d
+    t_in = np.where(d != 0, np.minimum(t_lo, t_hi), np.where((p0 >= lo) & (p0 <= hi), -np.inf, np.inf)).max(axis=1)
+    t_out = np.where(d != 0, np.maximum(t_lo, t_hi), np.where((p0 >= lo) & (p0 <= hi), np.inf, -np.inf)).min(axis=1)
+    visible = t_in < t_out
+    # Lines that miss the box have infinite bounds, and are not drawn anyway
+    t_in, t_out = np.where(visible, t_in, 0.0), np.where(visible, t_out, 0.0)
+    return p0 + t_in[:, None] * d, p0 + t_out[:, None] * d, visible
+
+
+def render_svg(diagram, show_unnamed=True, size=480):
+    unnamed_points = diagram.unnamed_points if show_unnamed else list()
+    unnamed_lines = diagram.unnamed_lines if show_unnamed else list()
+    unnamed_circles = diagram.unnamed_circles if show_unnamed else list()
+
+    names = [str(p) for p in diagram.named_points.keys()]
+    points = xy(diagram.named_points.values())
+    u_points = xy(unnamed_points)
+    circle_names = [str(c) for c in diagram.named_circles.keys()]
+    centers, radii = pairs(diagram.named_circles.values())
+    u_centers, u_radii = pairs(unnamed_circles)
+    line_names = [str(l) for l in diagram.named_lines.keys()]
+    normals, offsets = pairs(diagram.named_lines.values())
+    u_normals, u_offsets = pairs(unnamed_lines)
+    seg_ends = xy(P for seg in diagram.segments for P in seg).reshape(-1, 2, 2)
+
+    lo, hi = view_box(np.concatenate([points, u_points]), np.concatenate([centers, u_centers]),
+                      np.concatenate([radii, u_radii]), bool(line_names))
+    scale = size / (hi - lo)[0]
+
+    def px(coords):
+        # Pixels grow downwards
+        return np.stack([(coords[..., 0] - lo[0]) * scale, (hi[1] - coords[..., 1]) * scale], axis=-1)
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}" '
+           f'font-family="sans-serif" font-size="12">',
+           f'<rect width="{size}" height="{size}" fill="white"/>']
+
+    def draw_lines(normals, offsets, attrs):
+        a, b, visible = clip_lines(normals, offsets, lo, hi)
+        a, b = px(a), px(b)
+        return [f'<line x1="{a[i, 0]:.2f}" y1="{a[i, 1]:.2f}" x2="{b[i, 0]:.2f}" y2="{b[i, 1]:.2f}" {attrs[i]}/>'
+                for i in np.flatnonzero(visible)]
+
+    def draw_circles(centers, radii, attrs):
+        c, r = px(centers), radii * scale
+        return [f'<circle cx="{c[i, 0]:.2f}" cy="{c[i, 1]:.2f}" r="{r[i]:.2f}" fill="none" {attrs[i]}/>'
+                for i in range(len(radii)) if np.isfinite(r[i]) and np.isfinite(c[i]).all()]
+
+    unnamed_style = f'stroke="black" stroke-opacity="{UNNAMED_ALPHA}"'
+    u = px(u_points)
+    out.extend(f'<circle cx="{x:.2f}" cy="{y:.2f}" r="3" fill="black" fill-opacity="{UNNAMED_ALPHA}"/>' for x, y in u)
+
+    s = px(seg_ends)
+    for (a, b), color in zip(s, diagram.seg_colors):
+        rgb = "rgb(%d,%d,%d)" % tuple(int(255 * float(v)) for v in color[:3])
+        out.append(f'<line x1="{a[0]:.2f}" y1="{a[1]:.2f}" x2="{b[0]:.2f}" y2="{b[1]:.2f}" stroke="{rgb}" stroke-width="1.5"/>')
+
+    circle_colors = [PALETTE[(len(line_names) + i) % len(PALETTE)] for i in range(len(circle_names))]
+    out.extend(draw_circles(centers, radii, [f'stroke="{c}" stroke-width="1.5"' for c in circle_colors]))
+    out.extend(draw_circles(u_centers, u_radii, [unnamed_style] * len(u_radii)))
+    out.extend(draw_lines(u_normals, u_offsets, [unnamed_style] * len(u_offsets)))
+    line_colors = [PALETTE[i % len(PALETTE)] for i in range(len(line_names))]
+    out.extend(draw_lines(normals, offsets, [f'stroke="{c}" stroke-width="1.5"' for c in line_colors]))
+
+    # Points and their labels go last, on top of everything else
+    p = px(points)
+    for name, (x, y) in zip(names, p):
+        out.append(f'<circle cx="{x:.2f}" cy="{y:.2f}" r="3.5" fill="{POINT_COLOR}"/>')
+        out.append(f'<text x="{x + 4:.2f}" y="{y - 4:.2f}">{escape(name)}</text>')
+
+    # Named lines and circles are told apart by a legend, as in Diagram.plot
+    legend = list(zip(line_names, line_colors)) + list(zip(circle_names, circle_colors))
+    if legend:
+        width = 30 + 7 * max(len(n) for n, _ in legend)
+        x0 = size - width - 8
+        out.append(f'<rect x="{x0}" y="8" width="{width}" height="{8 + 16 * len(legend)}" fill="white" fill-opacity="0.8" stroke="#cccccc"/>')
+        for i, (name, color) in enumerate(legend):
+            y = 20 + 16 * i
+            out.append(f'<line x1="{x0 + 6}" y1="{y}" x2="{x0 + 22}" y2="{y}" stroke="{color}" stroke-width="2"/>')
+            out.append(f'<text x="{x0 + 26}" y="{y + 4}">{escape(name)}</text>')
+
+    out.append('</svg>')
+    return "\n".join(out)
+
+
+def svg_to_png(svg):
+    # Rasterizing is optional, and needs cairosvg
+    try:
+        import cairosvg
+    except ImportError:
+        raise RuntimeError("Rendering PNG needs cairosvg, e.g. pip3 install cairosvg")
+    return cairosvg.svg2png(bytestring=svg.encode())
+
+
+def data_url(svg=None, png=None):
+    if png is not None:
+        return f"data:image/png;base64,{base64.b64encode(png).decode()}"
+    return f"data:image/svg+xml;base64,{base64.b64encode(svg.encode()).decode()}"
+
+
+# Geometry is rounded, since clients only draw it, while NDG and goal values are sent as they are
+UNNAMED_KEYS = ["unnamed_points", "unnamed_lines", "unnamed_circles"]
+GEOMETRY_KEYS = ["named_points", "named_lines", "named_circles", "segments"] + UNNAMED_KEYS
+
+def finite(x, digits=None):
+    # NaN and infinity are not valid JSON
+    if isinstance(x, dict):
+        return {k: finite(v, digits) for k, v in x.items()}
+    elif isinstance(x, list):
+        return [finite(v, digits) for v in x]
+    elif not math.isfinite(x):
+        return None
+    return x if digits is None else round(x, digits)
+
+
+def diagram_json(diagram, show_unnamed=True, digits=6):
+    # The content of a diagram for clients that draw it themselves, e.g. the bundled index.html
+    d = diagram.to_dict()
+    if not show_unnamed:
+        d.update({k: list() for k in UNNAMED_KEYS})
+    return {
+        **{k: finite(d[k], digits) for k in GEOMETRY_KEYS},
+        "seg_colors": finite(d["seg_colors"], 3),
+        "ndgs": finite(d["ndgs"]),
+        "goals": finite(d["goals"]),
+    }
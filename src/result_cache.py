@@ -0,0 +1,110 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from primitives import Primitive
+
+
+# Solved diagrams stored on disk as JSON, one file per problem, keyed by a hash of the parsed
+# instructions and of every option that can change the result. Reading a file marks it as
+# recently used, and the least recently used files are removed once the cache is too big.
+
+# Options that only affect what is printed or plotted
+IGNORED_OPTS = ["problem", "dir", "jobs", "lines", "verbosity", "plot_freq", "loss_freq", "losses_freq", "progress_freq",
+                "unnamed_objects", "cache", "cache_dir", "cache_size"]
+
+
+def canonical(x):
+    # A JSON-able form of parsed instructions that does not depend on how they print
+    if isinstance(x, Primitive):
+        return [type(x).__name__, canonical(x.val)]
+    elif isinstance(x, tuple) and hasattr(x, "_fields"):
+        return [type(x).__name__] + [canonical(v) for v in x]
+    elif isinstance(x, (list, tuple)):
+        return [canonical(v) for v in x]
+    elif isinstance(x, dict):
+        return {str(k): canonical(v) for k, v in x.items()}
+    elif isinstance(x, str):
+        # Names read from the source also carry their positions, which do not change the problem
+        return str(x)
+    elif hasattr(x, "__dict__"):
+        return [type(x).__name__, canonical(vars(x))]
+    return x
+
+
+def problem_key(instructions, reader, opts):
+    problem = {
+        "instructions": canonical(instructions),
+        "unnamed": canonical([reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles, reader.segments]),
+        "opts": {k: v for k, v in opts.items() if k not in IGNORED_OPTS},
+    }
+    return hashlib.sha256(json.dumps(problem, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class JsonCache:
+    def __init__(self, cache_dir, max_mb):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_mb * 1024 * 1024
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get_json(self, key, load):
+        # Returns load of the stored data, or None if it is missing or cannot be loaded
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                val = load(json.load(f))
+            os.utime(path)
+            return val
+        except (OSError, ValueError, KeyError):
+            # Missing, or left half-written or evicted by another process
+            return None
+
+    def put_json(self, key, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file first so that readers never see a partial result
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = list()
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+
+class ResultCache(JsonCache):
+    def get(self, key):
+        # Diagrams need numpy, which the compile cache, also a JsonCache, does not
+        from diagram import Diagram
+        return self.get_json(key, lambda d: [Diagram.from_dict(m) for m in d["models"]])
+
+    def put(self, key, models):
+        self.put_json(key, {"models": [m.to_dict() for m in models]})
@@ -0,0 +1,141 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+from decompose import names
+from instruction import *
+from primitives import Point, Line
+from util import FuncInfo
+
+
+# Some assertions only restrict an object to something the optimizer can already construct directly,
+# e.g. a sampled triangle asserted to be isosceles, or a free point asserted to be on a segment.
+# Such assertions are folded into how the object is sampled, parameterized or defined, which removes
+# a loss and a degree of freedom. An assertion is only folded into an object once, and only if the
+# construction it becomes does not mention objects that are defined after that object.
+
+# Samplers that one more assertion turns into another, by the kind of assertion
+TRIANGLE_UPGRADES = {
+    ("triangle", "iso"): "iso-tri",
+    ("acute-tri", "iso"): "acute-iso-tri",
+    ("iso-tri", "iso"): "equi-tri",
+    ("acute-iso-tri", "iso"): "equi-tri",
+    ("triangle", "right"): "right-tri",
+}
+
+# Assertions about a point, and the parameterizations of the point that satisfy them
+POINT_PARAMS = ["on-seg", "on-ray", "on-line", "on-circ"]
+
+
+def iso_apex(args):
+    # The common point of (cong X Y X Z), if Y and Z differ
+    (a, b), (c, d) = args[:2], args[2:]
+    for x, y in [(a, b), (b, a)]:
+        for z, w in [(c, d), (d, c)]:
+            if x == z and y != w and x != y and x != w:
+                return x
+    return None
+
+
+class Rewriter:
+    def __init__(self, instructions):
+        self.instructions = list(instructions)
+
+        # Where each named object is first sampled, parameterized or defined
+        self.defined_at = dict()
+        for k, i in enumerate(self.instructions):
+            objs = i.points if isinstance(i, Sample) else [i.obj_name] if isinstance(i, (Compute, Parameterize)) else list()
+            for obj in objs:
+                self.defined_at.setdefault(obj, k)
+
+        self.rewrites = list()
+
+    def defined_before(self, objs, k):
+        return all(self.defined_at.get(obj, len(self.instructions)) < k for obj in objs)
+
+    def replace(self, k, assertion, instr):
+        self.rewrites.append((assertion, self.instructions[k], instr))
+        self.instructions[k] = instr
+
+    def fold_triangle(self, assertion):
+        cons = assertion.constraint
+        if cons.pred == "cong" and len(cons.args) == 4:
+            kind, vertex = "iso", iso_apex(cons.args)
+        elif cons.pred == "right" and len(cons.args) == 3:
+            kind, vertex = "right", cons.args[1]
+        else:
+            return False
+
+        if vertex is None or vertex not in self.defined_at:
+            return False
+        k = self.defined_at[vertex]
+        sample = self.instructions[k]
+        if not isinstance(sample, Sample) or set(cons.args) != set(sample.points) or len(sample.points) != 3:
+            return False
+
+        # An isosceles triangle only becomes equilateral through a second apex
+        if sample.args and sample.args[0] == vertex:
+            return False
+        sampler = TRIANGLE_UPGRADES.get((sample.sampler, kind))
+        if sampler is None:
+            return False
+
+        self.replace(k, assertion, Sample(sample.points, sampler, () if sampler == "equi-tri" else (vertex,)))
+        return True
+
+    def fold_point(self, assertion):
+        cons = assertion.constraint
+        if cons.pred not in POINT_PARAMS or not isinstance(cons.args[0], Point):
+            return False
+
+        p, rest = cons.args[0], list(cons.args[1:])
+        k = self.defined_at.get(p)
+        if k is None:
+            return False
+        param = self.instructions[k]
+        if not (isinstance(param, Parameterize) and param.parameterization[0] == "coords"):
+            return False
+        if p in names(rest) or not self.defined_before(names(rest), k):
+            return False
+
+        self.replace(k, assertion, Parameterize(p, (cons.pred, rest)))
+        return True
+
+    def fold_line(self, assertion):
+        cons = assertion.constraint
+        if cons.pred not in ["perp", "para"] or len(cons.args) != 2:
+            return False
+
+        for l, other in [cons.args, cons.args[::-1]]:
+            k = self.defined_at.get(l)
+            if k is None:
+                continue
+            param = self.instructions[k]
+            if not (isinstance(param, Parameterize) and param.parameterization[0] == "through-l"):
+                continue
+            if l in names(other) or not self.defined_before(names(other), k):
+                continue
+
+            [through_p] = param.parameterization[1]
+            self.replace(k, assertion, Compute(l, Line(FuncInfo(f"{cons.pred}-at", [through_p, other]))))
+            return True
+        return False
+
+    def rewrite(self):
+        folded = set()
+        for k, i in enumerate(self.instructions):
+            if isinstance(i, Assert) and (self.fold_triangle(i) or self.fold_point(i) or self.fold_line(i)):
+                folded.add(k)
+        return [i for k, i in enumerate(self.instructions) if k not in folded]
+
+
+def rewrite(instructions, verbosity=0):
+    rewriter = Rewriter(instructions)
+    rewritten = rewriter.rewrite()
+
+    if verbosity >= 0:
+        for assertion, old, new in rewriter.rewrites:
+            print(f"Folded {assertion} into {new} (was {old})")
+    return rewritten
@@ -0,0 +1,325 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import collections
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+import uuid
+
+from render import data_url, diagram_json
+from util import DEFAULTS
+
+
+# A fixed set of worker processes that solve problems sent to them one at a time. Workers import
+# tensorflow and run a tiny problem once at startup, so requests do not pay for it.
+# Each worker talks to the pool through its own pipe: a worker that is killed half-way through
+# sending a message could leave a shared queue locked for all the others.
+# This module must not import the Flask app: spawned workers import it to find worker_loop.
+
+WARM_UP_LINES = ["(param A point)"]
+
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = 3600
+
+FINISHED = ["done", "error", "timeout"]
+
+# How diagrams are sent to clients: as SVG images to show, or as JSON coordinates to draw themselves.
+# Each format has its own keys, for the list of diagrams of a job and for each diagram.
+FORMATS = {"svg": ("srcs", "src"), "json": ("models", "model")}
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class UnknownJob(Exception):
+    # Never submitted, or finished more than JOB_TTL seconds ago
+    pass
+
+
+def to_json(data):
+    # NaN and infinity are not valid JSON
+    return {k: (None if isinstance(v, float) and not math.isfinite(v) else v) for k, v in data.items()}
+
+
+def encode_model(model, opts, fmt):
+    if fmt == "json":
+        return diagram_json(model, show_unnamed=opts['unnamed_objects'])
+    return data_url(svg=model.to_svg(show_unnamed=opts['unnamed_objects']))
+
+
+def solve_job(job_id, opts, fmt, conn):
+    from builder import build
+
+    # Models are sent as soon as they are found, rather than when the search ends
+    def listener(event, data):
+        if event == "model":
+            conn.send((job_id, "model", encode_model(data['model'], opts, fmt)))
+        else:
+            conn.send((job_id, "progress", dict(to_json(data), event=event)))
+
+    build(opts, show_plot=False, listener=listener)
+
+
+def warm_up():
+    from builder import build
+    opts = dict(DEFAULTS)
+    opts.update(lines=WARM_UP_LINES, verbosity=-1, plot_freq=-1, loss_freq=-1, losses_freq=-1)
+    build(opts, show_plot=False)
+
+
+def worker_loop(conn):
+    warm_up()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        job_id, opts, fmt = job
+        conn.send((job_id, "started", os.getpid()))
+        try:
+            solve_job(job_id, opts, fmt, conn)
+            conn.send((job_id, "done", None))
+        except Exception as e:
+            # Exceptions may not pickle, so only their message is sent back
+            conn.send((job_id, "error", str(e)))
+
+
+class Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.job_id = None # the job sent to it, until it is finished
+
+
+class Job:
+    def __init__(self, job_id, fmt):
+        self.id = job_id
+        self.format = fmt
+        self.status = "queued"
+        self.pid = None
+        self.started_at = None
+        self.finished_at = None
+        self.diagrams = list()
+        self.error = None
+        self.progress = None
+
+        # Everything clients are told about, in order, as pairs of event name and data
+        self.events = list()
+
+    def add_event(self, event, data):
+        self.events.append((event, data))
+
+    def summary(self):
+        diagrams_key, _ = FORMATS[self.format]
+        return {"id": self.id, "status": self.status, diagrams_key: list(self.diagrams), "error": self.error, "progress": self.progress}
+
+
+class SolverPool:
+    def __init__(self, n_workers, timeout):
+        # Forking a process that already runs tensorflow is unsafe, so workers start from scratch
+        self.ctx = multiprocessing.get_context("spawn")
+        self.timeout = timeout
+
+        # Guards all jobs and workers; notified whenever a job changes
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.all_jobs = dict() # job id -> Job
+        self.queue = collections.deque() # jobs not sent to a worker yet, as (job id, opts, format)
+        self.workers = dict() # pid -> Worker
+        self.closed = False
+
+        # The pipes collect reads from, which include those of restarted workers until they are drained,
+        # and a pipe to wake it up whenever they change
+        self.conns = dict() # connection -> Worker
+        self.wake_recv, self.wake_send = multiprocessing.Pipe(duplex=False)
+
+        for _ in range(n_workers):
+            self.spawn()
+
+        for target in [self.collect, self.watch]:
+            threading.Thread(target=target, daemon=True).start()
+
+    def spawn(self):
+        conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(target=worker_loop, args=(child_conn,), daemon=True)
+        process.start()
+        # Only the worker keeps its end open, so that the pipe closes when the worker exits
+        child_conn.close()
+
+        worker = Worker(process, conn)
+        self.workers[process.pid] = worker
+        self.conns[conn] = worker
+        self.wake_send.send(None)
+
+    def dispatch(self):
+        # Sends queued jobs to idle workers, in the order they were submitted
+        idle = [worker for worker in self.workers.values() if worker.job_id is None]
+        while self.queue and idle:
+            worker, job = idle.pop(0), self.queue.popleft()
+            worker.job_id = job[0]
+            try:
+                worker.conn.send(job)
+            except OSError:
+                # The worker has exited, and collect fails the job when it finds out
+                pass
+
+    def collect(self):
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                conns = list(self.conns)
+
+            for conn in multiprocessing.connection.wait(conns + [self.wake_recv]):
+                if conn is self.wake_recv:
+                    conn.recv()
+                    continue
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    self.lost(conn)
+                    continue
+                self.receive(self.conns[conn], msg)
+
+    def receive(self, worker, msg):
+        job_id, kind, payload = msg
+        with self.changed:
+            if kind in FINISHED:
+                worker.job_id = None
+                self.dispatch()
+
+            job = self.all_jobs.get(job_id)
+            # Late messages from jobs that timed out are dropped
+            if job is None or job.status in FINISHED:
+                return
+            if kind == "started":
+                job.status, job.pid, job.started_at = "running", payload, time.time()
+                job.add_event("status", {"status": "running"})
+            elif kind == "progress":
+                job.progress = payload
+                job.add_event("progress", payload)
+            elif kind == "model":
+                _, diagram_key = FORMATS[job.format]
+                job.diagrams.append(payload)
+                job.add_event("model", {diagram_key: payload})
+            else:
+                self.finish(job, kind, payload)
+            self.changed.notify_all()
+
+    def lost(self, conn):
+        # The pipe of a worker closed: either it was restarted, or it exited by itself
+        with self.changed:
+            worker = self.conns.pop(conn)
+            conn.close()
+            if self.workers.get(worker.process.pid) is not worker:
+                return
+            del self.workers[worker.process.pid]
+
+            job = self.all_jobs.get(worker.job_id)
+            if job is not None and job.status not in FINISHED:
+                self.finish(job, "error", "The worker solving this problem exited")
+            if not self.closed:
+                self.spawn()
+                self.dispatch()
+            self.changed.notify_all()
+
+    def finish(self, job, status, error=None):
+        job.status, job.error, job.finished_at = status, error, time.time()
+        job.add_event(status, job.summary())
+
+    def watch(self):
+        while True:
+            time.sleep(1)
+            now = time.time()
+            with self.changed:
+                for job_id, job in list(self.all_jobs.items()):
+                    if job.status == "running" and now - job.started_at > self.timeout:
+                        self.restart(job.pid)
+                        self.finish(job, "timeout", f"Timed out after {self.timeout} seconds")
+                    elif job.status in FINISHED and now - job.finished_at > JOB_TTL:
+                        del self.all_jobs[job_id]
+                self.changed.notify_all()
+
+    def restart(self, pid):
+        # Killing a worker only closes its own pipe, which collect drains and forgets
+        worker = self.workers.pop(pid)
+        worker.process.terminate()
+        worker.process.join()
+        self.spawn()
+        self.dispatch()
+
+    def submit(self, opts, fmt="svg"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt}, expected one of {', '.join(FORMATS)}")
+        job = Job(uuid.uuid4().hex, fmt)
+        with self.lock:
+            self.all_jobs[job.id] = job
+            self.queue.append((job.id, dict(opts), fmt))
+            self.dispatch()
+        return job.id
+
+    def get_job(self, job_id):
+        # Must be called with the lock held
+        job = self.all_jobs.get(job_id)
+        if job is None:
+            raise UnknownJob(f"Unknown job {job_id}")
+        return job
+
+    def status(self, job_id):
+        with self.lock:
+            return self.get_job(job_id).summary()
+
+    def events(self, job_id):
+        # The job is looked up right away, so that unknown jobs are reported before any event is sent
+        with self.lock:
+            job = self.get_job(job_id)
+        return self.job_events(job)
+
+    def job_events(self, job):
+        # Yields every event of the job, waiting for new ones until it finishes
+        seen = 0
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: len(job.events) > seen)
+                new_events = job.events[seen:]
+            seen += len(new_events)
+            for event, data in new_events:
+                yield event, data
+                if event in FINISHED:
+                    return
+
+    def solve(self, opts, fmt="svg"):
+        job_id = self.submit(opts, fmt)
+        with self.changed:
+            job = self.get_job(job_id)
+            self.changed.wait_for(lambda: job.status in FINISHED)
+        if job.status == "timeout":
+            raise JobTimeout(job.error)
+        elif job.status == "error":
+            raise RuntimeError(job.error)
+        return job.diagrams
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            for worker in self.workers.values():
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+            for worker in self.workers.values():
+                worker.process.join(timeout=1)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            self.workers = dict()
+            self.wake_send.send(None)
@@ -0,0 +1,341 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import tensorflow as tf
+import random
+import numpy as np
+
+from optimizer import Optimizer, StallDetector
+from diagram import Diagram
+from tf_optimizer import TfOptimizer
+from util import select_candidate
+
+
+# The same construction as TfOptimizer, in eager tensorflow. The construction is run eagerly once to
+# create the variables, and then traced into tf.functions that rebuild it from the current variable
+# values: one that evaluates everything, and one that takes an Adam step. With the xla option the
+# step is compiled by XLA, which fuses the many small scalar ops of the construction.
+class Tf2Optimizer(TfOptimizer):
+
+    def __init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, listener=None):
+        if not tf.executing_eagerly():
+            raise RuntimeError("The tf2 backend cannot run in a process that has already used the tf backend")
+
+        Optimizer.__init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, listener)
+
+        self.batched = opts['batched']
+        self.batch_size = self.n_inits
+        self.check_objects = opts['check_numerics'] and not self.batched
+        if opts['check_numerics'] and opts['xla'] and self.verbosity >= 0:
+            print("WARNING: XLA cannot check numerics, check_numerics is ignored")
+            self.check_objects = False
+        if opts['halving'] and self.batched and self.verbosity >= 0:
+            print("WARNING: halving is not supported in batched mode, and is ignored")
+
+        # Variables by name in creation order, and how to sample values of a given shape for each of them
+        self.tf_vars = dict()
+        self.samplers = dict()
+        self.replay_vals = None
+
+    def mk_sampled_var(self, name, shape, sample, trainable):
+        if self.replay_vals is not None:
+            return self.replay_vals[name]
+        if name not in self.tf_vars:
+            self.tf_vars[name] = tf.Variable(sample(self.var_shape(shape)), name=name, trainable=trainable is None or trainable)
+            self.samplers[name] = sample
+        # Reads the variable where the construction is traced
+        return tf.identity(self.tf_vars[name])
+
+    def mkvar(self, name, shape=[], lo=-1.0, hi=1.0, trainable=None):
+        return self.mk_sampled_var(name, shape, lambda shape: tf.random.uniform(shape, minval=lo, maxval=hi, dtype=tf.float64), trainable)
+
+    def mk_normal_var(self, name, shape=[], mean=0.0, std=1.0, trainable=None):
+        return self.mk_sampled_var(name, shape, lambda shape: tf.random.normal(shape, mean=mean, stddev=std, dtype=tf.float64), trainable)
+
+    def draw_vals(self):
+        return [self.samplers[name](var.shape) for name, var in self.tf_vars.items()]
+
+    #####################
+    ## Tracing
+    ####################
+
+    def preprocess(self):
+        # Saved so that the construction can be rebuilt with the same random choices
+        self.construction_rng = random.getstate()
+        super().preprocess()
+
+    def rebuild(self, fn, vals=None, batch_size=None):
+        # Runs the construction again on the current variable values, or on the given values by name with
+        # a leading axis of batch_size candidates, and returns fn() of the result
+        saved, rng = dict(self.__dict__), random.getstate()
+        try:
+            self.reset()
+            self.verbosity = -1
+            self.replay_vals = vals
+            if batch_size is not None:
+                self.batched, self.batch_size, self.check_objects = True, batch_size, False
+            random.setstate(self.construction_rng)
+            Optimizer.preprocess(self)
+            self.regularize_points()
+            self.make_points_distinct()
+            self.loss = sum(self.losses.values())
+            if self.batched:
+                self.loss = tf.broadcast_to(self.loss, [self.batch_size])
+            return fn()
+        finally:
+            self.__dict__.clear()
+            self.__dict__.update(saved)
+            random.setstate(rng)
+
+    # Everything get_models and print_losses need, as dicts and lists
+    FIELDS = ["name2pt", "name2line", "name2circ", "segments", "unnamed_points", "unnamed_lines", "unnamed_circles",
+              "ndgs", "goals", "losses"]
+
+    def flat_fields(self, keys):
+        # tf.functions can only return dicts with sortable keys, so dicts are returned as lists of
+        # values and their keys are kept aside while tracing
+        fields = list()
+        for field in self.FIELDS:
+            x = getattr(self, field)
+            if isinstance(x, dict):
+                keys[field] = list(x.keys())
+                x = list(x.values())
+            fields.append(x)
+        return fields
+
+    def freeze(self):
+        opts = self.opts
+        self.trainable_vars = [v for v in self.tf_vars.values() if v.trainable]
+        self.field_keys = dict()
+
+        def train_loss(loss):
+            if self.batched:
+                # Candidates are independent so we descend on their sum, ignoring those that blew up
+                return tf.reduce_sum(tf.where(tf.math.is_finite(loss), loss, tf.zeros_like(loss)))
+            return loss
+
+        def evaluate():
+            return self.rebuild(lambda: [self.loss, self.flat_fields(self.field_keys)])
+
+        def step():
+            # Returns the loss before the step, the values it was computed from and the gradient norm
+            vals = [tf.identity(v) for v in self.tf_vars.values()]
+            with tf.GradientTape() as tape:
+                loss = self.rebuild(lambda: self.loss)
+                total = train_loss(loss)
+            grads = tape.gradient(total, self.trainable_vars)
+            grads = [tf.zeros_like(v) if g is None else g for g, v in zip(grads, self.trainable_vars)]
+            self.adam.apply_gradients(zip(grads, self.trainable_vars))
+            return loss, vals, self.grad_norms(grads)
+
+        self.learning_rate = tf.keras.optimizers.schedules.ExponentialDecay(
+            initial_learning_rate=opts['learning_rate'],
+            decay_steps=opts['decay_steps'],
+            decay_rate=opts['decay_rate'],
+            staircase=False)
+        # Same epsilon as tf.train.AdamOptimizer
+        self.adam = tf.keras.optimizers.Adam(learning_rate=self.learning_rate, epsilon=1e-8)
+        self.adam.build(self.trainable_vars)
+
+        self.evaluate = tf.function(evaluate, autograph=False)
+        self.step = tf.function(step, autograph=False, jit_compile=opts['xla'])
+
+    def restore(self, vals):
+        # Initializations only set the variables of the construction, and snapshots the optimizer too
+        for var, val in zip(list(self.tf_vars.values()) + list(self.adam.variables), vals):
+            var.assign(val)
+
+    def snapshot(self):
+        return [var.numpy() for var in list(self.tf_vars.values()) + list(self.adam.variables)]
+
+    def reset_adam(self):
+        # Clears the moments and the step count of the learning rate schedule
+        for var in self.adam.variables:
+            var.assign(tf.zeros_like(var))
+
+    def gen_inits(self):
+        n_inits = self.n_inits
+
+        # All initializations are drawn at once, and their losses come from a single eager evaluation of
+        # the construction over all of them
+        samples = {name: self.samplers[name]([n_inits] + var.shape.as_list()) for name, var in self.tf_vars.items()}
+        loss_vals = self.rebuild(lambda: self.loss, samples, batch_size=n_inits).numpy()
+        sample_vals = {name: val.numpy() for name, val in samples.items()}
+
+        # NaN losses sort last, see TfOptimizer.gen_inits
+        order = np.argsort(loss_vals, kind="stable")
+        self.sorted_inits = [([sample_vals[name][k] for name in self.tf_vars], loss_vals[k]) for k in order]
+
+    #####################
+    ## Values
+    ####################
+
+    def current(self):
+        # The values of all fields on the current variables, with dicts rebuilt from their keys
+        _, fields = tf.nest.map_structure(lambda x: x.numpy() if hasattr(x, "numpy") else x, self.evaluate())
+        return {field: dict(zip(self.field_keys[field], x)) if field in self.field_keys else x
+                for field, x in zip(self.FIELDS, fields)}
+
+    def print_losses(self, k=None):
+        vals = self.current()
+        losses, goals, ndgs = vals["losses"], vals["goals"], vals["ndgs"]
+        if k is not None:
+            losses, goals, ndgs = select_candidate([losses, goals, ndgs], k)
+        print("======== Print losses ==========")
+        print("-- Losses --")
+        for key, x in losses.items(): print("  %-50s %.10f" % (key, x))
+        print("-- Goals --")
+        for key, x in goals.items(): print("  %-50s %.10f" % (key, x))
+        print("-- NDGs --")
+        for key, x in ndgs.items(): print("  %-50s %.10f" % (key, x))
+        print("================================")
+
+    def get_models(self, ks):
+        vals = self.current()
+        assns = [vals[field] for field in self.FIELDS[:-1]]
+
+        models = list()
+        for k in ks:
+            named_pt_assn, named_line_assn, named_circ_assn, segments, \
+                unnamed_points, unnamed_lines, unnamed_circles_assn, ndgs, goals = assns if k is None else select_candidate(assns, k)
+
+            models.append(Diagram(
+                named_points=named_pt_assn, named_lines=named_line_assn, named_circles=named_circ_assn,
+                segments=segments, seg_colors=self.seg_colors, unnamed_points=unnamed_points, unnamed_lines=unnamed_lines,
+                unnamed_circles=unnamed_circles_assn, ndgs=ndgs, goals=goals))
+        return models
+
+    #####################
+    ## Core
+    ####################
+
+    def train(self, init_vals, start=0, stop=None):
+        opts = self.opts
+
+        self.restore(init_vals)
+        if start == 0:
+            self.reset_adam()
+
+        loss_v = None
+        stalls = StallDetector(opts)
+
+        for i in range(start, opts['n_iterations'] if stop is None else stop):
+
+            loss, vals, grad_norm = self.step()
+            loss_v = loss.numpy()
+            learning_rate_v = self.learning_rate(i).numpy()
+
+            if self.verbosity > 0 or (i % self.opts['loss_freq'] == 0 and self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
+                print("[%6d] %16.12f || %10.6f" % (i, loss_v, learning_rate_v))
+            self.report_iteration(i, loss_v, learning_rate_v)
+
+            if not np.isfinite(loss_v):
+                raise RuntimeError(f"Loss is not finite at iteration {i}, use check_numerics to find where")
+            elif loss_v < opts['eps']:
+                # The step already moved on, so go back to where the loss was computed
+                self.restore(vals)
+                if opts['verbosity'] >= 0:
+                    self.print_losses()
+                return loss_v
+
+            reason = stalls.check(loss_v, grad_norm.numpy())
+            if reason is not None:
+                self.abandon(i, reason, loss_v)
+
+        return loss_v
+
+    def train_batched(self):
+        opts = self.opts
+
+        self.reset_adam()
+
+        models = list()
+        done = np.zeros(self.batch_size, dtype=bool)
+        stalls = StallDetector(opts)
+
+        for i in range(opts['n_iterations']):
+
+            loss, vals, grad_norm = self.step()
+            loss_v = loss.numpy()
+            learning_rate_v = self.learning_rate(i).numpy()
+
+            # Candidates that blew up are abandoned rather than aborting the batch
+            done |= ~np.isfinite(loss_v)
+            if done.all():
+                break
+
+            best = int(np.argmin(np.where(done, np.inf, loss_v)))
+            if self.verbosity > 0 or (i % self.opts['loss_freq'] == 0 and self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
+                print("[%6d] %16.12f || %10.6f || %d/%d active" % (i, loss_v[best], learning_rate_v, (~done).sum(), self.batch_size))
+            self.report_iteration(i, loss_v[best], learning_rate_v, active=int((~done).sum()))
+
+            converged = np.flatnonzero((loss_v < opts['eps']) & ~done)
+            if converged.size > 0:
+                done[converged] = True
+                self.restore(vals)
+                for k, model in zip(converged, self.get_models(converged)):
+                    if self.valid_model(model, k):
+                        self.add_model(models, model)
+                    if len(models) >= opts['n_models']:
+                        return models
+
+            self.abandon_candidates(i, stalls.check(loss_v, grad_norm.numpy()), done)
+            if done.all():
+                break
+
+        return models
+
+    def solve(self):
+        self.freeze()
+
+        if self.batched:
+            if self.has_loss:
+                return self.train_batched()
+
+            models = list()
+            for k, model in enumerate(self.get_models(range(self.batch_size))):
+                if len(models) >= self.opts['n_models']:
+                    break
+                if self.valid_model(model, k):
+                    self.add_model(models, model)
+            return models
+
+        if self.has_loss:
+            self.gen_inits()
+            if self.opts['halving']:
+                return self.solve_halving()
+
+        models = list()
+
+        for i in range(self.n_tries):
+
+            # Stop when we have enough
+            if len(models) >= self.opts['n_models']:
+                return models
+
+            self.report("try", index=i, n_tries=self.n_tries)
+
+            if not self.has_loss:
+                self.restore(self.draw_vals())
+                model = self.get_model()
+                if self.valid_model(model):
+                    self.add_model(models, model)
+            else:
+                loss = None
+                try:
+                    loss = self.train(init_vals=self.sorted_inits[i][0])
+                except Exception as e:
+                    if self.verbosity > 0:
+                        print(f"ERROR: {e}")
+
+                if loss is not None and loss < self.opts['eps']:
+                    model = self.get_model()
+                    if self.valid_model(model):
+                        self.add_model(models, model)
+        return models
@@ -4,18 +4,23 @@ Released under Apache 2.0 license as described in the file LICENSE.
 Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
 import tensorflow.compat.v1 as tf
 import pdb
 import collections
 import random
 import itertools
-from tqdm import tqdm
-import os
-import glob
+import numpy as np
 
-from optimizer import Optimizer, LineSF, CircleNF
+from optimizer import Optimizer, StallDetector, LineSF, CircleNF
 from diagram import Diagram
-from util import get_random_string
+from util import select_candidate
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+
 
 class TfPoint(collections.namedtuple("TfPoint", ["x", "y"])):
     def __add__(self, p):  return TfPoint(self.x + p.x, self.y + p.y)
@@ -23,19 +28,45 @@ class TfPoint(collections.namedtuple("TfPoint", ["x", "y"])):
     def sdiv(self, z):     return TfPoint(self.x / z, self.y / z)
     def smul(self, z):     return TfPoint(self.x * z, self.y * z)
     def to_tf(self):       return tf.cast([self.x, self.y], dtype=tf.float64)
-    def norm(self):        return tf.norm(self.to_tf(), ord=2)
+    def norm(self):        return tf.math.sqrt(self.x ** 2 + self.y ** 2)
     def normalize(self):   return self.sdiv(self.norm())
     def has_nan(self):     return tf.logical_or(tf.math.is_nan(self.x), tf.math.is_nan(self.y))
     def __str__(self):     return "(coords %f %f)" % (self.x, self.y)
 
 class TfOptimizer(Optimizer):
 
-    def __init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, graph):
+    def __init__(self, instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, graph, listener=None):
         # tfcfg = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1, device_count={"CPU": 3})
         tfcfg = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
         self.sess = tf.Session(graph=graph, config=tfcfg)
 
-        super().__init__(instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors)
+        super().__init__(instructions, opts, unnamed_points, unnamed_lines, unnamed_circles, segments, seg_colors, listener)
+
+        # In batched mode every variable carries a leading dimension with one entry per initialization
+        self.batched = opts['batched']
+        self.batch_size = self.n_inits
+
+        self.in_graph = opts['in_graph'] and not self.batched
+        if opts['in_graph'] and self.batched and self.verbosity >= 0:
+            print("WARNING: in_graph is not supported in batched mode, and is ignored")
+        if opts['in_graph'] and opts['halving'] and not self.batched:
+            # Tries are resumed from Python between rounds
+            if self.verbosity >= 0:
+                print("WARNING: in_graph is not supported with halving, and is ignored")
+            self.in_graph = False
+        if opts['halving'] and self.batched and self.verbosity >= 0:
+            print("WARNING: halving is not supported in batched mode, and is ignored")
+
+        # Checking every object on every step is slow, so by default only the total loss is checked.
+        # A single diverging candidate must not abort the whole batch, so batched mode never checks objects.
+        self.check_objects = opts['check_numerics'] and not self.batched
+
+        # Variables in creation order, and their values by name while the construction is replayed
+        self.vars = list()
+        self.replay_vals = None
+
+        # Draws n values of each variable by name, for screening initializations
+        self.samplers = dict()
 
     def get_point(self, x, y):
         return TfPoint(x, y)
@@ -43,19 +74,39 @@ class TfOptimizer(Optimizer):
     def simplify(self, p, method="all"):
         return p
 
+    def var_shape(self, shape):
+        return [self.batch_size] + list(shape) if self.batched else shape
+
     def mkvar(self, name, shape=[], lo=-1.0, hi=1.0, trainable=None):
+        if self.replay_vals is not None:
+            return self.replay_vals[name]
         init = tf.random_uniform_initializer(minval=lo, maxval=hi)
-        return tf.compat.v1.get_variable(name=name, shape=shape, dtype=tf.float64, initializer=init, trainable=trainable)
+        var = tf.compat.v1.get_variable(name=name, shape=self.var_shape(shape), dtype=tf.float64, initializer=init, trainable=trainable)
+        self.vars.append(var)
+        self.samplers[name] = lambda n: tf.random.uniform([n] + list(shape), minval=lo, maxval=hi, dtype=tf.float64)
+        return var
 
     def mk_normal_var(self, name, shape=[], mean=0.0, std=1.0, trainable=None):
+        if self.replay_vals is not None:
+            return self.replay_vals[name]
         init = tf.random_normal_initializer(mean=mean, stddev=std)
-        return tf.compat.v1.get_variable(name=name, shape=shape, dtype=tf.float64, initializer=init, trainable=trainable)
+        var = tf.compat.v1.get_variable(name=name, shape=self.var_shape(shape), dtype=tf.float64, initializer=init, trainable=trainable)
+        self.vars.append(var)
+        self.samplers[name] = lambda n: tf.random.normal([n] + list(shape), mean=mean, stddev=std, dtype=tf.float64)
+        return var
 
     #####################
     ## Math Utilities
     ####################
+    def stack(self, xs):
+        xs = [tf.cast(x, dtype=tf.float64) for x in xs]
+        if self.batched:
+            # Values built only from constants have no candidate axis yet
+            xs = [tf.broadcast_to(x, [self.batch_size]) for x in xs]
+        return tf.stack(xs, axis=-1)
+
     def sum(self, xs):
-        return tf.reduce_sum(xs)
+        return tf.reduce_sum(self.stack(xs), axis=-1)
 
     def sqrt(self, x):
         return tf.math.sqrt(x)
@@ -91,7 +142,11 @@ class TfOptimizer(Optimizer):
         return tf.minimum(x, y)
 
     def cond(self, cond, t_lam, f_lam):
-        return tf.cond(cond, t_lam, f_lam)
+        if not self.batched:
+            # Grappler cannot sort graphs where a branch returns a captured tensor unchanged, so both branches return identities
+            return tf.cond(cond, lambda: tf.nest.map_structure(tf.identity, t_lam()), lambda: tf.nest.map_structure(tf.identity, f_lam()))
+        # Each candidate takes its own branch, so evaluate both and select elementwise
+        return tf.nest.map_structure(lambda t, f: tf.where_v2(cond, t, f), t_lam(), f_lam())
 
     def lt(self, x, y):
         return tf.less(x, y)
@@ -111,6 +166,18 @@ class TfOptimizer(Optimizer):
     def logical_or(self, x, y):
         return tf.logical_or(x, y)
 
+    def logical_and(self, x, y):
+        return tf.logical_and(x, y)
+
+    def reduce_max(self, xs):
+        return tf.reduce_max(self.stack(xs), axis=-1)
+
+    def reduce_min(self, xs):
+        return tf.reduce_min(self.stack(xs), axis=-1)
+
+    def sign(self, x):
+        return tf.math.sign(x)
+
     def abs(self, x):
         return tf.math.abs(x)
 
@@ -121,24 +188,33 @@ class TfOptimizer(Optimizer):
     ## Tensorflow Utilities
     ####################
 
+    def loss_axes(self, err):
+        # Reduce everything but the leading (candidate) axis when batched
+        return list(range(1, err.shape.rank)) if self.batched else None
+
     def mk_non_zero(self, err):
-        res = tf.reduce_mean(tf.exp(- (err ** 2) * 20))
-        tf.check_numerics(res, message="mk_non_zero")
-        return res
+        err = tf.convert_to_tensor(err, dtype=tf.float64)
+        res = tf.reduce_mean(tf.exp(- (err ** 2) * 20), axis=self.loss_axes(err))
+        return self.check_numerics(res, message="mk_non_zero")
 
     def mk_zero(self, err):
-        res = tf.reduce_mean(err**2)
-        tf.check_numerics(res, message="mk_zero")
-        return res
+        err = tf.convert_to_tensor(err, dtype=tf.float64)
+        res = tf.reduce_mean(err**2, axis=self.loss_axes(err))
+        return self.check_numerics(res, message="mk_zero")
+
+    def check_numerics(self, x, message):
+        return tf.debugging.check_numerics(x, message=message) if self.check_objects else x
 
     def register_pt(self, p, P, save_name=True):
         if save_name:
             assert(isinstance(p.val, str))
             assert(p not in self.name2pt)
 
-        Px = tf.debugging.check_numerics(P.x, message=str(p))
-        Py = tf.debugging.check_numerics(P.y, message=str(p))
-        P_checked = self.get_point(Px, Py)
+        if self.check_objects:
+            P_checked = self.get_point(self.check_numerics(P.x, message=str(p)), self.check_numerics(P.y, message=str(p)))
+        else:
+            # Non-finite coordinates are caught when the model is validated
+            P_checked = P
         self.all_points.append(P_checked)
         if save_name:
             self.name2pt[p] = P_checked
@@ -154,8 +230,10 @@ class TfOptimizer(Optimizer):
     def register_circ(self, c, C):
         assert(c not in self.name2circ)
         assert(isinstance(c.val, str))
-        r = tf.debugging.check_numerics(C.radius, message=str(c))
-        C_checked = CircleNF(center=C.center, radius=r)
+        if self.check_objects:
+            C_checked = CircleNF(center=C.center, radius=self.check_numerics(C.radius, message=str(c)))
+        else:
+            C_checked = C
         self.name2circ[c] = C_checked
         return C_checked
 
@@ -185,13 +263,15 @@ class TfOptimizer(Optimizer):
             self.goals[key] = self.mk_zero(val)
 
     def regularize_points(self):
-        norms = tf.cast([p.norm() for p in self.name2pt.values()], dtype=tf.float64)
-        self.register_loss("points", tf.reduce_mean(norms), self.opts['regularize_points'])
+        if not self.name2pt:
+            return
+        norms = self.stack([p.norm() for p in self.name2pt.values()])
+        self.register_loss("points", tf.reduce_mean(norms, axis=-1), self.opts['regularize_points'])
 
     def make_points_distinct(self):
-        if random.random() < self.opts['distinct_prob']:
-            distincts = tf.cast([self.dist(A, B) for A, B in itertools.combinations(self.name2pt.values(), 2)], tf.float64)
-            dloss     = tf.reduce_mean(self.mk_non_zero(distincts))
+        if len(self.name2pt) > 1 and random.random() < self.opts['distinct_prob']:
+            distincts = self.stack([self.dist(A, B) for A, B in itertools.combinations(self.name2pt.values(), 2)])
+            dloss     = self.mk_non_zero(distincts)
             self.register_loss("distinct", dloss, self.opts['make_distinct'])
 
     def freeze(self):
@@ -199,6 +279,12 @@ class TfOptimizer(Optimizer):
         self.regularize_points()
         self.make_points_distinct()
         self.loss = sum(self.losses.values())
+        if self.batched:
+            # One loss per candidate; candidates are independent so we descend on their sum
+            self.loss = tf.broadcast_to(self.loss, [self.batch_size])
+            train_loss = tf.reduce_sum(tf.where_v2(tf.math.is_finite(self.loss), self.loss, 0.0))
+        else:
+            train_loss = self.loss
         self.global_step = tf.train.get_or_create_global_step()
         self.learning_rate = tf.train.exponential_decay(
             global_step=self.global_step,
@@ -207,130 +293,354 @@ class TfOptimizer(Optimizer):
             decay_rate=opts['decay_rate'],
             staircase=False)
         optimizer         = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
-        gs, vs            = zip(*optimizer.compute_gradients(self.loss))
+        gs, vs            = zip(*optimizer.compute_gradients(train_loss))
         self.apply_grads  = optimizer.apply_gradients(zip(gs, vs), name='apply_gradients', global_step=self.global_step)
+        self.grad_norm    = self.grad_norms(gs)
         self.reset_step   = tf.assign(self.global_step, 0)
-        self.gen_inits()
+        if self.in_graph:
+            self.build_train_loop(dict(zip(vs, gs)))
+        self.global_init  = tf.compat.v1.global_variables_initializer()
+        if not self.batched:
+            self.gen_inits()
+
+    def grad_norms(self, grads):
+        # The norm of the gradient of each candidate's loss, which in batched mode is the slice of the
+        # gradient of the summed loss at that candidate
+        grads = [g for g in grads if g is not None]
+        if not grads:
+            return tf.zeros([self.batch_size] if self.batched else [], dtype=tf.float64)
+        if self.batched:
+            return tf.sqrt(tf.add_n([tf.reduce_sum(tf.reshape(g ** 2, [self.batch_size, -1]), axis=1) for g in grads]))
+        return tf.linalg.global_norm(grads)
+
+    def apply_step(self, fetch_grad_norm):
+        # The gradient norm comes from the same run as the step, so it costs nothing to compute
+        if fetch_grad_norm:
+            return self.sess.run([self.apply_grads, self.grad_norm])[1]
+        self.sess.run(self.apply_grads)
+        return None
+
+    def preprocess(self):
+        # Saved so that the construction can be replayed with the same random choices
+        self.construction_rng = random.getstate()
+        super().preprocess()
+
+    def replay_loss(self, vals, batch_size=None):
+        # Rebuilds the construction and its losses on top of the given variable values, which have a
+        # leading axis of batch_size candidates if it is given
+        saved, rng = dict(self.__dict__), random.getstate()
+        try:
+            self.reset()
+            self.verbosity = -1
+            self.replay_vals = vals
+            if batch_size is not None:
+                self.batched, self.batch_size, self.check_objects = True, batch_size, False
+            random.setstate(self.construction_rng)
+            super().preprocess()
+            self.regularize_points()
+            self.make_points_distinct()
+            loss = sum(self.losses.values())
+            return loss if batch_size is None else tf.broadcast_to(loss, [batch_size])
+        finally:
+            self.__dict__.clear()
+            self.__dict__.update(saved)
+            random.setstate(rng)
+
+    def build_train_loop(self, var2grad):
+        opts = self.opts
 
-    def print_losses(self):
+        # The same updates as tf.train.AdamOptimizer, with its default hyperparameters
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+
+        names = [v.op.name for v in self.vars]
+
+        def loss_and_grads(vals):
+            loss = self.replay_loss(dict(zip(names, vals)))
+            grads = tf.gradients(loss, vals)
+            return loss, [tf.zeros_like(v) if g is None else g for g, v in zip(grads, vals)]
+
+        def cond(i, vals, ms, vs, loss, grads):
+            return tf.logical_and(i < opts['n_iterations'], tf.logical_and(tf.math.is_finite(loss), tf.logical_not(loss < opts['eps'])))
+
+        def body(i, vals, ms, vs, loss, grads):
+            step = tf.cast(i, tf.float64)
+            learning_rate = opts['learning_rate'] * tf.pow(tf.constant(opts['decay_rate'], tf.float64), step / opts['decay_steps'])
+            lr_t = learning_rate * tf.sqrt(1 - beta2 ** (step + 1)) / (1 - beta1 ** (step + 1))
+
+            new_vals, new_ms, new_vs = list(), list(), list()
+            for var, val, m, v, g in zip(self.vars, vals, ms, vs, grads):
+                if var.trainable:
+                    m = beta1 * m + (1 - beta1) * g
+                    v = beta2 * v + (1 - beta2) * g ** 2
+                    val = val - lr_t * m / (tf.sqrt(v) + epsilon)
+                new_vals.append(val)
+                new_ms.append(m)
+                new_vs.append(v)
+
+            new_loss, new_grads = loss_and_grads(new_vals)
+            return i + 1, new_vals, new_ms, new_vs, new_loss, new_grads
+
+        # The loss and gradients at the initial values come from the graph built by preprocess
+        grads = [var2grad[v] if var2grad.get(v) is not None else tf.zeros_like(v) for v in self.vars]
+        vals = [tf.identity(v) for v in self.vars]
+        zeros = [tf.zeros_like(v) for v in vals]
+
+        n_iters, vals, _, _, loss, _ = tf.while_loop(
+            cond, body, (tf.constant(0), vals, zeros, zeros, self.loss, grads), back_prop=False)
+
+        assign = tf.group(*[tf.assign(var, val) for var, val in zip(self.vars, vals)])
+        with tf.control_dependencies([assign]):
+            self.loop_loss = tf.identity(loss)
+            self.loop_iterations = tf.identity(n_iters)
+
+    def print_losses(self, k=None):
+        losses, goals, ndgs = self.run([self.losses, self.goals, self.ndgs])
+        if k is not None:
+            losses, goals, ndgs = select_candidate([losses, goals, ndgs], k)
         print("======== Print losses ==========")
         print("-- Losses --")
-        for k, x in self.run(self.losses).items(): print("  %-50s %.10f" % (k, x))
+        for key, x in losses.items(): print("  %-50s %.10f" % (key, x))
         print("-- Goals --")
-        for k, x in self.run(self.goals).items(): print("  %-50s %.10f" % (k, x))
+        for key, x in goals.items(): print("  %-50s %.10f" % (key, x))
         print("-- NDGs --")
-        for k, x in self.run(self.ndgs).items(): print("  %-50s %.10f" % (k, x))
+        for key, x in ndgs.items(): print("  %-50s %.10f" % (key, x))
         print("================================")
 
 
     def gen_inits(self):
-
-        if not os.path.exists('.checkpoints'):
-            os.makedirs('.checkpoints')
-
-        # delete old checkpoints
-        ckpt_list = glob.glob('.checkpoints/*')
-        for ckpt_file in ckpt_list:
-            os.remove(ckpt_file)
-
         n_inits = self.n_inits
 
-        init_map = dict() # maps inits to losses
-        saver = tf.train.Saver(max_to_keep=None)
+        # Initializations live in memory as one array per global variable (optimizer slots included),
+        # and are restored with a single grouped assign
+        self.init_vars = tf.compat.v1.global_variables()
+        self.init_phs = [tf.compat.v1.placeholder(v.dtype.base_dtype, shape=v.shape) for v in self.init_vars]
+        self.restore_init = tf.group(*[tf.assign(v, ph) for v, ph in zip(self.init_vars, self.init_phs)])
 
-        self.global_init = tf.compat.v1.global_variables_initializer()
+        # All initializations are drawn at once, and their losses come from a single evaluation of the
+        # construction over all of them
+        samples = {name: sample(n_inits) for name, sample in self.samplers.items()}
+        losses = self.replay_loss(samples, batch_size=n_inits)
 
-        n_inits_iter = range(n_inits) if self.verbosity < 0 else tqdm(range(n_inits), desc="Sampling initializations...")
+        self.sess.run(self.global_init)
+        base_vals = self.sess.run(self.init_vars)
+        sample_vals, loss_vals = self.sess.run([samples, losses])
 
-        for _ in n_inits_iter:
-            self.sess.run(self.global_init)
-            # self.sess.run(tf.compat.v1.global_variables_initializer())
-            init_loss = self.sess.run(self.loss)
-            init_name = f".checkpoints/{get_random_string(8)}"
-            saver.save(self.sess, init_name)
-            init_map[init_name] = init_loss
+        def init_vals(k):
+            # Everything else, e.g. the optimizer slots, starts from its initial value
+            return [sample_vals[var.op.name][k] if var.op.name in sample_vals else val for var, val in zip(self.init_vars, base_vals)]
 
-        self.sorted_inits = sorted(init_map.items(), key=lambda x: x[1])
+        # NaN losses sort last. Tries one after the other only use the best n_tries, while successive
+        # halving starts from all of them.
+        order = np.argsort(loss_vals, kind="stable")
+        self.sorted_inits = [(init_vals(k), loss_vals[k]) for k in order]
 
+    def restore(self, init_vals):
+        self.sess.run(self.restore_init, feed_dict=dict(zip(self.init_phs, init_vals)))
 
-    def remove_inits(self):
-        # remove init files
-        for (init_name, init_loss) in self.sorted_inits:
-            os.remove(f"{init_name}.meta")
-            os.remove(f"{init_name}.index")
-            os.remove(f"{init_name}.data-00000-of-00001")
+    def snapshot(self):
+        # Everything restore needs to resume training from here, optimizer slots included
+        return self.sess.run(self.init_vars)
 
-    def train(self, init_name):
+    def train(self, init_vals, start=0, stop=None):
+        # Runs iterations start to stop, resuming from a snapshot if start is not 0
         opts = self.opts
 
-        restore_saver = tf.train.import_meta_graph(f"{init_name}.meta")
-        restore_saver.restore(self.sess, f"./{init_name}")
+        self.restore(init_vals)
 
         loss_v = None
 
-        self.sess.run(self.reset_step)
+        if start == 0:
+            self.sess.run(self.reset_step)
 
-        for i in range(opts['n_iterations']):
+        stalls = StallDetector(opts)
+
+        for i in range(start, opts['n_iterations'] if stop is None else stop):
 
             loss_v, learning_rate_v = self.sess.run([self.loss, self.learning_rate])
 
             if self.verbosity > 0 or (i % self.opts['loss_freq'] == 0 and self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
                 print("[%6d] %16.12f || %10.6f" % (i, loss_v, learning_rate_v))
+            self.report_iteration(i, loss_v, learning_rate_v)
             if self.verbosity > 1 or (i % self.opts['losses_freq'] == 0 and self.opts['losses_freq'] > 0 and self.opts['verbosity'] > -1):
                 self.print_losses()
             if i % self.opts['plot_freq'] == 0 and self.opts['plot_freq'] > 0 and self.opts['verbosity'] > -1:
                 self.get_model().plot(show_unnamed=self.opts['unnamed_objects'])
 
-            if loss_v < opts['eps']:
+            if not np.isfinite(loss_v):
+                raise RuntimeError(f"Loss is not finite at iteration {i}, use check_numerics to find where")
+            elif loss_v < opts['eps']:
                 if opts['verbosity'] >= 0:
                     self.print_losses()
                 return loss_v
             else:
-                self.sess.run(self.apply_grads)
+                grad_norm_v = self.apply_step(opts['grad_floor'] > 0)
+                reason = stalls.check(loss_v, grad_norm_v)
+                if reason is not None:
+                    self.abandon(i, reason, loss_v)
+
+        return loss_v
+
+    def train_in_graph(self, init_vals):
+        self.restore(init_vals)
 
+        # The whole descent runs in a single call
+        loss_v, n_iters = self.sess.run([self.loop_loss, self.loop_iterations])
+        learning_rate_v = self.opts['learning_rate'] * self.opts['decay_rate'] ** (n_iters / self.opts['decay_steps'])
+
+        if self.verbosity > 0 or (self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
+            print("[%6d] %16.12f || %10.6f" % (n_iters, loss_v, learning_rate_v))
+        self.report("iteration", iteration=int(n_iters), loss=float(loss_v), learning_rate=float(learning_rate_v), active=None)
+
+        if not np.isfinite(loss_v):
+            raise RuntimeError(f"Loss is not finite at iteration {n_iters}, use check_numerics to find where")
+
+        if loss_v < self.opts['eps'] and self.opts['verbosity'] >= 0:
+            self.print_losses()
         return loss_v
 
+    def train_batched(self):
+        opts = self.opts
+
+        self.sess.run(self.global_init)
+        self.sess.run(self.reset_step)
+
+        models = list()
+        done = np.zeros(self.batch_size, dtype=bool)
+        stalls = StallDetector(opts)
+
+        for i in range(opts['n_iterations']):
+
+            loss_v, learning_rate_v = self.sess.run([self.loss, self.learning_rate])
+
+            # Candidates that blew up are abandoned rather than aborting the batch
+            done |= ~np.isfinite(loss_v)
+            if done.all():
+                break
+
+            best = int(np.argmin(np.where(done, np.inf, loss_v)))
+            if self.verbosity > 0 or (i % self.opts['loss_freq'] == 0 and self.opts['loss_freq'] > 0 and self.opts['verbosity'] > -1):
+                print("[%6d] %16.12f || %10.6f || %d/%d active" % (i, loss_v[best], learning_rate_v, (~done).sum(), self.batch_size))
+            self.report_iteration(i, loss_v[best], learning_rate_v, active=int((~done).sum()))
+            if self.verbosity > 1 or (i % self.opts['losses_freq'] == 0 and self.opts['losses_freq'] > 0 and self.opts['verbosity'] > -1):
+                self.print_losses(best)
+            if i % self.opts['plot_freq'] == 0 and self.opts['plot_freq'] > 0 and self.opts['verbosity'] > -1:
+                self.get_model(best).plot(show_unnamed=self.opts['unnamed_objects'])
+
+            converged = np.flatnonzero((loss_v < opts['eps']) & ~done)
+            if converged.size > 0:
+                done[converged] = True
+                for k, model in zip(converged, self.get_models(converged)):
+                    if self.valid_model(model, k):
+                        self.add_model(models, model)
+                    if len(models) >= opts['n_models']:
+                        return models
+
+            if done.all():
+                break
+            grad_norm_v = self.apply_step(opts['grad_floor'] > 0)
+            self.abandon_candidates(i, stalls.check(loss_v, grad_norm_v), done)
+
+        return models
+
 
     #####################
     ## Core
     ####################
 
-    def get_model(self):
-        named_pt_assn, named_line_assn, named_circ_assn, segments, \
-            unnamed_points, unnamed_lines, unnamed_circles_assn, ndgs, goals = self.run([
-                self.name2pt, self.name2line, self.name2circ,
-                self.segments, self.unnamed_points, self.unnamed_lines, self.unnamed_circles,
-                self.ndgs, self.goals
-            ])
+    def get_model(self, k=None):
+        return self.get_models([k])[0]
 
-        return Diagram(
-            named_points=named_pt_assn, named_lines=named_line_assn, named_circles=named_circ_assn,
-            segments=segments, seg_colors=self.seg_colors, unnamed_points=unnamed_points, unnamed_lines=unnamed_lines,
-            unnamed_circles=unnamed_circles_assn, ndgs=ndgs, goals=goals)
+    def get_models(self, ks):
+        assns = self.run([
+            self.name2pt, self.name2line, self.name2circ,
+            self.segments, self.unnamed_points, self.unnamed_lines, self.unnamed_circles,
+            self.ndgs, self.goals
+        ])
+
+        models = list()
+        for k in ks:
+            named_pt_assn, named_line_assn, named_circ_assn, segments, \
+                unnamed_points, unnamed_lines, unnamed_circles_assn, ndgs, goals = assns if k is None else select_candidate(assns, k)
+
+            models.append(Diagram(
+                named_points=named_pt_assn, named_lines=named_line_assn, named_circles=named_circ_assn,
+                segments=segments, seg_colors=self.seg_colors, unnamed_points=unnamed_points, unnamed_lines=unnamed_lines,
+                unnamed_circles=unnamed_circles_assn, ndgs=ndgs, goals=goals))
+        return models
 
     def run(self, x):
         return self.sess.run(x)
 
-    def satisfies_goals(self):
-        if not self.opts['enforce_goals']:
-            return True
+    def solve_batched(self):
+        if self.has_loss:
+            self.freeze()
+            return self.train_batched()
 
-        goals = self.run(self.goals)
-        for k, x in goals.items():
-            if x > self.opts['eps'] * 10:
-                return False
-        return True
+        self.run(tf.compat.v1.global_variables_initializer())
+        models = list()
+        for k, model in enumerate(self.get_models(range(self.batch_size))):
+            if len(models) >= self.opts['n_models']:
+                break
+            if self.valid_model(model, k):
+                self.add_model(models, model)
+        return models
 
-    def valid_model(self):
-        if self.verbosity > 0:
-            self.print_losses()
-        if self.points_far_enough_away() and self.satisfies_goals():
-            return True
-        return False
+    def solve_halving(self):
+        opts = self.opts
+
+        # Successive halving: every initialization gets a short budget of iterations, then the better half
+        # of those that have not converged get twice the budget, and so on up to n_iterations
+        tries = [(init_vals, 0) for init_vals, _ in self.sorted_inits] # pairs of state and iterations run
+        budget = min(opts['halving_budget'], opts['n_iterations'])
+        n_runs = 0
+
+        models = list()
+
+        while tries:
+            unfinished = list() # triples of loss, state and iterations run
+
+            for state, start in tries:
+
+                # Stop when we have enough
+                if len(models) >= opts['n_models']:
+                    return models
+
+                self.report("try", index=n_runs, n_tries=len(tries), start=start, budget=budget)
+                n_runs += 1
+
+                loss = None
+                try:
+                    loss = self.train(init_vals=state, start=start, stop=budget)
+                except Exception as e:
+                    if self.verbosity > 0:
+                        print(f"ERROR: {e}")
+
+                if loss is None:
+                    continue
+                elif loss < opts['eps']:
+                    model = self.get_model()
+                    if self.valid_model(model):
+                        self.add_model(models, model)
+                else:
+                    unfinished.append((loss, self.snapshot(), budget))
+
+            if budget >= opts['n_iterations']:
+                break
+
+            unfinished.sort(key=lambda x: x[0])
+            tries = [(state, start) for _, state, start in unfinished[:max(1, len(unfinished) // 2)]]
+            budget = min(2 * budget, opts['n_iterations'])
+
+        return models
 
     def solve(self):
+        if self.batched:
+            return self.solve_batched()
+
         if self.has_loss:
             self.freeze()
+            if self.opts['halving']:
+                return self.solve_halving()
 
         models = list()
 
@@ -338,23 +648,28 @@ class TfOptimizer(Optimizer):
 
             # Stop when we have enough
             if len(models) >= self.opts['n_models']:
-                if self.has_loss: self.remove_inits()
                 return models
 
+            self.report("try", index=i, n_tries=self.n_tries)
+
             if not self.has_loss:
                 self.run(tf.compat.v1.global_variables_initializer())
-                if self.valid_model():
-                    models.append(self.get_model())
+                model = self.get_model()
+                if self.valid_model(model):
+                    self.add_model(models, model)
             else:
                 loss = None
                 try:
-                    loss = self.train(init_name=self.sorted_inits[i][0])
+                    if self.in_graph:
+                        loss = self.train_in_graph(init_vals=self.sorted_inits[i][0])
+                    else:
+                        loss = self.train(init_vals=self.sorted_inits[i][0])
                 except Exception as e:
                     if self.verbosity > 0:
                         print(f"ERROR: {e}")
 
                 if loss is not None and loss < self.opts['eps']:
-                    if self.valid_model():
-                        models.append(self.get_model())
-        if self.has_loss: self.remove_inits()
+                    model = self.get_model()
+                    if self.valid_model(model):
+                        self.add_model(models, model)
         return models
@@ -50,12 +50,28 @@ def match_in_first_2(p, ps):
     return (False, None)
 
 DEFAULTS = {
+    "backend": "tf",
+    "batched": False,
+    "cache": False,
+    "cache_dir": "~/.cache/geo-model-builder",
+    "cache_size": 64, # MB
     "decay_steps": 1e3,
     "decay_rate": 0.7,
     "distinct_prob": 1.0, # Note this
     "eps": 1e-3,
     "enforce_goals": False,
-    "experiment": False,
+    "in_graph": False,
+    "check_numerics": False,
+    "xla": False,
+    "halving": False,
+    "halving_budget": 100,
+    "stall_window": 0,
+    "stall_tol": 0.01,
+    "grad_floor": 0.0,
+    "lm_damping": 1e-3,
+    "decompose": False,
+    "rewrite": False,
+    "jobs": 1,
     "learning_rate": 1e-1,
     "loss_freq": 100,
     "losses_freq": 1000,
@@ -64,8 +80,10 @@ DEFAULTS = {
     "n_iterations": 5000,
     "ndg_loss": 1e-3,
     "plot_freq": 1000,
+    "progress_freq": 100,
     "unnamed_objects": True,
     "regularize_points": 1e-6,
+    "seed": None,
     "n_models": 1,
     "n_tries": 3,
     "n_inits": 10,
@@ -86,6 +104,18 @@ def get_random_string(length):
     result_str = ''.join(random.choice(letters) for i in range(length))
     return result_str
 
+def select_candidate(x, k):
+    # Index the k-th candidate out of a (possibly nested) batched assignment
+    if isinstance(x, dict):
+        return {key: select_candidate(v, k) for key, v in x.items()}
+    elif isinstance(x, tuple) and hasattr(x, "_fields"):
+        return type(x)(*[select_candidate(v, k) for v in x])
+    elif isinstance(x, (list, tuple)):
+        return type(x)(select_candidate(v, k) for v in x)
+    elif getattr(x, "ndim", 0) > 0:
+        return x[k]
+    return x
+
 
 """
 CASE_FIX = {
@@ -0,0 +1,39 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import os
+import sys
+
+import pytest
+
+# The sources are plain modules, imported the way src/builder_cli.py imports them
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from util import DEFAULTS
+
+PROBLEMS = os.path.join(ROOT, "problems")
+
+
+def problem_files():
+    return sorted(os.path.join(d, f) for d, _, fs in os.walk(PROBLEMS) for f in fs if f.endswith(".smt2"))
+
+
+def quiet_opts(**kwargs):
+    # Options to solve a small problem quickly, silently, reproducibly and without touching the cache
+    opts = dict(DEFAULTS, backend="numpy", cache=False, seed=0, verbosity=-1,
+                plot_freq=-1, loss_freq=-1, losses_freq=-1)
+    opts.update(kwargs)
+    return opts
+
+
+@pytest.fixture
+def solve_lines():
+    from builder import build
+
+    def solve(lines, **kwargs):
+        return build(quiet_opts(lines=list(lines), **kwargs), show_plot=False)
+    return solve
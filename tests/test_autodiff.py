@@ -0,0 +1,68 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import numpy as np
+import pytest
+
+import autodiff as ad
+
+
+# Each function takes two arrays of candidates, and is differentiable where they are evaluated
+FUNCTIONS = {
+    "arith": lambda x, y: (x * y - x / y + x ** 2) * 3.0 - (-y),
+    "trig": lambda x, y: ad.sin(x) * ad.cos(y) + ad.tanh(x * y) + ad.atan2(y, x + 2.0),
+    "inverse": lambda x, y: ad.asin(x * 0.5) + ad.acos(y * 0.25) + ad.sqrt(x * x + y * y),
+    "exp": lambda x, y: ad.exp(-(x ** 2) * 20) + ad.sigmoid(y) * ad.abs(x),
+    "select": lambda x, y: ad.where(ad.lt(x, y), x * y, x + y) + ad.maximum(x, y) - ad.minimum(x, 0.1),
+    "lists": lambda x, y: ad.sum_list([x, y, x * y]) + ad.mean_list([x, y]) * ad.max_list([x, y, 0.3]),
+}
+
+X = np.array([0.3, -0.7, 1.1])
+Y = np.array([1.2, 0.5, -0.4])
+
+
+def gradients(f, x, y):
+    tape = ad.Tape()
+    xs, ys = tape.var(x), tape.var(y)
+    out = f(xs, ys)
+    tape.backward(out, np.ones_like(out.val))
+    return tape, xs, ys, out
+
+
+@pytest.mark.parametrize("name", FUNCTIONS)
+def test_gradients_match_finite_differences(name):
+    f = FUNCTIONS[name]
+    _, xs, ys, out = gradients(f, X, Y)
+    assert np.allclose(out.val, f(X, Y))
+
+    h = 1e-6
+    assert np.allclose(xs.grad, (f(X + h, Y) - f(X - h, Y)) / (2 * h), atol=1e-5)
+    assert np.allclose(ys.grad, (f(X, Y + h) - f(X, Y - h)) / (2 * h), atol=1e-5)
+
+
+@pytest.mark.parametrize("name", FUNCTIONS)
+def test_replay_on_new_values(name):
+    # The tape is recorded once and replayed forward for every step
+    f = FUNCTIONS[name]
+    tape, xs, ys, out = gradients(f, X, Y)
+    xs.val, ys.val = X + 0.05, Y - 0.05
+    tape.forward()
+    assert np.allclose(out.val, f(X + 0.05, Y - 0.05))
+
+
+def test_branch_not_taken_gets_no_gradient():
+    tape = ad.Tape()
+    x = tape.var(np.array([-1.0, 4.0]))
+    # Both branches are evaluated, and the square root of -1 is NaN, but it is not taken
+    with np.errstate(invalid="ignore"):
+        out = ad.where(ad.gt(x, 0.0), ad.sqrt(x), x * 2.0)
+        tape.backward(out, np.ones(2))
+    assert np.allclose(x.grad, [2.0, 0.25])
+
+
+def test_nodes_have_no_truth_value():
+    with pytest.raises(TypeError):
+        bool(ad.Tape().var(1.0))
@@ -0,0 +1,71 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import csv
+import json
+from argparse import Namespace
+
+import pytest
+
+import benchmark
+from conftest import quiet_opts
+
+PROBLEMS = {"iso.smt2": ["(param (A B C) triangle)", "(param D point)", "(assert (on-seg D B C))",
+                         "(assert (cong A D A B))", "(eval (coll B C D))"],
+            "bad.smt2": ["(param A point)", "(define B point (foo A))"]}
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    d = tmp_path / "problems"
+    d.mkdir()
+    for name, lines in PROBLEMS.items():
+        (d / name).write_text("\n".join(lines))
+    return d
+
+
+def test_run_trial(corpus):
+    result = benchmark.run_trial(str(corpus / "iso.smt2"), quiet_opts(seed=3), trial=2)
+    assert result["seed"] == 5 and result["status"] == "solved" and result["n_models"] == 1
+    assert all(result[f"{phase}_time"] >= 0 for phase in benchmark.PHASES)
+    assert result["iterations"] > 0 and len(result["iterations_to_model"]) == 1
+    assert result["final_loss"] < quiet_opts()["eps"]
+    assert list(result["goal_residuals"][0]) and result["max_goal_residual"] < 1e-2
+
+    result = benchmark.run_trial(str(corpus / "bad.smt2"), quiet_opts(), trial=0)
+    assert result["status"] == "error" and "foo" in result["error"]
+
+
+def test_run_writes_json_and_csv(corpus, tmp_path):
+    out, out_csv = tmp_path / "results.json", tmp_path / "results.csv"
+    benchmark.run(Namespace(dirs=[str(corpus)], out=str(out), csv=str(out_csv), trials=2, seed=0, jobs=1,
+                            set=["backend=numpy", "n_models=1"]))
+
+    report = json.load(open(out))
+    assert report["meta"]["opts"]["backend"] == "numpy" and report["meta"]["trials"] == 2
+    problems = {name.rsplit("/", 1)[-1]: p for name, p in report["problems"].items()}
+    assert problems["iso.smt2"]["summary"]["success_rate"] == 1.0
+    assert problems["bad.smt2"]["summary"]["errors"] == 2
+    assert [t["seed"] for t in problems["iso.smt2"]["trials"]] == [0, 1]
+
+    rows = list(csv.DictReader(open(out_csv)))
+    assert len(rows) == 4 and set(rows[0]) == set(benchmark.CSV_FIELDS)
+
+
+def results(tmp_path, name, time, success_rate):
+    path = tmp_path / name
+    summary = {"success_rate": success_rate, "median_time": time}
+    json.dump({"problems": {"p.smt2": {"summary": summary, "trials": []}}}, open(path, "w"))
+    return str(path)
+
+
+@pytest.mark.parametrize("time, success_rate, regression", [
+    (10.0, 1.0, False), (11.0, 1.0, False), (13.0, 1.0, True), (10.0, 0.5, True), (0.3, 1.0, False)])
+def test_diff_flags_regressions(tmp_path, time, success_rate, regression):
+    old = results(tmp_path, "old.json", 0.1 if time < 1 else 10.0, 1.0)
+    new = results(tmp_path, "new.json", time, success_rate)
+    args = Namespace(old=old, new=new, time_tol=0.2, min_time=0.5, success_tol=0.0)
+    assert benchmark.diff(args) == int(regression)
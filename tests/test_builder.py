@@ -0,0 +1,49 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import math
+
+from builder import build
+from conftest import quiet_opts
+
+LINES = ["(param (A B C) triangle)", "(param D point)", "(assert (on-seg D B C))", "(assert (cong A D A B))"]
+
+
+def test_listener_reports_progress_and_models():
+    events = list()
+    models = build(quiet_opts(lines=LINES, n_models=2, progress_freq=10), show_plot=False,
+                   listener=lambda event, data: events.append((event, data)))
+
+    assert [data["name"] for event, data in events if event == "phase"] == ["parse", "construct", "solve"]
+
+    iterations = [data for event, data in events if event == "iteration"]
+    assert iterations and all(data["iteration"] % 10 == 0 and math.isfinite(data["loss"]) for data in iterations)
+    assert [data["iteration"] for data in iterations] == sorted(data["iteration"] for data in iterations)
+
+    # Each model is reported as soon as it is found, before the search ends
+    reported = [data["model"] for event, data in events if event == "model"]
+    assert len(models) == 2 and [m is r for m, r in zip(models, reported)] == [True, True]
+    names = [event for event, _ in events]
+    assert names[-1] == "phase" and names.index("model") < len(names) - 1
+
+
+def test_listener_is_optional():
+    assert len(build(quiet_opts(lines=LINES, progress_freq=1), show_plot=False)) == 1
+
+
+def test_dir_runs_in_parallel(tmp_path, capsys):
+    from builder import build_dir_parallel
+
+    problems = {"iso.smt2": LINES, "two.smt2": ["(param (A B C) triangle)", "(param (D E F) triangle)"],
+                "bad.smt2": ["(param A point)", "(define B point (foo A))"]}
+    for name, lines in problems.items():
+        (tmp_path / name).write_text("\n".join(lines))
+
+    solve_map = build_dir_parallel(quiet_opts(dir=str(tmp_path), jobs=2), sorted(problems))
+    assert list(solve_map) == ["bad.smt2", "iso.smt2", "two.smt2"]
+    assert solve_map["iso.smt2"] == solve_map["two.smt2"] == 1
+    assert solve_map["bad.smt2"].startswith("ERROR:")
+    assert "Solved 2/3 problems" in capsys.readouterr().out
@@ -0,0 +1,53 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import pytest
+
+import decompose
+from diagram import Diagram
+from ir import read_program
+
+
+ISO_CONG = ["(param (A B C) triangle)", "(param (D E F) triangle)",
+            "(assert (cong A B A C))", "(assert (cong D E D F))"]
+ISO_TRI = ["(param (A B C) (iso-tri A))", "(param (D E F) (iso-tri D))"]
+
+
+def diagram(points):
+    return Diagram.from_dict({"named_points": points, "named_lines": {}, "named_circles": {}, "segments": [],
+                              "seg_colors": [], "unnamed_points": [], "unnamed_lines": [], "unnamed_circles": [],
+                              "ndgs": {}, "goals": {}})
+
+
+def test_splits_independent_objects():
+    subproblems = decompose.decompose(read_program(ISO_CONG))
+    assert [sorted(str(p) for i in s.instructions for p in decompose.names(i)) for s in subproblems] == \
+        [["A", "A", "A", "B", "B", "C", "C"], ["D", "D", "D", "E", "E", "F", "F"]]
+
+
+def test_keeps_connected_objects_together():
+    assert len(decompose.decompose(read_program(ISO_CONG + ["(assert (cong A B D E))"]))) == 1
+
+
+def test_pick_merges_avoids_clashes():
+    first = [diagram({"A": [0, 0]}), diagram({"A": [5, 5]})]
+    second = [diagram({"D": [0, 0]}), diagram({"D": [3, 3]})]
+    merges = decompose.pick_merges([first, second], 2, min_dist=0.1)
+    assert [[m.named_points for m in parts] for parts in merges] == \
+        [[first[0].named_points, second[1].named_points], [first[1].named_points, second[0].named_points]]
+
+
+@pytest.mark.parametrize("lines", [ISO_CONG, ISO_TRI])
+@pytest.mark.parametrize("seed", range(5))
+def test_finds_as_many_models_as_the_whole_problem(solve_lines, lines, seed):
+    assert len(solve_lines(lines, decompose=True, n_models=3, seed=seed)) == 3
+
+
+def test_solves_the_whole_problem_when_merges_clash(solve_lines, monkeypatch):
+    monkeypatch.setattr(decompose, "apart", lambda models, min_dist: len(models) < 2)
+    models = solve_lines(ISO_CONG, decompose=True, n_models=2)
+    assert len(models) == 2
+    assert sorted(str(p) for p in models[0].named_points) == ["A", "B", "C", "D", "E", "F"]
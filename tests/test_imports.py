@@ -0,0 +1,20 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.mark.parametrize("module", ["builder", "ir"])
+def test_import_is_light(module):
+    # Checked in a fresh interpreter, since other tests import everything
+    code = f"import sys, {module}; print(sorted(m for m in ['numpy', 'matplotlib', 'tqdm', 'tensorflow'] if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=f"{ROOT}/src", capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
@@ -0,0 +1,62 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import json
+import random
+
+import pytest
+
+from conftest import problem_files, quiet_opts
+from ir import IR_VERSION, compile_program, from_ir, read_program, to_ir
+
+
+def read_or_skip(lines):
+    try:
+        return read_program(lines)
+    except Exception as e:
+        # Some test problems are meant to be invalid
+        pytest.skip(str(e))
+
+
+@pytest.mark.parametrize("path", problem_files())
+def test_round_trip(path):
+    program = read_or_skip(open(path).readlines())
+    ir = json.loads(json.dumps(to_ir(program)))
+    decoded = from_ir(ir)
+
+    assert [str(i) for i in decoded.instructions] == [str(i) for i in program.instructions]
+    assert [type(i) for i in decoded.instructions] == [type(i) for i in program.instructions]
+    for field in ["unnamed_points", "unnamed_lines", "unnamed_circles"]:
+        assert [str(x) for x in getattr(decoded, field)] == [str(x) for x in getattr(program, field)]
+    assert [(str(a), str(b)) for a, b in decoded.segments] == [(str(a), str(b)) for a, b in program.segments]
+    assert decoded.seg_colors == program.seg_colors
+    assert to_ir(decoded) == ir
+
+
+def test_rejects_other_versions():
+    with pytest.raises(ValueError):
+        from_ir(dict(to_ir(read_program(["(param A point)"])), version=IR_VERSION + 1))
+
+
+POLYGON = ["(param (A B C D) polygon)", "(param (E F G) triangle)"]
+
+
+def test_cached_compile_matches_parsing_when_seeded(tmp_path):
+    opts = quiet_opts(cache=True, cache_dir=str(tmp_path))
+    results = list()
+    for _ in range(3):
+        random.seed(0)
+        program = compile_program(POLYGON, opts)
+        results.append((program.seg_colors, random.random()))
+
+    random.seed(0)
+    assert results == [(read_program(POLYGON).seg_colors, random.random())] * 3
+
+
+def test_cached_compile_draws_new_colors_when_unseeded(tmp_path):
+    opts = quiet_opts(cache=True, cache_dir=str(tmp_path), seed=None)
+    colors = [compile_program(POLYGON, opts).seg_colors for _ in range(3)]
+    assert colors[0] and colors[0] != colors[1] != colors[2]
@@ -0,0 +1,58 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import numpy as np
+import pytest
+
+import lm_optimizer
+from builder import build
+from conftest import quiet_opts
+
+
+PROGRAMS = {
+    "iso": ["(param (A B C) triangle)", "(param (D E F) triangle)", "(assert (cong A B A C))", "(assert (cong D E D F))"],
+    "on-seg": ["(param (A B C) triangle)", "(param D point)", "(assert (on-seg D B C))", "(assert (cong A D B D))"],
+    "redundant": ["(param (A B C) triangle)", "(assert (cong A B A C))", "(assert (cong A C A B))"],
+}
+
+
+def solve_counting(lines, **kwargs):
+    iterations = list()
+    def listener(event, data):
+        if event == "iteration":
+            iterations.append(data["iteration"])
+
+    models = build(quiet_opts(lines=lines, progress_freq=1, **kwargs), show_plot=False, listener=listener)
+    return models, len(iterations)
+
+
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_converges_in_fewer_iterations_than_adam(name):
+    models, lm_iterations = solve_counting(PROGRAMS[name], backend="lm", n_models=2)
+    assert len(models) == 2
+    _, adam_iterations = solve_counting(PROGRAMS[name], backend="numpy", n_models=2)
+    assert lm_iterations < adam_iterations
+
+
+def test_singular_systems_without_damping(solve_lines, monkeypatch):
+    # P is in no loss, so without damping the normal equations are singular
+    pinv_calls = list()
+    pinv = np.linalg.pinv
+    monkeypatch.setattr(np.linalg, "pinv", lambda a: pinv_calls.append(1) or pinv(a))
+
+    lines = PROGRAMS["on-seg"] + ["(param P point)"]
+    assert len(solve_lines(lines, backend="lm", lm_damping=0.0, n_models=2)) == 2
+    assert pinv_calls
+
+
+def test_abandons_candidates_whose_damping_blows_up(monkeypatch):
+    # Nothing is solvable with an impossible assertion, and damping only grows
+    monkeypatch.setattr(lm_optimizer, "MAX_DAMPING", 1e2)
+    reasons = list()
+    lines = ["(param (A B C) triangle)", "(assert (eq (dist A B) (mul 2 (dist A B))))"]
+    build(quiet_opts(lines=lines, backend="lm", n_iterations=200),
+          show_plot=False, listener=lambda event, data: reasons.append(data.get("reason")) if event == "abort" else None)
+    assert "damping" in reasons
@@ -0,0 +1,66 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import re
+
+import pytest
+
+from conftest import problem_files
+from parse import Span, parse_sexprs
+
+
+def test_forms_span_lines_and_skip_comments():
+    [form] = parse_sexprs(["(assert ; a comment (with parens)", "  (cong A B", "        A C))"])
+    assert form == ("assert", ("cong", "A", "B", "A", "C"))
+    assert form.span == Span(1, 1, 3, 14)
+    assert form[1].span == Span(2, 3, 3, 13)
+    assert form[1][4].span == Span(3, 11, 3, 12)
+
+
+def test_accepts_lines_with_or_without_newlines_or_one_string():
+    lines = ["(param A point)", "(param B point)"]
+    expected = [("param", "A", "point"), ("param", "B", "point")]
+    assert parse_sexprs(lines) == parse_sexprs([l + "\n" for l in lines]) == parse_sexprs("\n".join(lines)) == expected
+
+
+def test_skips_empty_top_level_forms():
+    assert parse_sexprs("()\n(param A point) ()") == [("param", "A", "point")]
+    assert parse_sexprs("(f ())") == [("f", ())]
+
+
+@pytest.mark.parametrize("text, message", [
+    ("(param A point))", "unexpected ')' at line 1, column 16"),
+    ("(param A point)\n(param (B C", "'(' at line 2, column 8 is never closed"),
+])
+def test_errors_give_positions(text, message):
+    with pytest.raises(RuntimeError, match=re.escape(message)):
+        parse_sexprs(text)
+
+
+def test_deep_nesting_does_not_recurse():
+    depth = 100000
+    [form] = parse_sexprs("(" * depth + "x" + ")" * depth)
+    for _ in range(depth - 1):
+        [form] = form
+    assert form == ("x",)
+
+
+@pytest.mark.parametrize("path", problem_files())
+def test_spans_point_at_their_text(path):
+    text = open(path).read()
+    lines = text.split("\n")
+
+    def check(x):
+        line, col, end_line, end_col = x.span
+        if isinstance(x, str):
+            assert line == end_line and lines[line - 1][col - 1:end_col - 1] == x
+        else:
+            assert lines[line - 1][col - 1] == "(" and lines[end_line - 1][end_col - 2] == ")"
+            for y in x:
+                check(y)
+
+    for form in parse_sexprs(text):
+        check(form)
@@ -0,0 +1,94 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import json
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from conftest import PROBLEMS
+from render import GEOMETRY_KEYS, UNNAMED_KEYS, clip_lines, diagram_json, finite, render_svg, svg_to_png
+
+SVG = "{http://www.w3.org/2000/svg}"
+
+
+@pytest.fixture(scope="module")
+def rs_example():
+    from builder import build
+    from conftest import quiet_opts
+    [model] = build(quiet_opts(problem=f"{PROBLEMS}/misc/rs-example.smt2"), show_plot=False)
+    return model
+
+
+def test_clip_lines():
+    # The x axis, a diagonal, and a line that misses the box
+    normals = np.array([[0.0, 1.0], [np.sqrt(0.5), np.sqrt(0.5)], [1.0, 0.0]])
+    offsets = np.array([0.0, 0.0, 5.0])
+    a, b, visible = clip_lines(normals, offsets, np.array([-1.0, -1.0]), np.array([1.0, 1.0]))
+    assert list(visible) == [True, True, False]
+    assert sorted(map(tuple, np.round([a[0], b[0]], 9))) == [(-1.0, 0.0), (1.0, 0.0)]
+    assert sorted(map(tuple, np.round([a[1], b[1]], 9))) == [(-1.0, 1.0), (1.0, -1.0)]
+
+
+def test_svg_shows_every_named_object(rs_example):
+    svg = ET.fromstring(render_svg(rs_example))
+    size = float(svg.get("width"))
+    labels = [t.text for t in svg.iter(f"{SVG}text")]
+    for name in list(rs_example.named_points) + list(rs_example.named_lines) + list(rs_example.named_circles):
+        assert str(name) in labels
+
+    # Lines are clipped to the view
+    for line in svg.iter(f"{SVG}line"):
+        for k in ["x1", "y1", "x2", "y2"]:
+            assert -1e-6 <= float(line.get(k)) <= size + 1e-6
+
+
+def test_svg_hides_unnamed_objects(solve_lines):
+    [model] = solve_lines(["(param (A B C) triangle)", "(param D point)", "(assert (on-line D (line A B)))",
+                           "(assert (on-circ D (circumcircle A B C)))"])
+    assert model.unnamed_lines and model.unnamed_circles
+
+    def n_elements(svg):
+        return len(list(ET.fromstring(svg).iter()))
+    assert n_elements(render_svg(model)) > n_elements(render_svg(model, show_unnamed=False))
+
+
+def test_svg_escapes_names(rs_example):
+    model = rs_example._replace(named_points={"<A&B>": next(iter(rs_example.named_points.values()))})
+    assert "<A&B>" in [t.text for t in ET.fromstring(render_svg(model)).iter(f"{SVG}text")]
+
+
+def test_png_needs_cairosvg(rs_example):
+    try:
+        import cairosvg
+    except ImportError:
+        with pytest.raises(RuntimeError, match="cairosvg"):
+            svg_to_png(render_svg(rs_example))
+    else:
+        assert rs_example.to_png().startswith(b"\x89PNG")
+
+
+def test_finite():
+    assert finite({"a": [1.23456789, float("nan")], "b": float("-inf"), "c": 2}, 3) == {"a": [1.235, None], "b": None, "c": 2}
+
+
+def test_diagram_json(solve_lines):
+    [model] = solve_lines(["(param (A B C) triangle)", "(param D point)", "(assert (on-line D (line A B)))",
+                           "(assert (on-circ D (circumcircle A B C)))", "(eval (coll A B D))"])
+    d = diagram_json(model)
+    assert json.loads(json.dumps(d, allow_nan=False)) == d
+
+    assert set(d) == set(GEOMETRY_KEYS) | {"seg_colors", "ndgs", "goals"}
+    assert set(d["named_points"]) == {str(p) for p in model.named_points} == {"A", "B", "C", "D"}
+    assert all(d[k] for k in UNNAMED_KEYS[1:]) and list(d["goals"])
+    A = next(P for p, P in model.named_points.items() if str(p) == "A")
+    assert list(d["named_points"]["A"]) == [round(float(A.x), 6), round(float(A.y), 6)]
+
+    hidden = diagram_json(model, show_unnamed=False)
+    assert all(hidden[k] == [] for k in UNNAMED_KEYS)
+    assert {k: hidden[k] for k in ["named_points", "named_lines", "named_circles", "segments"]} == \
+           {k: d[k] for k in ["named_points", "named_lines", "named_circles", "segments"]}
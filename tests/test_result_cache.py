@@ -0,0 +1,94 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import json
+import os
+
+import pytest
+
+import builder
+from conftest import quiet_opts
+from ir import read_program
+from result_cache import IGNORED_OPTS, JsonCache, problem_key
+
+LINES = ["(param (A B C) triangle)", "(define M point (midp B C))"]
+
+
+def key(lines=LINES, **kwargs):
+    program = read_program(lines)
+    return problem_key(program.instructions, program, quiet_opts(**kwargs))
+
+
+def test_key_depends_on_problem_seed_and_options():
+    keys = [key(), key(["(param (A B C) triangle)", "(define M point (midp A C))"]),
+            key(seed=1), key(seed=None), key(n_models=2), key(learning_rate=0.2), key(backend="lm")]
+    assert len(set(keys)) == len(keys)
+    assert key() == key(["; the same problem", "(param (A B C)   triangle)", "(define M point", "  (midp B C))"])
+
+
+@pytest.mark.parametrize("opt", ["verbosity", "plot_freq", "loss_freq", "losses_freq", "progress_freq",
+                                 "unnamed_objects", "cache_dir", "cache_size", "jobs"])
+def test_key_ignores_output_options(opt):
+    assert opt in IGNORED_OPTS
+    assert key(**{opt: "changed"}) == key()
+
+
+@pytest.fixture
+def solve_calls(monkeypatch):
+    calls = list()
+
+    def solve_problem(opts, reader, listener=None):
+        calls.append(opts)
+        return real_solve_problem(opts, reader, listener)
+
+    real_solve_problem = builder.solve_problem
+    monkeypatch.setattr(builder, "solve_problem", solve_problem)
+    return calls
+
+
+def test_hit_skips_solving(tmp_path, solve_calls):
+    opts = quiet_opts(lines=LINES, cache=True, cache_dir=str(tmp_path))
+    first = builder.build(dict(opts), show_plot=False)
+    second = builder.build(dict(opts), show_plot=False)
+
+    assert len(solve_calls) == 1
+    assert len(first) == len(second) == 1
+    assert first[0].to_dict() == second[0].to_dict()
+
+
+def test_unseeded_solves_are_not_cached(tmp_path, solve_calls):
+    opts = quiet_opts(lines=LINES, cache=True, cache_dir=str(tmp_path), seed=None)
+    for _ in range(2):
+        builder.build(dict(opts), show_plot=False)
+    assert len(solve_calls) == 2
+
+
+def test_failures_are_not_cached(tmp_path, monkeypatch):
+    calls = list()
+    monkeypatch.setattr(builder, "solve_problem", lambda opts, reader, listener=None: calls.append(opts) or [])
+    opts = quiet_opts(lines=LINES, cache=True, cache_dir=str(tmp_path))
+    for _ in range(2):
+        assert builder.build(dict(opts), show_plot=False) == []
+    assert len(calls) == 2
+
+
+def test_evicts_least_recently_used(tmp_path):
+    data = {"x": "a" * 1000}
+    size = len(json.dumps(data))
+
+    # Room for two entries but not three
+    cache = JsonCache(str(tmp_path), 2.5 * size / (1024 * 1024))
+    cache.put_json("a", data)
+    cache.put_json("b", data)
+    os.utime(cache.path("a"), (1000, 1000))
+    os.utime(cache.path("b"), (2000, 2000))
+
+    # Reading a makes b the least recently used
+    assert cache.get_json("a", lambda d: d) == data
+    cache.put_json("c", data)
+
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+    assert cache.get_json("b", lambda d: d) is None
@@ -0,0 +1,60 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import pytest
+
+from instruction import Assert, Sample
+from ir import read_program
+from rewrite import rewrite
+
+
+TWO_TRIANGLES = [
+    "(param (A B C) triangle)",
+    "(param (D E F) triangle)",
+    "(assert (cong A B A C))",
+    "(assert (cong D E D F))",
+]
+
+
+def test_folds_each_triangle():
+    instructions = rewrite(read_program(TWO_TRIANGLES).instructions, verbosity=-1)
+    assert not any(isinstance(i, Assert) for i in instructions)
+    assert [(i.sampler, [str(a) for a in i.args]) for i in instructions] == [("iso-tri", ["A"]), ("iso-tri", ["D"])]
+
+
+def test_equilateral_through_second_apex():
+    lines = ["(param (A B C) triangle)", "(assert (cong A B C A))", "(assert (cong A B B C))"]
+    [sample] = rewrite(read_program(lines).instructions, verbosity=-1)
+    assert sample.sampler == "equi-tri"
+
+
+def test_keeps_assertions_it_cannot_fold():
+    lines = TWO_TRIANGLES[:2] + [
+        # Not about the sides of one triangle
+        "(assert (cong A B D E))",
+        # P is defined before the circle it would be parameterized on
+        "(param P point)",
+        "(param omega circle)",
+        "(assert (on-circ P omega))",
+    ]
+    instructions = rewrite(read_program(lines).instructions, verbosity=-1)
+    assert [str(i.constraint.pred) for i in instructions if isinstance(i, Assert)] == ["cong", "on-circ"]
+
+
+@pytest.mark.parametrize("backend", ["numpy", "lm"])
+def test_two_folded_triangles_solve(solve_lines, backend):
+    # Folded triangles must not be placed on top of each other
+    models = solve_lines(TWO_TRIANGLES, backend=backend, rewrite=True, n_models=2)
+    assert len(models) == 2
+    for m in models:
+        xys = {str(p): (float(P.x), float(P.y)) for p, P in m.named_points.items()}
+        assert len(set(xys.values())) == 6
+
+
+def test_fixed_base_triangles_solve(solve_lines):
+    lines = ["(param (A B C) (iso-tri A))", "(param (D E F) (iso-tri D))",
+             "(param (G H I) (right-tri G))", "(param (J K L) equi-tri)"]
+    assert len(solve_lines(lines, n_models=2)) == 2
@@ -0,0 +1,146 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import importlib.util
+import json
+import os
+import time
+
+import pytest
+
+import solver_pool
+from conftest import quiet_opts
+from solver_pool import JobTimeout, SolverPool, UnknownJob
+
+# Workers warm up on the default backend
+pytestmark = pytest.mark.skipif(importlib.util.find_spec("tensorflow") is None, reason="needs tensorflow")
+
+LINES = ["(param (A B C) triangle)", "(define M point (midp B C))"]
+
+# Never converges, so it runs until it times out
+ENDLESS = quiet_opts(lines=["(param (A B C) triangle)", "(assert (cong A B A C))"], eps=-1.0, n_iterations=10 ** 9)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SolverPool(1, timeout=60)
+    yield pool
+    pool.shutdown()
+
+
+def test_solve(pool):
+    diagrams = pool.solve(quiet_opts(lines=LINES))
+    assert len(diagrams) == 1 and diagrams[0].startswith("data:image/svg+xml")
+
+    models = pool.solve(quiet_opts(lines=LINES, n_models=2), "json")
+    assert len(models) == 2 and "seg_colors" in models[0]
+
+
+def test_submit_streams_events(pool):
+    job_id = pool.submit(quiet_opts(lines=LINES))
+    events = list(pool.events(job_id))
+
+    names = [event for event, _ in events]
+    assert names[0] == "status" and names[-1] == "done" and "model" in names
+    assert events[-1][1] == pool.status(job_id)
+    assert pool.status(job_id)["status"] == "done" and len(pool.status(job_id)["srcs"]) == 1
+
+
+def test_progress_is_streamed(pool):
+    job_id = pool.submit(quiet_opts(lines=["(param (A B C) triangle)", "(assert (cong A B A C))"], progress_freq=10))
+    progress = [data for event, data in pool.events(job_id) if event == "progress"]
+
+    iterations = [data for data in progress if data["event"] == "iteration"]
+    assert iterations and all(data["iteration"] % 10 == 0 for data in iterations)
+    assert pool.status(job_id)["progress"] == progress[-1]
+
+
+def test_errors_are_reported(pool):
+    with pytest.raises(RuntimeError):
+        pool.solve(quiet_opts(lines=["(param A point)", "(define B point (foo A))"]))
+    # The worker is still there
+    assert len(pool.solve(quiet_opts(lines=LINES))) == 1
+
+
+def test_unknown_jobs(pool):
+    with pytest.raises(UnknownJob):
+        pool.status("nope")
+    with pytest.raises(UnknownJob):
+        pool.events("nope")
+
+
+def test_finished_jobs_are_forgotten(pool, monkeypatch):
+    monkeypatch.setattr(solver_pool, "JOB_TTL", 0)
+    job_id = pool.submit(quiet_opts(lines=LINES))
+    assert list(pool.events(job_id))[-1][0] == "done"
+
+    deadline = time.time() + 10
+    while job_id in pool.all_jobs and time.time() < deadline:
+        time.sleep(0.1)
+    with pytest.raises(UnknownJob):
+        pool.status(job_id)
+
+
+def test_timeout_restarts_only_its_worker():
+    pool = SolverPool(2, timeout=2)
+    try:
+        slow = pool.submit(ENDLESS)
+        # Runs on the other worker while the first one is killed
+        assert len(pool.solve(quiet_opts(lines=LINES))) == 1
+
+        events = list(pool.events(slow))
+        assert events[-1][0] == "timeout"
+        with pytest.raises(JobTimeout):
+            pool.solve(ENDLESS)
+
+        assert len(pool.workers) == 2
+        for _ in range(3):
+            assert len(pool.solve(quiet_opts(lines=LINES))) == 1
+    finally:
+        pool.shutdown()
+
+
+def test_worker_that_exits_is_replaced(pool):
+    job_id = pool.submit(ENDLESS)
+    while pool.status(job_id)["status"] != "running":
+        time.sleep(0.1)
+    with pool.lock:
+        worker, = pool.workers.values()
+    worker.process.kill()
+
+    assert list(pool.events(job_id))[-1][0] == "error"
+    assert len(pool.solve(quiet_opts(lines=LINES))) == 1
+
+
+@pytest.fixture(scope="module")
+def client():
+    os.environ["GMB_N_WORKERS"] = "1"
+    pytest.importorskip("flask")
+    from app import app
+    return app.test_client()
+
+
+FORM = {"problem_input": "\n".join(LINES), "n_models": "1", "plot_unnamed": "false"}
+
+
+def test_routes(client):
+    response = client.post("/solve", data=FORM)
+    assert response.status_code == 200 and len(response.get_json()["srcs"]) == 1
+
+    response = client.post("/jobs", data=dict(FORM, format="json"))
+    assert response.status_code == 202
+    job_id = response.get_json()["id"]
+
+    stream = client.get(f"/jobs/{job_id}/events").get_data(as_text=True)
+    events = [block.split("\n") for block in stream.strip().split("\n\n")]
+    assert events[-1][0] == "event: done"
+    assert json.loads(events[-1][1][len("data: "):])["status"] == "done"
+    assert len(client.get(f"/jobs/{job_id}").get_json()["models"]) == 1
+
+
+def test_routes_unknown_jobs(client):
+    assert client.get("/jobs/nope").status_code == 404
+    assert client.get("/jobs/nope/events").status_code == 404
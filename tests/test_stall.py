@@ -0,0 +1,45 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import numpy as np
+
+from optimizer import StallDetector
+
+
+def detector(**kwargs):
+    return StallDetector(dict(dict(stall_window=3, stall_tol=0.1, grad_floor=0.0), **kwargs))
+
+
+def test_plateau_after_a_window_without_progress():
+    d = detector()
+    reasons = [d.check(loss) for loss in [10.0, 5.0, 4.9, 4.8, 4.8, 4.8]]
+    # The best loss is compared with the best one a window before: 4.8 is more than 10% better than 10.0,
+    # but not than 5.0
+    assert reasons == [None, None, None, None, "plateau", "plateau"]
+
+
+def test_no_plateau_while_improving():
+    d = detector()
+    assert all(d.check(loss) is None for loss in [10.0, 8.0, 6.0, 4.0, 2.0, 1.0])
+
+
+def test_disabled_by_default_window():
+    d = detector(stall_window=0)
+    assert all(d.check(1.0) is None for _ in range(10))
+
+
+def test_gradient_floor():
+    d = detector(stall_window=0, grad_floor=1e-3)
+    assert d.check(1.0, grad_norm=1e-2) is None
+    assert d.check(1.0, grad_norm=1e-4) == "gradient"
+
+
+def test_batched_reasons_per_try():
+    d = detector(grad_floor=1e-3)
+    for loss in [[10.0, 8.0, np.nan], [5.0, 8.0, np.nan], [4.0, 8.0, np.nan], [3.0, 8.0, np.nan]]:
+        d.check(np.array(loss), grad_norm=np.ones(3))
+    reasons = d.check(np.array([2.0, 7.9, np.nan]), grad_norm=np.array([1.0, 1.0, 1e-4]))
+    assert list(reasons) == [None, "plateau", "gradient"]
@@ -0,0 +1,59 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import collections
+
+from conftest import quiet_opts
+from ir import read_program
+from np_optimizer import NumpyOptimizer
+from optimizer import has_raw_val
+from primitives import Point
+from util import FuncInfo
+
+LINES = ["(param (A B C) triangle)", "(param D point)",
+         "(assert (cong D (midp A B) D C))", "(assert (coll C D (midp A B)))",
+         "(assert (on-circ D (circumcircle A B C)))", "(assert (on-circ C (circumcircle A B C)))"]
+
+
+def counting_solver(lines=LINES):
+    # A solver that counts how often each unnamed point and circle term is built
+    program = read_program(lines)
+    solver = NumpyOptimizer(program.instructions, quiet_opts(lines=lines), program.unnamed_points, program.unnamed_lines,
+                            program.unnamed_circles, program.segments, program.seg_colors)
+    solver.builds = collections.Counter()
+    build_pt, build_circ = solver.build_pt, solver.build_circ
+
+    def counted(build):
+        def count(term, *args):
+            # Raw values do not print
+            solver.builds["raw" if has_raw_val(term) else str(term)] += 1
+            return build(term, *args)
+        return count
+
+    solver.build_pt, solver.build_circ = counted(build_pt), counted(build_circ)
+    return solver
+
+
+def test_equal_terms_are_built_once():
+    solver = counting_solver()
+    solver.preprocess()
+    assert solver.builds == {"(midp A B)": 1, "(circumcircle A B C)": 1}
+
+    midp = Point(FuncInfo("midp", (Point("A"), Point("B"))))
+    assert solver.lookup_pt(midp) is solver.lookup_pt(Point(FuncInfo("midp", (Point("A"), Point("B")))))
+    assert solver.builds["(midp A B)"] == 1
+
+
+def test_raw_values_are_not_cached():
+    solver = counting_solver()
+    solver.preprocess()
+    n_cached = len(solver.term_cache)
+
+    raw = Point(FuncInfo("__val__", [solver.lookup_pt(Point("A"))]))
+    midp = Point(FuncInfo("midp", (raw, Point("B"))))
+    assert solver.lookup_pt(midp) is not solver.lookup_pt(midp)
+    # The midpoint and its raw argument, for each lookup
+    assert solver.builds["raw"] == 4 and len(solver.term_cache) == n_cached
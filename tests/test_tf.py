@@ -0,0 +1,178 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+import importlib.util
+import json
+import re
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from conftest import PROBLEMS, ROOT
+
+pytestmark = pytest.mark.skipif(importlib.util.find_spec("tensorflow") is None, reason="needs tensorflow")
+
+ISO_CONG = "(param (A B C) triangle)\n(param (D E F) triangle)\n(assert (cong A B A C))\n(assert (cong D E D F))\n"
+
+
+def run_cli(tmp_path, program, *args):
+    # A process that has used the tf backend cannot use tf2, so each run gets its own
+    if not program.endswith(".smt2"):
+        path = tmp_path / "problem.smt2"
+        path.write_text(program)
+        program = str(path)
+    out = subprocess.run([sys.executable, "builder_cli.py", "--problem", program, "--seed", "0",
+                          "--plot_freq", "-1", "--loss_freq", "-1", "--losses_freq", "-1", *args],
+                         cwd=f"{ROOT}/src", capture_output=True, text=True, timeout=600)
+    assert out.returncode == 0, out.stderr
+    found = re.search(r"Found (\d+) models", out.stdout)
+    return int(found.group(1)) if found else None, out.stderr
+
+
+# Run before the scripts of run_script, which build a solver with tf_solver and look inside it
+SCRIPT_PRELUDE = f"""
+import json, random, sys
+import numpy as np
+import tensorflow.compat.v1 as tf
+sys.path.insert(0, {ROOT + '/tests'!r})
+from conftest import quiet_opts
+from ir import compile_program
+from tf_optimizer import TfOptimizer
+
+tf.disable_v2_behavior()
+
+def tf_solver(lines, **kwargs):
+    # Set up like builder.solve, but in a new default graph, so that scripts can add to it
+    opts = quiet_opts(lines=lines, backend="tf", **kwargs)
+    random.seed(opts['seed'])
+    reader = compile_program(lines, opts)
+    tf.reset_default_graph()
+    graph = tf.get_default_graph()
+    tf.set_random_seed(opts['seed'])
+    solver = TfOptimizer(reader.instructions, opts, reader.unnamed_points, reader.unnamed_lines, reader.unnamed_circles,
+                         reader.segments, reader.seg_colors, graph)
+    solver.preprocess()
+    return solver
+"""
+
+
+def run_script(script):
+    # Runs the script in its own process, like run_cli, and returns the JSON it prints last
+    out = subprocess.run([sys.executable, "-c", SCRIPT_PRELUDE + textwrap.dedent(script)],
+                         cwd=f"{ROOT}/src", capture_output=True, text=True, timeout=600)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("args", [[], ["--check_numerics"], ["--in_graph"]])
+def test_graph_is_well_formed(tmp_path, args):
+    # Grappler complains about conds whose branches return their inputs unchanged
+    _, log = run_cli(tmp_path, f"{PROBLEMS}/IMO/IMO_2001_P1.smt2", "--backend", "tf", "--n_tries", "1", "--n_inits", "1",
+                     "--n_iterations", "20", *args)
+    assert "topological sort failed" not in log and "optimizer failed" not in log
+
+
+@pytest.mark.parametrize("args", [[], ["--in_graph"]])
+def test_in_graph_loop_finds_models(tmp_path, args):
+    n_found, _ = run_cli(tmp_path, ISO_CONG, "--backend", "tf", "--n_models", "2", *args)
+    assert n_found == 2
+
+
+@pytest.mark.parametrize("args", [[], ["--xla"]])
+def test_tf2_finds_models(tmp_path, args):
+    n_found, _ = run_cli(tmp_path, ISO_CONG, "--backend", "tf2", "--n_models", "2", *args)
+    assert n_found == 2
+
+
+def test_halving_starts_from_every_init_and_keeps_the_best():
+    # Never converges, so every round is run
+    rounds = run_script("""
+        solver = tf_solver(%r.splitlines(), halving=True, halving_budget=5, n_iterations=20,
+                           n_models=1, n_tries=1, n_inits=8, eps=-1.0)
+
+        # Each try is recorded with its start, its final loss, and the final loss of the try it resumes
+        tries, resumed = list(), dict()
+        key = lambda vals: b"".join(np.asarray(v).tobytes() for v in vals)
+        train, snapshot = solver.train, solver.snapshot
+
+        def logged_train(init_vals, start=0, stop=None):
+            loss = train(init_vals, start=start, stop=stop)
+            tries.append((start, float(loss), resumed.get(key(init_vals))))
+            return loss
+
+        def logged_snapshot():
+            vals = snapshot()
+            resumed[key(vals)] = tries[-1][1]
+            return vals
+
+        solver.train, solver.snapshot = logged_train, logged_snapshot
+        solver.solve()
+        print(json.dumps([[t for t in tries if t[0] == start] for start in [0, 5, 10]]))
+    """ % ISO_CONG)
+
+    first, second, third = rounds
+    assert len(first) == 8 and len(second) == 4 and len(third) == 2
+    assert sorted(resumed for _, _, resumed in second) == sorted(loss for _, loss, _ in first)[:4]
+    assert sorted(resumed for _, _, resumed in third) == sorted(loss for _, loss, _ in second)[:2]
+
+
+def test_screened_inits_are_sorted_with_nans_last():
+    losses = run_script("""
+        solver = tf_solver(%r.splitlines(), n_inits=12)
+
+        # Every third initialization blows up
+        replay_loss = solver.replay_loss
+        def with_nans(vals, batch_size=None):
+            loss = replay_loss(vals, batch_size)
+            return tf.where_v2(tf.equal(tf.range(batch_size) %% 3, 0), tf.cast(np.nan, loss.dtype), loss)
+
+        solver.replay_loss = with_nans
+        solver.freeze()
+        print(json.dumps([float(loss) for _, loss in solver.sorted_inits]))
+    """ % ISO_CONG)
+
+    assert len(losses) == 12
+    finite = [loss for loss in losses if loss == loss]
+    assert len(finite) == 8 and losses[:8] == finite == sorted(finite)
+
+
+def test_screen_matches_the_construction():
+    runs = run_script("""
+        runs = list()
+        for _ in range(2):
+            solver = tf_solver(open(%r).readlines(), n_inits=6)
+            solver.freeze()
+
+            # The loss of the construction itself, from each screened initialization
+            found = list()
+            for vals, loss in solver.sorted_inits:
+                solver.restore(vals)
+                found.append([float(loss), float(solver.run(solver.loss))])
+            runs.append(found)
+        print(json.dumps(runs))
+    """ % f"{PROBLEMS}/IMO/IMO_2001_P1.smt2")
+
+    assert runs[0] == runs[1]
+    for screened, constructed in runs[0]:
+        assert screened == pytest.approx(constructed, rel=1e-9, abs=1e-12)
+
+
+def test_batched_models_satisfy_their_goals():
+    results = run_script("""
+        lines = ["(param (A B C) triangle)", "(param D point)", "(assert (cong A B A C))", "(assert (on-seg D B C))",
+                 "(assert (cong D B D C))", "(eval (coll B C D))"]
+        solver = tf_solver(lines, batched=True, n_models=2, n_inits=20)
+        models = solver.solve()
+
+        solver.opts['enforce_goals'] = True
+        print(json.dumps([[float(v) for v in m.goals.values()] + [bool(solver.satisfies_goals(m.goals))] for m in models]))
+    """)
+
+    assert len(results) == 2
+    for *goals, satisfied in results:
+        assert goals and satisfied
@@ -0,0 +1,38 @@
+"""
+Copyright (c) 2020 Ryan Krueger. All rights reserved.
+Released under Apache 2.0 license as described in the file LICENSE.
+Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
+"""
+
+from types import SimpleNamespace
+
+from conftest import quiet_opts
+from diagram import Coords
+from optimizer import Optimizer
+
+
+# Validation only needs the options, not a backend
+def validator(**kwargs):
+    return SimpleNamespace(opts=quiet_opts(**kwargs))
+
+
+def test_points_far_enough_away():
+    v = validator(min_dist=0.1)
+    assert Optimizer.points_far_enough_away(v, {"A": Coords(0.0, 0.0), "B": Coords(1.0, 0.0), "C": Coords(0.0, 1.0)})
+    assert not Optimizer.points_far_enough_away(v, {"A": Coords(0.0, 0.0), "B": Coords(1.0, 0.0), "C": Coords(1.05, 0.0)})
+    assert Optimizer.points_far_enough_away(v, {"A": Coords(0.0, 0.0)})
+
+
+def test_satisfies_goals():
+    assert Optimizer.satisfies_goals(validator(enforce_goals=False), {"g": 1.0})
+    v = validator(enforce_goals=True, eps=1e-3)
+    assert Optimizer.satisfies_goals(v, {"g": 1e-3, "h": 0.0})
+    assert not Optimizer.satisfies_goals(v, {"g": 1e-3, "h": 1.0})
+    assert Optimizer.satisfies_goals(v, {})
+
+
+def test_solved_models_are_valid(solve_lines):
+    models = solve_lines(["(param (A B C) triangle)", "(param D point)", "(assert (on-seg D B C))"], n_models=3)
+    assert len(models) == 3
+    for m in models:
+        assert Optimizer.points_far_enough_away(validator(), {p: Coords(float(P.x), float(P.y)) for p, P in m.named_points.items()})